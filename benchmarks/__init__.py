@@ -0,0 +1,8 @@
+"""
+Benchmarks for the overhead of the decorators and generators and for their
+behaviour under contention.
+
+Run them with:
+
+    python -m benchmarks.run --output results.json
+"""
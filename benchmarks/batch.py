@@ -0,0 +1,50 @@
+"""
+Benchmarks of the throughput of creating rows one transaction per row and
+in the chunked transactions of a WriteBatch.
+"""
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+
+from db_utils.batch import WriteBatch
+from db_utils.transaction import read_committed_transactions
+
+from benchmarks.contention import delete_users
+
+
+def create_per_row(usernames):
+    """Create each user in its own transaction."""
+    for username in usernames:
+        for transaction_manager in read_committed_transactions():
+            with transaction_manager:
+                User.objects.create(username=username)
+
+
+def create_batched(usernames, chunk_size):
+    """Create the users in a WriteBatch."""
+    with WriteBatch(chunk_size=chunk_size) as batch:
+        for username in usernames:
+            batch.create(User, username=username)
+
+
+def run(rows=1000, chunk_size=100):
+    """
+    Create rows users per row and batched and return the rows per second.
+
+    Args:
+        rows (int): The number of users to create in each scenario.
+        chunk_size (int): The chunk size of the WriteBatch.
+    """
+    results = {}
+    usernames = ['batch_{0}'.format(index) for index in xrange(rows)]
+    for name, func in (
+        ('per_row', create_per_row),
+        ('batched', lambda usernames: create_batched(usernames, chunk_size)),
+    ):
+        delete_users()
+        started = default_timer()
+        func(usernames)
+        duration = default_timer() - started
+        results[name] = {'rows': rows, 'seconds': duration, 'throughput': rows / duration}
+    delete_users()
+    return results
@@ -0,0 +1,132 @@
+"""
+Benchmarks of throughput and latency when several threads run get_or_create
+for the same rows at the same time.
+
+Each thread calls get_or_create for the usernames hot_0, hot_1, ... in order,
+so all threads race to create every row and all but one of them get an
+IntegrityError, or on SQLite a locked database, which is retried.
+"""
+import threading
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+from django.db import connection, DatabaseError, transaction
+
+from db_utils.backoff import DecorrelatedJitterBackoff, ExponentialBackoff, FullJitterBackoff
+from db_utils.errors import MYSQL_ERRORS
+from db_utils.metrics import MetricsAggregator, add_collector, remove_collector
+from db_utils.transaction import commit_on_success_with_read_committed
+
+
+SCENARIOS = (
+    ('no_delay', {'delay': 0}),
+    ('constant', {'delay': 0.1}),
+    ('exponential', {'backoff': ExponentialBackoff(base=0.01, cap=0.2)}),
+    ('full_jitter', {'backoff': FullJitterBackoff(base=0.01, cap=0.2)}),
+    ('decorrelated_jitter', {'backoff': DecorrelatedJitterBackoff(base=0.01, cap=0.2)}),
+    ('key_lock', {'key': lambda username: username}),
+)
+
+
+def percentile(values, percent):
+    """
+    Return the percentile of a sorted list.
+    """
+    if not values:
+        return None
+    return values[int(round(percent / 100.0 * (len(values) - 1)))]
+
+
+class Worker(threading.Thread):
+    """
+    A thread which calls get_or_create for the hot rows.
+    """
+    def __init__(self, func, operations, start_event, **kwargs):
+        super(Worker, self).__init__(**kwargs)
+        self.func = func
+        self.operations = operations
+        self.start_event = start_event
+        self.latencies = []
+        self.errors = 0
+
+    def run(self):
+        self.start_event.wait()
+        try:
+            for index in xrange(self.operations):
+                started = default_timer()
+                try:
+                    self.func('hot_{0}'.format(index))
+                except DatabaseError:
+                    self.errors += 1
+                self.latencies.append(default_timer() - started)
+        finally:
+            connection.close()
+
+
+@transaction.commit_on_success
+def delete_users():
+    """Delete the rows created by the previous scenario."""
+    User.objects.all().delete()
+
+
+def run_scenario(kwargs, threads, operations, max_attempts):
+    """
+    Run one scenario and return its results.
+    """
+    @commit_on_success_with_read_committed(exceptions=MYSQL_ERRORS, max_attempts=max_attempts, **kwargs)
+    def get_or_create(username):
+        """Get or create a hot row."""
+        return User.objects.get_or_create(username=username)
+
+    delete_users()
+    aggregator = MetricsAggregator()
+    add_collector(aggregator)
+
+    start_event = threading.Event()
+    workers = [Worker(get_or_create, operations, start_event) for __ in xrange(threads)]
+    for worker in workers:
+        worker.start()
+    started = default_timer()
+    start_event.set()
+    for worker in workers:
+        worker.join()
+    duration = default_timer() - started
+
+    remove_collector(aggregator)
+    metrics = aggregator.snapshot().values()
+    latencies = sorted(latency for worker in workers for latency in worker.latencies)
+
+    return {
+        'threads': threads,
+        'operations': len(latencies),
+        'duration': duration,
+        'throughput': len(latencies) / duration,
+        'errors': sum(worker.errors for worker in workers),
+        'attempts': sum(function_metrics['attempts'] for function_metrics in metrics),
+        'retries': sum(function_metrics['retries'] for function_metrics in metrics),
+        'sleep': sum(function_metrics['sleep_duration']['sum'] for function_metrics in metrics),
+        'latency': {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else None,
+        },
+    }
+
+
+def run(threads=8, operations=50, max_attempts=5, names=None):
+    """
+    Run the scenarios and return a dict of results keyed by scenario name.
+
+    Args:
+        threads (int): The number of concurrent threads.
+        operations (int): The number of get_or_create calls per thread.
+        max_attempts (int): The max_attempts of the decorator.
+        names (list): The names of the scenarios to run. Defaults to all.
+    """
+    results = {}
+    for name, kwargs in SCENARIOS:
+        if names and name not in names:
+            continue
+        results[name] = run_scenario(kwargs, threads, operations, max_attempts)
+    return results
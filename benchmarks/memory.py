@@ -0,0 +1,81 @@
+"""
+Benchmarks of the memory retained by the retry generator while it waits for
+the next attempt.
+
+The block fails at the bottom of a deep call stack whose frames each hold a
+buffer. As long as the traceback of the failure is referenced, all of these
+frames and buffers stay alive.
+"""
+import gc
+import resource
+import types
+
+from django.db import IntegrityError
+
+from db_utils.log_policy import LogPolicy, NONE
+from db_utils.metrics import MetricsCollector, add_collector, remove_collector
+from db_utils.utils import exception_managers_until_success
+
+
+def fail_deep(depth, payload):
+    """Raise an IntegrityError at the bottom of depth frames."""
+    buffer = bytearray(payload)  # pylint: disable=unused-variable
+    if depth == 0:
+        raise IntegrityError()
+    fail_deep(depth - 1, payload)
+
+
+def count_live_objects():
+    """
+    Return the number of tracebacks and frames of the benchmark which are
+    alive and the size of the buffers they hold.
+    """
+    counts = {'tracebacks': 0, 'frames': 0, 'retained_bytes': 0}
+    for obj in gc.get_objects():
+        if isinstance(obj, types.TracebackType):
+            counts['tracebacks'] += 1
+        elif isinstance(obj, types.FrameType) and obj.f_code is fail_deep.__code__:
+            counts['frames'] += 1
+            counts['retained_bytes'] += len(obj.f_locals.get('buffer') or ())
+    return counts
+
+
+class SleepSnapshot(MetricsCollector):
+    """
+    Count the live objects when the generator is about to wait.
+    """
+    def __init__(self):
+        self.counts = None
+
+    def record_sleep(self, func_path, duration):
+        gc.collect()
+        self.counts = count_live_objects()
+
+
+def run(depth=200, payload=10000):
+    """
+    Fail the first of two attempts at depth and return the objects which are
+    alive while waiting for the second one.
+
+    Args:
+        depth (int): The depth of the call stack of the failure.
+        payload (int): The size of the buffer held by each frame.
+    """
+    snapshot = SleepSnapshot()
+    add_collector(snapshot)
+    try:
+        for exception_manager in exception_managers_until_success(
+            exceptions_to_retry=(IntegrityError,), delay=0.001, max_attempts=2, log_policy=LogPolicy(retries=NONE),
+        ):
+            with exception_manager:
+                if exception_manager.attempt == 1:
+                    fail_deep(depth, payload)
+    finally:
+        remove_collector(snapshot)
+
+    counts = snapshot.counts
+    counts.update({
+        'depth': depth,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
+    return counts
@@ -0,0 +1,101 @@
+"""
+Benchmarks of the per-call overhead of the decorators and generators when
+no exceptions are raised.
+"""
+from timeit import default_timer
+
+from django.db import transaction, IntegrityError
+
+from db_utils.transaction import (
+    DATABASE_EXCEPTIONS, commit_on_success_with_read_committed, commit_on_success_with_repeatable_read,
+    read_committed_transactions, repeatable_read_transactions, savepoint_transactions,
+)
+from db_utils.utils import ExceptionManager, exception_managers_until_success
+
+
+def do_nothing():
+    """Just return."""
+    return
+
+
+def run_commit_on_success():
+    """Run an empty block in commit_on_success."""
+    with transaction.commit_on_success():
+        pass
+
+
+def generator_benchmark(generator, **kwargs):
+    """
+    Return a function which runs an empty block retried by generator.
+    """
+    def run():  # pylint: disable=missing-docstring
+        for manager in generator(**kwargs):
+            with manager:
+                pass
+    return run
+
+
+def retry_once():
+    """Run a block which fails once in exception_managers_until_success."""
+    failed = []
+    for exception_manager in exception_managers_until_success(exceptions_to_retry=DATABASE_EXCEPTIONS):
+        with exception_manager:
+            if not failed:
+                failed.append(True)
+                raise IntegrityError()
+
+
+BENCHMARKS = (
+    ('baseline.function_call', do_nothing),
+    ('baseline.commit_on_success', run_commit_on_success),
+    ('decorator.commit_on_success_with_read_committed', commit_on_success_with_read_committed()(do_nothing)),
+    ('decorator.commit_on_success_with_repeatable_read', commit_on_success_with_repeatable_read()(do_nothing)),
+    ('generator.read_committed_transactions', generator_benchmark(read_committed_transactions)),
+    ('generator.repeatable_read_transactions', generator_benchmark(repeatable_read_transactions)),
+    ('generator.savepoint_transactions', generator_benchmark(savepoint_transactions)),
+    (
+        'generator.exception_managers_until_success',
+        generator_benchmark(exception_managers_until_success, exceptions_to_retry=DATABASE_EXCEPTIONS),
+    ),
+    ('generator.exception_managers_until_success_retry', retry_once),
+    ('exception_manager.construction', lambda: ExceptionManager(DATABASE_EXCEPTIONS)),
+    (
+        'exception_manager.construction_with_context_manager',
+        lambda: ExceptionManager(DATABASE_EXCEPTIONS, None, transaction.commit_on_success),
+    ),
+)
+
+
+def measure(func, number, repeat):
+    """
+    Return the best time per call in seconds out of repeat runs of number
+    calls.
+    """
+    timings = []
+    for __ in xrange(repeat):
+        started = default_timer()
+        for __ in xrange(number):
+            func()
+        timings.append((default_timer() - started) / number)
+    return min(timings)
+
+
+def run(number=10000, repeat=5, names=None):
+    """
+    Run the benchmarks and return a dict of results keyed by benchmark name.
+
+    Args:
+        number (int): The number of calls per run.
+        repeat (int): The number of runs. The fastest is reported.
+        names (list): The names of the benchmarks to run. Defaults to all.
+    """
+    results = {}
+    for name, func in BENCHMARKS:
+        if names and name not in names:
+            continue
+        results[name] = {
+            'seconds_per_call': measure(func, number, repeat),
+            'number': number,
+            'repeat': repeat,
+        }
+    return results
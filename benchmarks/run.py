@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Run the benchmarks and write the results as JSON.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --compare results.json
+
+By default a file-backed SQLite database in a temporary directory is used.
+With --mysql the database from runtests.py is used.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+import django
+
+
+PARENT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sqlite_settings(directory, timeout):
+    """
+    Return the settings for a file-backed SQLite database.
+    """
+    return dict(
+        INSTALLED_APPS=(
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'db_utils',
+        ),
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(directory, 'benchmarks.sqlite3'),
+                'TEST_NAME': os.path.join(directory, 'test_benchmarks.sqlite3'),
+                'OPTIONS': {'timeout': timeout},
+            },
+        },
+    )
+
+
+def get_commit():
+    """
+    Return the current git commit or None.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=PARENT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Print the ratio of each result to the baseline.
+    """
+    for name, result in sorted(results['overhead'].items()):
+        if name in baseline.get('overhead', {}):
+            ratio = result['seconds_per_call'] / baseline['overhead'][name]['seconds_per_call']
+            print '{0:60} {1:10.2f}us {2:6.2f}x'.format(name, result['seconds_per_call'] * 1e6, ratio)
+
+    for name, result in sorted(results['contention'].items()):
+        if name in baseline.get('contention', {}):
+            base = baseline['contention'][name]
+            print '{0:60} {1:8.1f}/s {2:6.2f}x  p99 {3:6.2f}x'.format(
+                'contention.' + name, result['throughput'], result['throughput'] / base['throughput'],
+                result['latency']['p99'] / base['latency']['p99'],
+            )
+
+    for name, result in sorted(results['batch'].items()):
+        if name in baseline.get('batch', {}):
+            print '{0:60} {1:8.1f}/s {2:6.2f}x'.format(
+                'batch.' + name, result['throughput'], result['throughput'] / baseline['batch'][name]['throughput']
+            )
+
+    if results['memory'] and baseline.get('memory'):
+        print '{0:60} {1:10d}B {2:10d}B'.format(
+            'memory.retained_bytes', results['memory']['retained_bytes'], baseline['memory']['retained_bytes']
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='File to write the JSON results to. Defaults to stdout.')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with.')
+    parser.add_argument('--mysql', action='store_true', help='Use the MySQL database from runtests.py.')
+    parser.add_argument('--sqlite-timeout', type=float, default=0.05, help='Seconds SQLite waits for a lock.')
+    parser.add_argument('--number', type=int, default=10000, help='Calls per overhead run.')
+    parser.add_argument('--repeat', type=int, default=5, help='Overhead runs. The fastest is reported.')
+    parser.add_argument('--threads', type=int, default=8, help='Threads per contention scenario.')
+    parser.add_argument('--operations', type=int, default=50, help='Calls per thread and contention scenario.')
+    parser.add_argument('--max-attempts', type=int, default=5, help='max_attempts in the contention scenarios.')
+    parser.add_argument('--skip-overhead', action='store_true')
+    parser.add_argument('--skip-contention', action='store_true')
+    parser.add_argument('--skip-memory', action='store_true')
+    parser.add_argument('--skip-batch', action='store_true')
+    parser.add_argument('--rows', type=int, default=1000, help='Rows created per batch scenario.')
+    parser.add_argument('--chunk-size', type=int, default=100, help='Chunk size of the batch scenario.')
+    parser.add_argument('--depth', type=int, default=200, help='Call stack depth of the memory benchmark.')
+    parser.add_argument('benchmarks', nargs='*', help='Names of benchmarks or scenarios to run. Defaults to all.')
+    args = parser.parse_args()
+
+    sys.path.insert(0, PARENT)
+    directory = tempfile.mkdtemp()
+    try:
+        if args.mysql:
+            from runtests import DEFAULT_SETTINGS
+            settings.configure(**DEFAULT_SETTINGS)
+        else:
+            settings.configure(**sqlite_settings(directory, args.sqlite_timeout))
+        if hasattr(django, 'setup'):
+            django.setup()
+
+        # The warnings about isolation levels on SQLite and the retry logs
+        # would measure the log handlers.
+        logging.getLogger('db_utils').setLevel(logging.CRITICAL)
+
+        from django.db import connection
+        from benchmarks import batch, contention, memory, overhead
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = {
+                'meta': {
+                    'commit': get_commit(),
+                    'timestamp': time.time(),
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'vendor': connection.vendor,
+                    'arguments': vars(args),
+                },
+                'overhead': {},
+                'contention': {},
+                'memory': {},
+                'batch': {},
+            }
+            if not args.skip_overhead:
+                results['overhead'] = overhead.run(args.number, args.repeat, args.benchmarks)
+            if not args.skip_contention:
+                results['contention'] = contention.run(
+                    args.threads, args.operations, args.max_attempts, args.benchmarks
+                )
+            if not args.skip_memory:
+                results['memory'] = memory.run(args.depth)
+            if not args.skip_batch:
+                results['batch'] = batch.run(args.rows, args.chunk_size)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+    finally:
+        shutil.rmtree(directory)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+This module implements adaptive tuning of the retries of the transaction
+decorators.
+
+An AdaptiveRetry keeps statistics about the calls of each decorated function
+which were retried: how often retrying succeeded and how long the attempts
+which conflicted took. From these it tunes the number of attempts and scales
+the base delay of the backoff, within the bounds it is created with.
+
+    ADAPTIVE = AdaptiveRetry(min_attempts=1, max_attempts=5, max_scale=10)
+
+    @commit_on_success_with_read_committed(adaptive=ADAPTIVE)
+    def view(request):
+        ...
+
+- If retries almost never succeed the number of attempts is lowered, down to
+  min_attempts, so no work is wasted on retrying a function which will fail
+  anyway. If it is lowered to a single attempt, every probe_interval-th call
+  still retries once to notice when retrying helps again.
+- If retries mostly succeed but calls still run out of attempts the number of
+  attempts is raised again, up to max_attempts.
+- If a retry conflicts again the conflicts cluster and the delay is doubled,
+  up to max_scale times the base delay. If the first retry succeeds the delay
+  is lowered by decrease, down to min_scale times the base delay. The delay is
+  never scaled below the average duration of the conflicting attempts.
+
+The max_attempts passed to the decorator or configured for the function is
+the starting point of the tuning.
+"""
+from threading import Lock
+
+
+class FunctionStats(object):
+    """
+    The statistics and tuned options of one function.
+    """
+    def __init__(self, max_attempts):
+        self.max_attempts = max_attempts
+        self.scale = 1.0
+        self.retry_success_rate = 1.0
+        self.conflict_latency = None
+        self.calls = 0
+        self.retried_calls = 0
+        self.exhausted_calls = 0
+
+
+class AdaptiveRetry(object):
+    """
+    A thread-safe tuner of the retries of each function.
+    """
+    def __init__(self, min_attempts=1, max_attempts=5, min_scale=0.5, max_scale=10, decrease=0.9, alpha=0.1,
+                 low_success_rate=0.1, high_success_rate=0.5, sample_size=20, probe_interval=20):
+        """
+        Create the tuner.
+
+        Args:
+            min_attempts (int): The lowest number of attempts.
+            max_attempts (int): The highest number of attempts.
+            min_scale (float): The lowest factor of the base delay.
+            max_scale (float): The highest factor of the base delay.
+            decrease (float): The factor the delay is multiplied with when
+                the first retry succeeds.
+            alpha (float): The weight of the newest call in the moving
+                averages.
+            low_success_rate (float): The rate of successful retries below
+                which the number of attempts is lowered.
+            high_success_rate (float): The rate of successful retries above
+                which the number of attempts is raised if calls ran out of
+                attempts.
+            sample_size (int): The number of retried calls after which the
+                number of attempts is tuned.
+            probe_interval (int): The interval of the calls which retry once
+                although the number of attempts was lowered to one.
+        """
+        self.min_attempts = min_attempts
+        self.max_attempts = max_attempts
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.decrease = decrease
+        self.alpha = alpha
+        self.low_success_rate = low_success_rate
+        self.high_success_rate = high_success_rate
+        self.sample_size = sample_size
+        self.probe_interval = probe_interval
+        self.lock = Lock()
+        self.stats = {}
+
+    def get_stats(self, func_path, max_attempts):
+        """
+        Return the statistics of a function. Must be called with the lock held.
+        """
+        stats = self.stats.get(func_path)
+        if stats is None:
+            max_attempts = min(max(max_attempts, self.min_attempts), self.max_attempts)
+            stats = self.stats[func_path] = FunctionStats(max_attempts)
+        return stats
+
+    def get_options(self, func_path, max_attempts, base):
+        """
+        Return the number of attempts and the factor of the delays of the
+        next call of a function.
+
+        Args:
+            func_path (str): The path of the function.
+            max_attempts (int): The configured number of attempts.
+            base (float): The configured base delay.
+        """
+        with self.lock:
+            stats = self.get_stats(func_path, max_attempts)
+            stats.calls += 1
+            attempts = stats.max_attempts
+            if attempts == 1 and self.probe_interval and stats.calls % self.probe_interval == 0:
+                attempts = 2
+
+            scale = stats.scale
+            if base and stats.conflict_latency is not None:
+                scale = max(scale, min(stats.conflict_latency / base, self.max_scale))
+            return attempts, scale
+
+    def record_call(self, func_path, attempts, succeeded, conflict_durations):
+        """
+        Record a call which succeeded or raised a retriable exception.
+
+        Args:
+            func_path (str): The path of the function.
+            attempts (int): The number of attempts the call made.
+            succeeded (bool): Whether the last attempt succeeded.
+            conflict_durations (list): The durations of the attempts which
+                raised a retriable exception.
+        """
+        with self.lock:
+            stats = self.stats.get(func_path)
+            if stats is None:
+                return
+
+            for duration in conflict_durations:
+                stats.conflict_latency = self.average(stats.conflict_latency, duration)
+
+            if attempts == 1:
+                if not succeeded:
+                    stats.exhausted_calls += 1
+                return
+
+            stats.retried_calls += 1
+            stats.retry_success_rate = self.average(stats.retry_success_rate, 1.0 if succeeded else 0.0)
+            if not succeeded:
+                stats.exhausted_calls += 1
+
+            if attempts > 2:
+                stats.scale = min(stats.scale * 2, self.max_scale)
+            elif succeeded:
+                stats.scale = max(stats.scale * self.decrease, self.min_scale)
+
+            if stats.retried_calls >= self.sample_size:
+                if stats.retry_success_rate < self.low_success_rate:
+                    stats.max_attempts = max(stats.max_attempts - 1, self.min_attempts)
+                elif stats.retry_success_rate > self.high_success_rate and stats.exhausted_calls:
+                    stats.max_attempts = min(stats.max_attempts + 1, self.max_attempts)
+                stats.retried_calls = 0
+                stats.exhausted_calls = 0
+
+    def average(self, average, value):
+        """
+        Return the exponentially weighted moving average including value.
+        """
+        if average is None:
+            return value
+        return average + self.alpha * (value - average)
+
+    def snapshot(self):
+        """
+        Return the tuned options and statistics of all functions.
+        """
+        with self.lock:
+            return dict(
+                (func_path, {
+                    'max_attempts': stats.max_attempts,
+                    'scale': stats.scale,
+                    'retry_success_rate': stats.retry_success_rate,
+                    'conflict_latency': stats.conflict_latency,
+                })
+                for func_path, stats in self.stats.iteritems()
+            )
+
+    def reset(self):
+        """
+        Forget the statistics of all functions.
+        """
+        with self.lock:
+            self.stats.clear()
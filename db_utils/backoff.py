@@ -0,0 +1,162 @@
+"""
+This module implements backoff strategies which decide how long to wait
+between attempts of a retried block of code.
+
+A strategy object only holds configuration and can be shared between any
+number of decorators and generators. Each retry loop calls start() to get a
+BackoffSchedule which keeps the state of that loop (the previous delay and
+the time the loop started).
+"""
+import random
+import time
+
+
+class BackoffSchedule(object):
+    """
+    The state of a single retry loop.
+
+    Usage:
+        schedule = ExponentialBackoff(base=0.05, cap=1).start()
+        for attempt in xrange(1, max_attempts + 1):
+            ...
+            delay = schedule.next_delay(attempt)
+            if delay is None:
+                raise
+            time.sleep(delay)
+    """
+    def __init__(self, backoff, scale=1):
+        """
+        Create the schedule.
+
+        Args:
+            backoff (Backoff): The strategy which computes the delays.
+            scale (float): A factor the delays of the strategy are multiplied
+                with before they are capped, as if its base were scaled.
+        """
+        self.backoff = backoff
+        self.scale = scale
+        self.started = time.time()
+        self.previous = None
+
+    def next_delay(self, attempt):
+        """
+        Return the time to wait after the given attempt failed or None if the
+        deadline of the strategy does not allow another attempt.
+
+        Args:
+            attempt (int): The number of the attempt which failed, starting at 1.
+        """
+        delay = self.backoff.compute(attempt, self.previous) * self.scale
+        if self.backoff.cap is not None:
+            delay = min(delay, self.backoff.cap)
+        delay = max(delay, 0)
+
+        if self.backoff.deadline is not None:
+            if time.time() + delay - self.started > self.backoff.deadline:
+                return None
+
+        # The strategy computes from its own, unscaled delays.
+        self.previous = delay / self.scale if self.scale else delay
+        return delay
+
+
+class Backoff(object):
+    """
+    Base class of the backoff strategies.
+
+    Subclasses implement compute() which returns the uncapped delay after an
+    attempt.
+    """
+    def __init__(self, base=0.1, cap=None, deadline=None):
+        """
+        Create the strategy.
+
+        Args:
+            base (float): The delay the strategy starts from.
+            cap (float): The maximum time to wait between two attempts.
+            deadline (float): The maximum time, measured from the start of the
+                first attempt, after which no further attempt is made.
+        """
+        self.base = base
+        self.cap = cap
+        self.deadline = deadline
+
+    def compute(self, attempt, previous):
+        """
+        Return the delay after the given attempt.
+
+        Args:
+            attempt (int): The number of the attempt which failed, starting at 1.
+            previous (float): The previous delay or None after the first attempt.
+        """
+        raise NotImplementedError
+
+    def start(self, scale=1):
+        """
+        Return a new BackoffSchedule for a retry loop.
+
+        Args:
+            scale (float): A factor the delays are multiplied with.
+        """
+        return BackoffSchedule(self, scale)
+
+
+class ConstantBackoff(Backoff):
+    """
+    Wait base seconds between all attempts.
+    """
+    def compute(self, attempt, previous):
+        return self.base
+
+
+class LinearBackoff(Backoff):
+    """
+    Wait base, 2 * base, 3 * base, ... seconds.
+    """
+    def compute(self, attempt, previous):
+        return self.base * attempt
+
+
+class ExponentialBackoff(Backoff):
+    """
+    Wait base, base * factor, base * factor ** 2, ... seconds.
+    """
+    def __init__(self, base=0.1, cap=None, deadline=None, factor=2):
+        super(ExponentialBackoff, self).__init__(base=base, cap=cap, deadline=deadline)
+        self.factor = factor
+
+    def compute(self, attempt, previous):
+        return self.base * self.factor ** (attempt - 1)
+
+
+class FullJitterBackoff(ExponentialBackoff):
+    """
+    Wait a random time between 0 and the capped exponential delay.
+    """
+    def compute(self, attempt, previous):
+        delay = super(FullJitterBackoff, self).compute(attempt, previous)
+        if self.cap is not None:
+            delay = min(delay, self.cap)
+        return random.uniform(0, delay)
+
+
+class DecorrelatedJitterBackoff(Backoff):
+    """
+    Wait a random time between base and three times the previous delay.
+    """
+    def compute(self, attempt, previous):
+        if previous is None:
+            previous = self.base
+        return random.uniform(self.base, max(self.base, previous * 3))
+
+
+def get_backoff(backoff=None, delay=0):
+    """
+    Return backoff if it is set and a ConstantBackoff waiting delay seconds
+    otherwise.
+
+    This keeps the delay argument of the decorators and generators working.
+    """
+    if backoff is not None:
+        return backoff
+    return ConstantBackoff(base=delay)
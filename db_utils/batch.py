@@ -0,0 +1,209 @@
+"""
+This module implements batching of many small writes into few retried
+transactions.
+
+Wrapping every save() in its own transaction costs an isolation level SET,
+a BEGIN and a COMMIT, i.e. an fsync, per row. A WriteBatch collects the
+operations and runs them chunk_size at a time in one transaction of a retry
+generator:
+
+    with WriteBatch(chunk_size=500) as batch:
+        for row in rows:
+            batch.create(Event, user_id=row['user_id'], name=row['name'])
+            batch.get_or_create(Tag, name=row['tag'])
+
+If a chunk raises a retriable exception, only that chunk is retried. If it
+still fails, it is split in halves which are run on their own without
+retries, down to single operations, so a poison row only fails itself. Its exception is
+stored on its BatchOperation and the other chunks still run. Once all chunks
+ran, flush() raises a BatchError listing the failed operations.
+
+The chunks commit any open transactions like the generators they run in.
+"""
+import logging
+
+from django.db import DatabaseError
+
+from transaction import read_committed_transactions
+from utils import get_caller_path
+
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 100
+
+
+class BatchError(Exception):
+    """
+    Raised after a flush if some operations failed.
+    """
+    def __init__(self, failed):
+        super(BatchError, self).__init__('{0} operations failed.'.format(len(failed)))
+        self.failed = failed
+
+
+class BatchOperation(object):
+    """
+    A call queued in a WriteBatch, and its result once it is committed.
+    """
+    __slots__ = ('func', 'args', 'kwargs', 'result', 'exception', 'done')
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.exception = None
+        self.done = False
+
+    def run(self):
+        """
+        Call the function of the operation and return its result.
+        """
+        return self.func(*self.args, **self.kwargs)
+
+
+class WriteBatch(object):
+    """
+    A queue of write operations which are run in chunked transactions.
+
+    It is not thread-safe. Each thread should use its own batch.
+    """
+    def __init__(
+        self, chunk_size=CHUNK_SIZE, transactions=read_committed_transactions, using=None, auto_flush=True,
+        bisect_exceptions=(DatabaseError,), func_path=None, **kwargs
+    ):
+        """
+        Create the batch.
+
+        Args:
+            chunk_size (int): The number of operations run in one transaction.
+            transactions (function): The generator the chunks are run with,
+                e.g. read_committed_transactions or
+                repeatable_read_transactions. It decides the isolation level.
+            using (str): The database alias of the operations.
+            auto_flush (bool): Run a chunk as soon as chunk_size operations
+                are queued, instead of when flush() is called.
+            bisect_exceptions (tuple): The exceptions which make a failing
+                chunk be split to find the failing operations. Other
+                exceptions are raised, leaving the operations which were not
+                committed in the queue. The halves of a split chunk are
+                not retried on them.
+            func_path (str): The path the options are overridden and the
+                attempts are reported under. Defaults to the function
+                creating the batch.
+            kwargs: The retry options passed to transactions, e.g.
+                exceptions_to_retry, max_attempts or backoff.
+        """
+        self.chunk_size = chunk_size
+        self.transactions = transactions
+        self.using = using
+        self.auto_flush = auto_flush
+        self.bisect_exceptions = bisect_exceptions
+        self.func_path = func_path or get_caller_path()
+        self.kwargs = kwargs
+        self.pending = []
+        self.failed = []
+
+    def add(self, func, *args, **kwargs):
+        """
+        Queue a call of func and return its BatchOperation.
+
+        The function may be called more than once, if its chunk is retried,
+        so it should only write to the database.
+        """
+        operation = BatchOperation(func, args, kwargs)
+        self.pending.append(operation)
+        if self.auto_flush and len(self.pending) >= self.chunk_size:
+            self.run_pending()
+        return operation
+
+    def get_manager(self, model):
+        """
+        Return the manager of a model on the database of the batch.
+        """
+        if self.using is None:
+            return model._default_manager  # pylint: disable=protected-access
+        return model._default_manager.db_manager(self.using)  # pylint: disable=protected-access
+
+    def create(self, model, **kwargs):
+        """
+        Queue creating an instance of model. The result is the instance.
+        """
+        return self.add(self.get_manager(model).create, **kwargs)
+
+    def update(self, model, values, **filters):
+        """
+        Queue updating the rows of model which match filters with the dict
+        of values. The result is the number of updated rows.
+        """
+        return self.add(lambda: self.get_manager(model).filter(**filters).update(**values))
+
+    def get_or_create(self, model, **kwargs):
+        """
+        Queue getting or creating an instance of model. The result is a tuple
+        of the instance and whether it was created.
+        """
+        return self.add(self.get_manager(model).get_or_create, **kwargs)
+
+    def flush(self):
+        """
+        Run all queued operations in chunks and raise a BatchError listing
+        the operations which failed since the last flush, including the ones
+        run by auto_flush.
+        """
+        self.run_pending()
+        failed, self.failed = self.failed, []
+        if failed:
+            raise BatchError(failed)
+
+    def run_pending(self):
+        """
+        Run all queued operations in chunks and add the ones which failed to
+        self.failed.
+        """
+        try:
+            while self.pending:
+                chunk = self.pending[:self.chunk_size]
+                self.run_chunk(chunk, self.failed)
+                del self.pending[:len(chunk)]
+        finally:
+            # Another exception may leave committed operations of a split
+            # chunk in the queue.
+            self.pending = [operation for operation in self.pending if not operation.done]
+
+    def run_chunk(self, operations, failed, split=False):
+        """
+        Run operations in a retried transaction, splitting them in halves if
+        they fail, and add the operations which failed on their own to failed.
+
+        The halves of a split chunk are attempted once, so a poison
+        operation is not retried at every level of the split.
+        """
+        kwargs = dict(self.kwargs, max_attempts=1) if split else self.kwargs
+        try:
+            for transaction_manager in self.transactions(using=self.using, func_path=self.func_path, **kwargs):
+                with transaction_manager:
+                    results = [operation.run() for operation in operations]
+        except self.bisect_exceptions as exception:
+            if len(operations) == 1:
+                log.warning('Batched operation %r failed: %r', operations[0].func, exception)
+                operations[0].exception = exception
+                operations[0].done = True
+                failed.append(operations[0])
+                return
+            middle = len(operations) // 2
+            self.run_chunk(operations[:middle], failed, True)
+            self.run_chunk(operations[middle:], failed, True)
+            return
+
+        for operation, result in zip(operations, results):
+            operation.result = result
+            operation.done = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.flush()
@@ -0,0 +1,148 @@
+"""
+This module implements a circuit breaker for the transaction decorators.
+
+After failure_threshold consecutive retriable failures of a function within
+window seconds the circuit opens and calls raise CircuitOpenError without
+touching the database for cooldown seconds. Then the circuit is half open and
+a limited number of probe calls are let through. If a probe succeeds the
+circuit closes, if it fails the circuit opens again.
+
+    BREAKER = CircuitBreaker(failure_threshold=5, cooldown=30)
+
+    @commit_on_success_with_read_committed(breaker=BREAKER)
+    def view(request):
+        ...
+
+By default each decorated function has its own circuit. With by='alias' all
+functions using the same databases share one.
+"""
+from threading import Lock
+import time
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a function whose circuit is open.
+    """
+    pass
+
+
+class Circuit(object):
+    """
+    The state of one circuit.
+    """
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.first_failure = None
+        self.opened = None
+        self.probes = 0
+
+
+class CircuitBreaker(object):
+    """
+    A thread-safe circuit breaker which keeps one circuit per key.
+    """
+    def __init__(self, failure_threshold=5, window=60, cooldown=30, half_open_probes=1, by='func_path'):
+        """
+        Create the circuit breaker.
+
+        Args:
+            failure_threshold (int): The number of consecutive retriable
+                failures which open the circuit.
+            window (float): The time in seconds within which the failures
+                have to happen.
+            cooldown (float): The time in seconds a circuit stays open.
+            half_open_probes (int): The number of concurrent calls let
+                through while the circuit is half open.
+            by (str): 'func_path' to key the circuits by decorated function
+                or 'alias' to key them by database aliases.
+        """
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.half_open_probes = half_open_probes
+        self.by = by
+        self.lock = Lock()
+        self.circuits = {}
+
+    def get_key(self, func_path, aliases):
+        """
+        Return the key of the circuit of a call.
+        """
+        if self.by == 'alias':
+            return ','.join(aliases)
+        return func_path
+
+    def get_circuit(self, key):
+        """
+        Return the circuit of a key. Must be called with the lock held.
+        """
+        circuit = self.circuits.get(key)
+        if circuit is None:
+            circuit = self.circuits[key] = Circuit()
+        return circuit
+
+    def before_call(self, key):
+        """
+        Raise CircuitOpenError if the circuit of key does not let the call
+        through.
+        """
+        with self.lock:
+            circuit = self.get_circuit(key)
+            if circuit.state == OPEN:
+                if time.time() - circuit.opened < self.cooldown:
+                    raise CircuitOpenError('Circuit of {0} is open.'.format(key))
+                circuit.state = HALF_OPEN
+                circuit.probes = 0
+
+            if circuit.state == HALF_OPEN:
+                if circuit.probes >= self.half_open_probes:
+                    raise CircuitOpenError('Circuit of {0} is half open.'.format(key))
+                circuit.probes += 1
+
+    def record_success(self, key):
+        """
+        Close the circuit of key.
+        """
+        with self.lock:
+            circuit = self.get_circuit(key)
+            circuit.state = CLOSED
+            circuit.failures = 0
+            circuit.first_failure = None
+
+    def record_failure(self, key):
+        """
+        Record a retriable failure and return True if the circuit of key is
+        open afterwards.
+        """
+        with self.lock:
+            circuit = self.get_circuit(key)
+            now = time.time()
+
+            if circuit.state == HALF_OPEN:
+                circuit.state = OPEN
+                circuit.opened = now
+                return True
+
+            if circuit.first_failure is None or now - circuit.first_failure > self.window:
+                circuit.failures = 0
+                circuit.first_failure = now
+            circuit.failures += 1
+
+            if circuit.failures >= self.failure_threshold:
+                circuit.state = OPEN
+                circuit.opened = now
+            return circuit.state == OPEN
+
+    def get_state(self, key):
+        """
+        Return the state of the circuit of key.
+        """
+        with self.lock:
+            return self.get_circuit(key).state
@@ -0,0 +1,152 @@
+"""
+This module implements a retry budget which limits retries to a fraction of
+first attempts over a sliding window.
+
+When the database degrades every request retries, which multiplies the load
+at the worst moment. A budget shared by all decorators and generators makes
+them fail fast instead once retries exceed the budget:
+
+    RETRY_BUDGET = RetryBudget(ratio=0.1)
+
+    @commit_on_success_with_read_committed(budget=RETRY_BUDGET)
+    def view(request):
+        ...
+
+The budget is thread-safe. If path is given it is kept in a memory mapped
+file so that all worker processes using the same path share it.
+"""
+from threading import Lock
+import fcntl
+import mmap
+import os
+import struct
+import time
+
+
+class LocalCounters(object):
+    """
+    Counters of first attempts and retries per time slot, kept in memory.
+    """
+    def __init__(self, slots):
+        self.lock = Lock()
+        self.values = [0] * (3 * slots)
+
+    def update(self, func):
+        """
+        Call func with the list of values while holding the lock and return
+        its result. The list holds the epoch, first attempts and retries of
+        each slot.
+        """
+        with self.lock:
+            return func(self.values)
+
+
+class FileCounters(object):
+    """
+    Counters of first attempts and retries per time slot, kept in a memory
+    mapped file which is shared between processes.
+    """
+    def __init__(self, slots, path):
+        self.lock = Lock()
+        self.format = '<{0}q'.format(3 * slots)
+        self.size = struct.calcsize(self.format)
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < self.size:
+                os.ftruncate(self.fd, self.size)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.mmap = mmap.mmap(self.fd, self.size)
+
+    def update(self, func):
+        """
+        Call func with the list of values while holding the thread and file
+        locks, write the values back and return the result of func.
+        """
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                values = list(struct.unpack(self.format, self.mmap[:self.size]))
+                result = func(values)
+                self.mmap[:self.size] = struct.pack(self.format, *values)
+                return result
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def close(self):
+        """
+        Unmap and close the file.
+        """
+        self.mmap.close()
+        os.close(self.fd)
+
+
+class RetryBudget(object):
+    """
+    Allows at most min_retries + ratio * first attempts retries within the
+    sliding window.
+    """
+    def __init__(self, ratio=0.1, min_retries=10, window=10, slots=10, path=None):
+        """
+        Create the budget.
+
+        Args:
+            ratio (float): The fraction of first attempts which may be retried.
+            min_retries (int): The number of retries which are always allowed
+                within the window, so that low traffic can still retry.
+            window (float): The length of the sliding window in seconds.
+            slots (int): The number of slots the window is divided into.
+            path (str): A file to share the budget between processes.
+        """
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.slots = slots
+        self.slot_length = float(window) / slots
+        self.counters = FileCounters(slots, path) if path else LocalCounters(slots)
+
+    def current_slot(self, values):
+        """
+        Return the index of the current slot, clearing it if it is from an
+        earlier window.
+        """
+        epoch = int(time.time() / self.slot_length)
+        index = (epoch % self.slots) * 3
+        if values[index] != epoch:
+            values[index:index + 3] = [epoch, 0, 0]
+        return index
+
+    def totals(self, values):
+        """
+        Return the number of first attempts and retries within the window.
+        """
+        oldest = int(time.time() / self.slot_length) - self.slots
+        attempts = retries = 0
+        for index in xrange(0, len(values), 3):
+            if values[index] > oldest:
+                attempts += values[index + 1]
+                retries += values[index + 2]
+        return attempts, retries
+
+    def deposit(self):
+        """
+        Record a first attempt.
+        """
+        def deposit(values):  # pylint: disable=missing-docstring
+            values[self.current_slot(values) + 1] += 1
+        self.counters.update(deposit)
+
+    def withdraw(self):
+        """
+        Record a retry and return True if the budget allows it. Otherwise
+        return False.
+        """
+        def withdraw(values):  # pylint: disable=missing-docstring
+            index = self.current_slot(values)
+            attempts, retries = self.totals(values)
+            if retries >= self.min_retries + self.ratio * attempts:
+                return False
+            values[index + 2] += 1
+            return True
+        return self.counters.update(withdraw)
@@ -0,0 +1,174 @@
+"""
+This module implements claiming rows of a table used as a work queue.
+
+Workers polling the same rows with SELECT ... FOR UPDATE wait for each
+other's locks and deadlock. claim_rows() locks the rows with SELECT ...
+FOR UPDATE SKIP LOCKED where it is supported, so each worker skips the rows
+locked by the others, marks them as claimed and commits right away:
+
+    for job in claim_rows(Job.objects.filter(status='queued'), limit=10, claim={'status': 'running'}):
+        run(job)
+
+Elsewhere the candidate rows are read without locks and each one is claimed
+with an UPDATE which only matches it while it still matches the queryset
+and, if a version field is given, still has the version which was read. A
+row claimed by another worker in between is skipped.
+
+The claim has to make the rows stop matching the queryset, or they are
+claimed again.
+"""
+import time
+
+from django.db import connections
+from django.db.models import F
+
+from backoff import get_backoff
+from config import get_config
+from metrics import record_sleep
+from transaction import read_committed_transactions
+from utils import get_caller_path
+
+
+def skip_locked_supported(using):
+    """
+    Return whether the database using supports SELECT ... FOR UPDATE SKIP
+    LOCKED, i.e. MySQL 8, MariaDB 10.6 or PostgreSQL 9.5 and later.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        connection.cursor()
+        return connection.pg_version >= 90500
+    if connection.vendor == 'mysql':
+        connection.cursor()
+        if 'mariadb' in connection.connection.get_server_info().lower():
+            return connection.get_server_version() >= (10, 6)
+        return connection.get_server_version() >= (8, 0, 1)
+    return False
+
+
+def get_claim_values(claim, version_field):
+    """
+    Return the values of the UPDATE claiming rows.
+    """
+    values = dict(claim)
+    if version_field is not None:
+        values[version_field] = F(version_field) + 1
+    return values
+
+
+def set_claimed(obj, claim, version_field):
+    """
+    Set the claimed values on an instance.
+    """
+    for name, value in claim.iteritems():
+        setattr(obj, name, value)
+    if version_field is not None:
+        setattr(obj, version_field, getattr(obj, version_field) + 1)
+
+
+def claim_skip_locked(queryset, limit, claim, version_field):
+    """
+    Lock up to limit rows of the queryset skipping the locked ones, claim
+    them and return them.
+    """
+    sql, params = queryset[:limit].query.get_compiler(queryset.db).as_sql()
+    rows = list(queryset.model._default_manager.db_manager(queryset.db).raw(  # pylint: disable=protected-access
+        sql + ' FOR UPDATE SKIP LOCKED', params
+    ))
+    if rows:
+        queryset.model._default_manager.db_manager(queryset.db).filter(  # pylint: disable=protected-access
+            pk__in=[row.pk for row in rows]
+        ).update(**get_claim_values(claim, version_field))
+    for row in rows:
+        set_claimed(row, claim, version_field)
+    return rows
+
+
+def claim_optimistic(queryset, limit, claim, version_field):
+    """
+    Read up to limit rows of the queryset, claim the ones no other worker
+    claimed in between and return them, or None if there were no rows.
+    """
+    rows = list(queryset[:limit])
+    if not rows:
+        return None
+    claimed = []
+    for row in rows:
+        filters = {'pk': row.pk}
+        if version_field is not None:
+            filters[version_field] = getattr(row, version_field)
+        if queryset.filter(**filters).update(**get_claim_values(claim, version_field)):
+            set_claimed(row, claim, version_field)
+            claimed.append(row)
+    return claimed
+
+
+def claim_rows(queryset, limit=1, claim=None, version_field=None, **kwargs):
+    """
+    A generator which claims the rows of a queryset, limit rows at a time,
+    and yields them until no unclaimed rows are left.
+
+    Each batch is claimed in its own short READ COMMITTED transaction, which
+    is retried on transient errors, and the rows are yielded after it
+    committed. The rows are claimed in the order of the queryset, or of the
+    primary key if it is not ordered.
+
+    If other workers claimed all candidates of a batch, the next batch is
+    read after the delay or backoff of the retry options. The iteration
+    stops if the deadline of the backoff is exceeded.
+
+    Args:
+        queryset (QuerySet): The rows which can be claimed.
+        limit (int): The maximum number of rows claimed in one transaction.
+        claim (dict): The values set on the claimed rows. They have to make
+            the rows stop matching the queryset.
+        version_field (str): The name of an integer field which is
+            incremented by each claim. Where SKIP LOCKED is not supported
+            it is compared to detect rows claimed by other workers. Without
+            a claim the queryset has to filter on it.
+        kwargs: The retry options passed to read_committed_transactions,
+            e.g. exceptions_to_retry or max_attempts. using defaults to the
+            database of the queryset.
+
+    Usage:
+        for job in claim_rows(Job.objects.filter(status='queued'), limit=10, claim={'status': 'running'}):
+            run(job)
+    """
+    if not claim and version_field is None:
+        raise ValueError('A claim or a version_field is required to stop claimed rows matching the queryset.')
+    func_path = kwargs.pop('func_path', None) or get_caller_path()
+    kwargs.setdefault('using', queryset.db)
+    options = get_config().get_retry_options(
+        func_path, kwargs.get('exceptions_to_retry'), kwargs.get('delay'), kwargs.get('max_attempts'),
+        kwargs.get('backoff'), kwargs.get('log_policy'),
+    )
+    strategy = get_backoff(options.backoff, options.delay)
+    schedule = strategy.start()
+    lost_batches = 0
+    claim = claim or {}
+    if not queryset.ordered:
+        queryset = queryset.order_by('pk')
+    claim_batch = claim_skip_locked if skip_locked_supported(queryset.db) else claim_optimistic
+    while True:
+        for transaction_manager in read_committed_transactions(func_path=func_path, **kwargs):
+            with transaction_manager:
+                rows = claim_batch(queryset, limit, claim, version_field)
+
+        if not rows:
+            if rows is None or claim_batch is claim_skip_locked:
+                return
+            # Other workers claimed all the candidates.
+            lost_batches += 1
+            wait = schedule.next_delay(lost_batches)
+            if wait is None:
+                return
+            if wait:
+                record_sleep(func_path, wait)
+                time.sleep(wait)
+            continue
+
+        if lost_batches:
+            lost_batches = 0
+            schedule = strategy.start()
+        for row in rows:
+            yield row
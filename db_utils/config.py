@@ -0,0 +1,180 @@
+"""
+This module implements a frozen snapshot of the DB_UTILS_* settings.
+
+Looking up settings on Django's lazy settings object on every attempt is
+slow, in particular for settings which are not set. The settings are
+instead read once into a DBUtilsConfig, which is replaced when a setting
+changes, e.g. by override_settings in tests.
+
+The retry options of the decorators and generators which are not passed
+explicitly default to the config, and can be overridden per function
+without code changes:
+
+    DB_UTILS_MAX_ATTEMPTS = 3
+    DB_UTILS_BACKOFF = 'myapp.retries.BACKOFF'
+    DB_UTILS_OVERRIDES = {
+        'myapp.views.create_user': {'max_attempts': 5, 'delay': 0.2},
+    }
+
+Exceptions, backoffs and log policies can be given as objects or as dotted
+paths to them.
+"""
+from collections import namedtuple
+from importlib import import_module
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.test.signals import setting_changed
+
+from errors import get_classifier
+from log_policy import DEFAULT_LOG_POLICY
+
+
+DATABASE_EXCEPTIONS = (IntegrityError,)
+DELAY = 0.1
+MAX_ATTEMPTS = 3
+
+MAX_CACHED_OPTIONS = 1024
+
+RETRY_OPTIONS = ('exceptions', 'delay', 'max_attempts', 'backoff', 'log_policy')
+
+# The options which can be given as dotted paths.
+OBJECT_OPTIONS = ('exceptions', 'backoff', 'log_policy')
+
+# The name of each field of the config and its default.
+SETTINGS = (
+    ('DB_UTILS_ENABLE_TRANSACTIONS', 'enable_transactions', True),
+    ('DB_UTILS_SESSION_ISOLATION_LEVEL', 'session_isolation_level', True),
+    ('DB_UTILS_LOCK_DIRECTORY', 'lock_directory', None),
+    ('DB_UTILS_EXCEPTIONS', 'exceptions', DATABASE_EXCEPTIONS),
+    ('DB_UTILS_DELAY', 'delay', DELAY),
+    ('DB_UTILS_MAX_ATTEMPTS', 'max_attempts', MAX_ATTEMPTS),
+    ('DB_UTILS_BACKOFF', 'backoff', None),
+    ('DB_UTILS_LOG_POLICY', 'log_policy', DEFAULT_LOG_POLICY),
+    ('DB_UTILS_OVERRIDES', 'overrides', None),
+)
+
+
+RetryOptions = namedtuple('RetryOptions', RETRY_OPTIONS + ('classifier',))
+
+
+def load(name, value):
+    """
+    Return the object a dotted path points to if name is one of the
+    OBJECT_OPTIONS and value is a string, or value.
+    """
+    if name not in OBJECT_OPTIONS or not isinstance(value, basestring):
+        return value
+    module_path, __, name = value.rpartition('.')
+    return getattr(import_module(module_path), name)
+
+
+class DBUtilsConfig(object):
+    """
+    An immutable set of the tunables of db_utils.
+    """
+    __slots__ = tuple(field for __, field, __ in SETTINGS) + ('cache', 'cache_lock')
+
+    def __init__(self, **kwargs):
+        """
+        Create the config. Fields which are not given get their defaults.
+
+        Args:
+            enable_transactions (bool): If False the isolation levels are not
+                changed and no transactions are started.
+            session_isolation_level (bool): Set the isolation level per
+                session instead of per transaction.
+            lock_directory (str): The directory of the file locks.
+            exceptions (tuple): The default exceptions to retry, or an
+                ExceptionClassifier.
+            delay (float): The default time to wait between attempts.
+            max_attempts (int): The default number of attempts.
+            backoff (Backoff): The default backoff strategy.
+            log_policy (LogPolicy): The default log policy.
+            overrides (dict): Dicts of retry options keyed by the path
+                (module.function) of the functions they apply to.
+        """
+        for __, field, default in SETTINGS:
+            object.__setattr__(self, field, load(field, kwargs.pop(field, default)))
+        if kwargs:
+            raise TypeError('Unknown fields: {0}'.format(', '.join(sorted(kwargs))))
+
+        overrides = {}
+        for func_path, options in (self.overrides or {}).iteritems():
+            overrides[func_path] = dict((name, load(name, value)) for name, value in options.iteritems())
+        object.__setattr__(self, 'overrides', overrides)
+        object.__setattr__(self, 'cache', {})
+        object.__setattr__(self, 'cache_lock', threading.Lock())
+
+    def __setattr__(self, name, value):
+        raise AttributeError('DBUtilsConfig is immutable.')
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Create a config from the DB_UTILS_* settings.
+        """
+        return cls(**dict(
+            (field, getattr(settings, name)) for name, field, __ in SETTINGS if hasattr(settings, name)
+        ))
+
+    def get_retry_options(self, func_path, exceptions=None, delay=None, max_attempts=None, backoff=None,
+                          log_policy=None):
+        """
+        Return the RetryOptions of a function.
+
+        The overrides of the function take precedence over the options which
+        are passed, which take precedence over the defaults of the config.
+        Options which are None are not passed. The result is cached, as long
+        as not too many different combinations are requested.
+        """
+        key = (func_path, exceptions, delay, max_attempts, backoff, log_policy)
+        options = self.cache.get(key)
+        if options is not None:
+            return options
+
+        values = {}
+        overrides = self.overrides.get(func_path, {})
+        for name, value in zip(RETRY_OPTIONS, key[1:]):
+            if name in overrides:
+                values[name] = overrides[name]
+            elif value is not None:
+                values[name] = value
+            else:
+                values[name] = getattr(self, name)
+        options = RetryOptions(classifier=get_classifier(values['exceptions']), **values)
+
+        with self.cache_lock:
+            if len(self.cache) >= MAX_CACHED_OPTIONS:
+                self.cache.clear()
+            self.cache[key] = options
+        return options
+
+
+_config = None
+
+
+def get_config():
+    """
+    Return the current DBUtilsConfig.
+    """
+    global _config  # pylint: disable=global-statement
+    config = _config
+    if config is None:
+        config = _config = DBUtilsConfig.from_settings()
+    return config
+
+
+def reset_config(sender=None, setting=None, **kwargs):  # pylint: disable=unused-argument
+    """
+    Forget the current config so the next get_config() reads the settings.
+
+    This is connected to the setting_changed signal.
+    """
+    global _config  # pylint: disable=global-statement
+    if setting is None or setting.startswith('DB_UTILS_'):
+        _config = None
+
+
+setting_changed.connect(reset_config, dispatch_uid='db_utils.reset_config')
@@ -0,0 +1,172 @@
+"""
+This module implements classifiers which decide whether a block of code which
+raised an exception should be retried.
+
+A classifier can be passed wherever a tuple of exceptions to retry is
+accepted, e.g.:
+
+    @commit_on_success_with_read_committed(exceptions=MYSQL_ERRORS)
+    def view(request):
+        ...
+
+Deadlocks and lock wait timeouts are retried, lost connections are retried on
+a new connection and all other errors are raised immediately.
+"""
+from django.db import DatabaseError, IntegrityError
+
+
+# Actions returned by the classifiers.
+RETRY = 'retry'
+RECONNECT = 'reconnect'
+FAIL = 'fail'
+
+# MySQL server and client error codes.
+ER_DUP_ENTRY = 1062
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_LOCK_DEADLOCK = 1213
+CR_SERVER_GONE_ERROR = 2006
+CR_SERVER_LOST = 2013
+
+MYSQL_RETRY_CODES = frozenset([ER_DUP_ENTRY, ER_LOCK_WAIT_TIMEOUT, ER_LOCK_DEADLOCK])
+MYSQL_RECONNECT_CODES = frozenset([CR_SERVER_GONE_ERROR, CR_SERVER_LOST])
+
+# Error codes after which the whole transaction is rolled back or lost, and
+# with it its savepoints.
+MYSQL_TRANSACTION_LOST_CODES = frozenset([ER_LOCK_DEADLOCK]) | MYSQL_RECONNECT_CODES
+
+# SQLite does not have error codes.
+SQLITE_RETRY_MESSAGES = ('database is locked',)
+
+
+def get_error_code(exception):
+    """
+    Return the driver error code of an exception or None.
+
+    MySQLdb raises exceptions with the arguments (code, message) and Django
+    keeps them when it re-raises them as its own exceptions.
+    """
+    args = getattr(exception, 'args', ())
+    if args and isinstance(args[0], (int, long)):
+        return args[0]
+    return None
+
+
+class ExceptionClassifier(object):
+    """
+    A classifier which retries all instances of the given exceptions.
+
+    Subclasses override classify() to look at the exception itself.
+    """
+    def __init__(self, exceptions=()):
+        """
+        Create the classifier.
+
+        Args:
+            exceptions (tuple): The exceptions which are passed to classify().
+                All other exceptions are raised.
+        """
+        self.exceptions = exceptions
+
+    def classify(self, exception):
+        """
+        Return RETRY, RECONNECT or FAIL for an instance of one of
+        self.exceptions.
+        """
+        return RETRY
+
+
+class MySQLErrorClassifier(ExceptionClassifier):
+    """
+    A classifier which looks at the MySQL error codes.
+    """
+    def __init__(
+        self, exceptions=(DatabaseError,), retry_codes=MYSQL_RETRY_CODES, reconnect_codes=MYSQL_RECONNECT_CODES,
+        retry_exceptions=(IntegrityError,), retry_messages=SQLITE_RETRY_MESSAGES,
+    ):
+        """
+        Create the classifier.
+
+        Args:
+            exceptions (tuple): The exceptions to classify.
+            retry_codes (set): Error codes which are retried.
+            reconnect_codes (set): Error codes which are retried on a new
+                connection.
+            retry_exceptions (tuple): Exceptions without an error code which
+                are retried, e.g. IntegrityErrors raised by SQLite.
+            retry_messages (tuple): Messages of exceptions without an error
+                code which are retried.
+        """
+        super(MySQLErrorClassifier, self).__init__(exceptions)
+        self.retry_codes = retry_codes
+        self.reconnect_codes = reconnect_codes
+        self.retry_exceptions = retry_exceptions
+        self.retry_messages = retry_messages
+
+    def classify(self, exception):
+        code = get_error_code(exception)
+        if code is None:
+            if isinstance(exception, self.retry_exceptions):
+                return RETRY
+            for arg in getattr(exception, 'args', ()):
+                if isinstance(arg, basestring) and any(message in arg for message in self.retry_messages):
+                    return RETRY
+            return FAIL
+
+        if code in self.reconnect_codes:
+            return RECONNECT
+        if code in self.retry_codes:
+            return RETRY
+        return FAIL
+
+
+MYSQL_ERRORS = MySQLErrorClassifier()
+
+# Retries the errors which reads can raise, i.e. lock wait timeouts, deadlocks
+# and lost connections, but not duplicate entries.
+MYSQL_READ_ERRORS = MySQLErrorClassifier(
+    retry_codes=frozenset([ER_LOCK_WAIT_TIMEOUT, ER_LOCK_DEADLOCK]), retry_exceptions=(),
+)
+
+
+class SavepointClassifier(ExceptionClassifier):
+    """
+    A classifier for blocks run in savepoints, which raises the exceptions
+    after which the block cannot be retried in the same transaction.
+
+    A deadlock on MySQL rolls back the whole transaction, not only the
+    statement, and a lost connection loses the transaction, so there is no
+    savepoint left to roll back to.
+    """
+    def __init__(self, exceptions):
+        """
+        Create the classifier.
+
+        Args:
+            exceptions (tuple): A tuple of exceptions, which are retried if
+                the exception is an instance of exactly one of them, or an
+                ExceptionClassifier.
+        """
+        if isinstance(exceptions, ExceptionClassifier):
+            self.classifier = exceptions
+            exceptions = exceptions.exceptions
+        else:
+            self.classifier = None
+        super(SavepointClassifier, self).__init__(tuple(exceptions))
+
+    def classify(self, exception):
+        if get_error_code(exception) in MYSQL_TRANSACTION_LOST_CODES:
+            return FAIL
+        if self.classifier is None:
+            return RETRY if type(exception) in self.exceptions else FAIL
+        action = self.classifier.classify(exception)
+        return FAIL if action == RECONNECT else action
+
+
+def get_classifier(exceptions):
+    """
+    Return exceptions if it is a classifier and an ExceptionClassifier which
+    retries all the exceptions in the tuple otherwise.
+    """
+    if isinstance(exceptions, ExceptionClassifier):
+        return exceptions
+    return ExceptionClassifier(exceptions)
@@ -0,0 +1,279 @@
+"""
+This module implements a bounded pool of worker threads which runs database
+work and returns futures, and a timer thread which submits work after a
+delay.
+
+The retrying functions in utils and transaction which end in _async use it
+to run each attempt on a worker and to schedule the next attempt instead of
+sleeping, so the calling thread, e.g. the event loop of an asynchronous
+server, is never blocked by a query or a backoff:
+
+    future = read_committed_transactions_async(partial(create_user, username))
+    future.add_done_callback(lambda future: io_loop.add_callback(respond, future))
+
+Each attempt runs entirely on one worker thread and so on one database
+connection per alias. Workers keep their connections between attempts and
+close them when the executor is shut down.
+"""
+import heapq
+from itertools import count
+import logging
+import Queue
+import sys
+import threading
+import time
+
+from django.db import connections
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+
+
+class FutureTimeout(Exception):
+    """
+    Raised if the result of a Future is not available within the timeout.
+    """
+    pass
+
+
+class Future(object):
+    """
+    The result of work which runs in another thread.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.finished = False
+        self.value = None
+        self.exc_info = None
+        self.callbacks = []
+
+    def done(self):
+        """
+        Return True if the result or exception is set.
+        """
+        return self.finished
+
+    def set_result(self, value):
+        """
+        Set the result and call the callbacks.
+        """
+        self.finish(value, None)
+
+    def set_exception(self, exc_info):
+        """
+        Set the exception, as returned by sys.exc_info(), and call the
+        callbacks.
+        """
+        self.finish(None, exc_info)
+
+    def finish(self, value, exc_info):
+        """
+        Set the result or exception, wake up waiting threads and call the
+        callbacks.
+        """
+        with self.condition:
+            self.value = value
+            self.exc_info = exc_info
+            self.finished = True
+            self.condition.notify_all()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            self.run_callback(callback)
+
+    def run_callback(self, callback):
+        """
+        Call a callback with the future and log its exceptions.
+        """
+        try:
+            callback(self)
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Error in callback of %s.', self)
+
+    def add_done_callback(self, callback):
+        """
+        Call callback with the future once it is done. It is called in the
+        thread which finishes the future, or right away if it is done.
+        """
+        with self.condition:
+            if not self.finished:
+                self.callbacks.append(callback)
+                return
+        self.run_callback(callback)
+
+    def wait(self, timeout=None):
+        """
+        Wait until the future is done or raise FutureTimeout.
+        """
+        with self.condition:
+            if not self.finished:
+                self.condition.wait(timeout)
+            if not self.finished:
+                raise FutureTimeout()
+
+    def result(self, timeout=None):
+        """
+        Wait for and return the result, or raise the exception.
+        """
+        self.wait(timeout)
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+
+    def exception(self, timeout=None):
+        """
+        Wait for and return the exception, or None.
+        """
+        self.wait(timeout)
+        return self.exc_info[1] if self.exc_info is not None else None
+
+
+class TransactionExecutor(object):
+    """
+    A bounded pool of worker threads and a timer thread.
+
+    The threads are started on first use and are daemon threads.
+    """
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Create the executor.
+
+        Args:
+            max_workers (int): The number of worker threads and so the
+                maximum number of concurrent database connections per alias.
+        """
+        self.max_workers = max_workers
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.workers = []
+        self.timer = None
+        self.timers = []
+        self.sequence = count()
+        self.stopped = False
+
+    def start(self):
+        """
+        Start the threads if they are not running. Must hold self.lock.
+        """
+        if self.stopped:
+            raise RuntimeError('The executor is shut down.')
+        if not self.workers:
+            for __ in xrange(self.max_workers):
+                worker = threading.Thread(target=self.run_worker, name='db_utils-worker')
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+            self.timer = threading.Thread(target=self.run_timer, name='db_utils-timer')
+            self.timer.daemon = True
+            self.timer.start()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run func on a worker and return a Future of its result.
+        """
+        future = Future()
+        self.call_later(0, self.run_future, future, func, args, kwargs)
+        return future
+
+    def call_later(self, delay, func, *args, **kwargs):
+        """
+        Call func on a worker after delay seconds.
+
+        The keyword argument future is a Future which is failed if the call
+        is dropped by shutdown().
+        """
+        future = kwargs.pop('future', None)
+        with self.lock:
+            self.start()
+            if delay <= 0:
+                self.queue.put((func, args))
+                return
+            heapq.heappush(self.timers, (time.time() + delay, next(self.sequence), func, args, future))
+            self.condition.notify()
+
+    @staticmethod
+    def run_future(future, func, args, kwargs):
+        """
+        Call func and set its result or exception on the future.
+        """
+        try:
+            result = func(*args, **kwargs)
+        except:
+            future.set_exception(sys.exc_info())
+        else:
+            future.set_result(result)
+
+    def run_worker(self):
+        """
+        Run submitted calls until shutdown.
+        """
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                func, args = item
+                try:
+                    func(*args)
+                except Exception:  # pylint: disable=broad-except
+                    log.exception('Error in %s.', func)
+        finally:
+            for connection in connections.all():
+                connection.close()
+
+    def run_timer(self):
+        """
+        Move due calls to the queue of the workers until shutdown.
+        """
+        with self.lock:
+            while not self.stopped:
+                now = time.time()
+                while self.timers and self.timers[0][0] <= now:
+                    __, __, func, args, __ = heapq.heappop(self.timers)
+                    self.queue.put((func, args))
+                self.condition.wait(self.timers[0][0] - now if self.timers else None)
+
+    def shutdown(self, wait=True):
+        """
+        Stop the threads after the queued calls. Calls which are scheduled
+        for later are dropped and their futures fail with a RuntimeError.
+
+        Args:
+            wait (bool): Wait for the threads to finish.
+        """
+        with self.lock:
+            self.stopped = True
+            self.condition.notify()
+            workers = self.workers
+            dropped, self.timers = self.timers, []
+        for __, __, __, __, future in dropped:
+            if future is not None:
+                try:
+                    raise RuntimeError('The executor was shut down before the call.')
+                except RuntimeError:
+                    future.set_exception(sys.exc_info())
+        for __ in workers:
+            self.queue.put(None)
+        if wait:
+            for worker in workers:
+                worker.join()
+            if self.timer is not None:
+                self.timer.join()
+
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_executor():
+    """
+    Return the executor shared by the _async functions which are not given
+    one.
+    """
+    global _default_executor  # pylint: disable=global-statement
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = TransactionExecutor()
+        return _default_executor
@@ -0,0 +1,258 @@
+"""
+This module implements a fault injector for testing and load testing the
+retry machinery without a contended database.
+
+While a FaultInjector is installed, every cursor created by Django raises
+the configured errors instead of executing matching statements:
+
+    with FaultInjector(seed=42) as injector:
+        # Deadlock the first two INSERTs of create_user, then let them pass.
+        injector.add([DEADLOCK, DEADLOCK, None], func_path='myapp.views.create_user', sql=r'^INSERT')
+        # Lose the connection on one of ten statements of any function.
+        injector.add(DISCONNECT, probability=0.1)
+        create_user(request)
+
+The errors look like the ones MySQL raises, so MYSQL_ERRORS classifies them
+like real ones, on any database. A rule matches a statement if its
+func_path (module.function) is on the call stack of the statement, e.g. the
+decorated function or the function iterating over a generator, and if its
+sql pattern matches the statement. The rules are tried in the order they
+were added and the first matching one decides.
+
+The injector is meant for tests. It wraps the cursors of all connections of
+the process and inspects the call stack of every statement.
+"""
+from collections import defaultdict
+import random
+import re
+import sys
+import threading
+
+from django.db import DatabaseError, IntegrityError
+from django.db.backends import BaseDatabaseWrapper
+from django.db.backends.util import CursorWrapper
+
+from errors import CR_SERVER_GONE_ERROR, ER_DUP_ENTRY, ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT
+
+
+INTEGRITY_ERROR = 'integrity_error'
+DEADLOCK = 'deadlock'
+LOCK_WAIT_TIMEOUT = 'lock_wait_timeout'
+DISCONNECT = 'disconnect'
+
+# Functions creating the errors of the named faults.
+FAULTS = {
+    INTEGRITY_ERROR: lambda: IntegrityError(ER_DUP_ENTRY, 'Duplicate entry (injected)'),
+    DEADLOCK: lambda: DatabaseError(
+        ER_LOCK_DEADLOCK, 'Deadlock found when trying to get lock; try restarting transaction (injected)'
+    ),
+    LOCK_WAIT_TIMEOUT: lambda: DatabaseError(
+        ER_LOCK_WAIT_TIMEOUT, 'Lock wait timeout exceeded; try restarting transaction (injected)'
+    ),
+    DISCONNECT: lambda: DatabaseError(CR_SERVER_GONE_ERROR, 'MySQL server has gone away (injected)'),
+}
+
+_injector = None
+
+
+def get_exception(fault):
+    """
+    Return the exception to raise for a fault, which is the name of one of
+    the FAULTS, an exception class or an exception.
+    """
+    if isinstance(fault, basestring):
+        return FAULTS[fault]()
+    if isinstance(fault, type):
+        return fault()
+    return fault
+
+
+def get_stack_paths(frame):
+    """
+    Return the set of the paths (module.function) of the functions on the
+    call stack of frame.
+    """
+    paths = set()
+    while frame is not None:
+        paths.add('{0}.{1}'.format(frame.f_globals.get('__name__'), frame.f_code.co_name))
+        frame = frame.f_back
+    return paths
+
+
+class FaultRule(object):
+    """
+    Decides which statements fail and with which faults.
+    """
+    def __init__(self, faults, func_path=None, sql=None, probability=1.0, max_faults=None):
+        """
+        Create the rule.
+
+        Args:
+            faults: A fault, i.e. the name of one of the FAULTS, an exception
+                class or an exception, or a list of faults and Nones. The
+                items of a list are used by the matching statements one
+                after another, None lets a statement pass. Once the list is
+                used up the rule does not match anymore.
+            func_path (str): The path of a function which has to be on the
+                call stack, or None to match all statements.
+            sql (str): A regular expression which has to match the
+                statement, or None.
+            probability (float): The probability with which a single fault
+                is raised.
+            max_faults (int): The number of faults after which the rule does
+                not match anymore, or None.
+        """
+        self.sequence = list(faults) if isinstance(faults, (list, tuple)) else None
+        self.fault = None if self.sequence is not None else faults
+        self.func_path = func_path
+        self.sql = re.compile(sql) if sql is not None else None
+        self.probability = probability
+        self.max_faults = max_faults
+        self.matched = 0
+        self.injected = 0
+
+    def exhausted(self):
+        """
+        Return True if the rule does not inject any more faults.
+        """
+        if self.max_faults is not None and self.injected >= self.max_faults:
+            return True
+        return self.sequence is not None and self.matched >= len(self.sequence)
+
+    def matches(self, sql, paths):
+        """
+        Return True if the rule applies to a statement.
+
+        Args:
+            sql (str): The statement.
+            paths (set): The paths of the functions on its call stack.
+        """
+        if self.exhausted():
+            return False
+        if self.func_path is not None and self.func_path not in paths:
+            return False
+        return self.sql is None or self.sql.search(sql) is not None
+
+    def next_fault(self, rng):
+        """
+        Return the fault of the next matching statement or None.
+        """
+        self.matched += 1
+        if self.sequence is not None:
+            fault = self.sequence[self.matched - 1]
+        elif rng.random() < self.probability:
+            fault = self.fault
+        else:
+            fault = None
+        if fault is not None:
+            self.injected += 1
+        return fault
+
+
+class FaultInjectingCursorWrapper(CursorWrapper):
+    """
+    A cursor which asks the installed FaultInjector before executing a
+    statement.
+    """
+    def execute(self, sql, params=()):
+        inject(sql)
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        inject(sql)
+        return self.cursor.executemany(sql, param_list)
+
+
+class FaultInjector(object):
+    """
+    A thread-safe set of FaultRules which is installed process wide.
+    """
+    def __init__(self, seed=None):
+        """
+        Create the injector.
+
+        Args:
+            seed: The seed of the random numbers deciding whether a fault
+                with a probability is raised. Together with a single thread
+                this makes the faults deterministic.
+        """
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.rules = []
+        self.injected = defaultdict(int)
+        self.cursor = None
+
+    def add(self, faults, func_path=None, sql=None, probability=1.0, max_faults=None):
+        """
+        Add a FaultRule and return it. The arguments are those of FaultRule.
+        """
+        rule = FaultRule(faults, func_path, sql, probability, max_faults)
+        with self.lock:
+            self.rules.append(rule)
+        return rule
+
+    def clear(self):
+        """
+        Remove all rules and forget the injected faults.
+        """
+        with self.lock:
+            self.rules = []
+            self.injected = defaultdict(int)
+
+    def get_fault(self, sql, paths):
+        """
+        Return the fault to raise for a statement or None.
+        """
+        with self.lock:
+            for rule in self.rules:
+                if rule.matches(sql, paths):
+                    fault = rule.next_fault(self.random)
+                    if fault is not None:
+                        self.injected[fault] += 1
+                    return fault
+        return None
+
+    def install(self):
+        """
+        Wrap the cursors of all connections. Only one injector can be
+        installed at a time.
+        """
+        global _injector  # pylint: disable=global-statement
+        if _injector is not None:
+            raise RuntimeError('A FaultInjector is already installed.')
+        _injector = self
+        cursor = self.cursor = BaseDatabaseWrapper.__dict__['cursor']
+
+        def fault_injecting_cursor(connection):  # pylint: disable=missing-docstring
+            return FaultInjectingCursorWrapper(cursor(connection), connection)
+        BaseDatabaseWrapper.cursor = fault_injecting_cursor
+
+    def uninstall(self):
+        """
+        Restore the cursors of the connections.
+        """
+        global _injector  # pylint: disable=global-statement
+        if _injector is not self:
+            return
+        BaseDatabaseWrapper.cursor = self.cursor
+        _injector = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.uninstall()
+
+
+def inject(sql):
+    """
+    Raise the fault the installed FaultInjector decides on for a statement.
+    """
+    injector = _injector
+    if injector is None or not injector.rules:
+        return
+    # The frame of execute() is skipped along with this one.
+    fault = injector.get_fault(sql, get_stack_paths(sys._getframe(2)))  # pylint: disable=protected-access
+    if fault is not None:
+        raise get_exception(fault)
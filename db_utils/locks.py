@@ -0,0 +1,377 @@
+"""
+This module implements locks keyed by arbitrary values, in-process and
+across processes.
+
+If two threads of a process race to create the same row, one of them gets an
+IntegrityError, rolls back, waits and retries. Taking a lock on the unique key
+before the transaction lets the second thread wait for the first one to
+commit instead, after which it finds the row:
+
+    @commit_on_success_with_read_committed(key=lambda username: username)
+    def create_user(username):
+        return User.objects.get_or_create(username=username)
+
+The striped locks only serialize threads of the same process. Named locks
+serialize all processes using the same database server, with GET_LOCK on
+MySQL, advisory locks on PostgreSQL and file locks, which only cover one
+host, on other databases:
+
+    @commit_on_success_with_read_committed(lock_name=lambda username: 'user:' + username)
+    def create_user(username):
+        return User.objects.get_or_create(username=username)
+"""
+from contextlib import contextmanager
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+from threading import local, RLock
+import time
+
+from django.db import connections, transaction, DatabaseError, DEFAULT_DB_ALIAS
+
+from config import get_config
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_STRIPES = 256
+LOCK_TIMEOUT = 10
+MAX_LOCK_NAME_LENGTH = 64
+POLL_INTERVAL = 0.01
+MAX_POLL_INTERVAL = 0.1
+
+
+class StripedLock(object):
+    """
+    A fixed number of reentrant locks which keys are mapped to by their hash.
+
+    The memory used does not grow with the number of keys. Different keys
+    which map to the same stripe are serialized too, which only costs some
+    concurrency.
+    """
+    def __init__(self, stripes=DEFAULT_STRIPES):
+        """
+        Create the locks.
+
+        Args:
+            stripes (int): The number of locks.
+        """
+        self.locks = [RLock() for __ in xrange(stripes)]
+
+    def get(self, key):
+        """
+        Return the lock of a key, or None if the key is None.
+        """
+        if key is None:
+            return None
+        return self.locks[hash(key) % len(self.locks)]
+
+
+DEFAULT_LOCKS = StripedLock()
+
+
+@contextmanager
+def locked(lock, context_manager):
+    """
+    A context manager which holds a lock while in context_manager.
+
+    The lock is acquired before entering context_manager and released after
+    leaving it, so a transaction is committed before the next thread waiting
+    for the lock starts its own.
+    """
+    with lock:
+        with context_manager:
+            yield
+
+
+def locked_context_manager(lock, context_manager):
+    """
+    Return a function which creates a context_manager holding lock.
+
+    Args:
+        lock: A lock or None to not lock.
+        context_manager (function): A function which creates a context
+            manager.
+    """
+    if lock is None:
+        return context_manager
+    return lambda: locked(lock, context_manager())
+
+
+class LockTimeout(Exception):
+    """
+    Raised if a named lock could not be acquired within its timeout.
+    """
+    pass
+
+
+def get_lock_name(name):
+    """
+    Return a lock name which fits into the MySQL limit of 64 characters.
+
+    Longer names are replaced by their SHA-1 hash.
+    """
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    else:
+        name = str(name)
+    if len(name) <= MAX_LOCK_NAME_LENGTH:
+        return name
+    return 'db_utils:' + hashlib.sha1(name).hexdigest()
+
+
+def get_lock_key(name):
+    """
+    Return a signed 64 bit integer derived from a lock name, as used by the
+    PostgreSQL advisory lock functions.
+    """
+    return struct.unpack('>q', hashlib.sha1(name).digest()[:8])[0]
+
+
+def poll(try_acquire, timeout):
+    """
+    Call try_acquire until it returns True or timeout seconds have passed
+    and return the last result. A timeout of None waits forever.
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    interval = POLL_INTERVAL
+    while not try_acquire():
+        if deadline is not None and time.time() >= deadline:
+            return False
+        wait = interval if deadline is None else min(interval, max(deadline - time.time(), 0))
+        time.sleep(wait)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+    return True
+
+
+class MySQLLockBackend(object):
+    """
+    Named locks using GET_LOCK and RELEASE_LOCK.
+
+    Before MySQL 5.7 a session can hold only one of these locks. Acquiring
+    a second one releases the first.
+    """
+    def acquire(self, connection, name, timeout):
+        """
+        Acquire the lock and return a handle, or None on timeout.
+        """
+        cursor = connection.cursor()
+        cursor.execute('SELECT GET_LOCK(%s, %s)', [name, timeout if timeout is not None else -1])
+        if cursor.fetchone()[0] == 1:
+            return name
+        return None
+
+    def release(self, connection, handle):
+        """
+        Release the lock.
+        """
+        connection.cursor().execute('SELECT RELEASE_LOCK(%s)', [handle])
+
+
+class PostgreSQLLockBackend(object):
+    """
+    Named locks using session level advisory locks.
+
+    pg_advisory_lock has no timeout, so pg_try_advisory_lock is polled.
+    """
+    def acquire(self, connection, name, timeout):
+        """
+        Acquire the lock and return a handle, or None on timeout.
+        """
+        key = get_lock_key(name)
+        cursor = connection.cursor()
+
+        def try_acquire():  # pylint: disable=missing-docstring
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [key])
+            return cursor.fetchone()[0]
+
+        return key if poll(try_acquire, timeout) else None
+
+    def release(self, connection, handle):
+        """
+        Release the lock.
+        """
+        connection.cursor().execute('SELECT pg_advisory_unlock(%s)', [handle])
+
+
+class FileLockBackend(object):
+    """
+    Named locks using flock on files in a directory.
+
+    They only serialize processes on the same host. The directory is
+    DB_UTILS_LOCK_DIRECTORY or db_utils_locks in the temporary directory.
+    """
+    def get_path(self, name):
+        """
+        Return the path of the file of a lock.
+        """
+        directory = get_config().lock_directory or os.path.join(
+            tempfile.gettempdir(), 'db_utils_locks'
+        )
+        try:
+            os.makedirs(directory)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        return os.path.join(directory, hashlib.sha1(name).hexdigest() + '.lock')
+
+    def acquire(self, connection, name, timeout):  # pylint: disable=unused-argument
+        """
+        Acquire the lock and return a handle, or None on timeout.
+        """
+        fd = os.open(self.get_path(name), os.O_RDWR | os.O_CREAT, 0o666)
+
+        def try_acquire():  # pylint: disable=missing-docstring
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as error:
+                if error.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                return False
+            return True
+
+        try:
+            acquired = poll(try_acquire, timeout)
+        except:
+            os.close(fd)
+            raise
+        if not acquired:
+            os.close(fd)
+            return None
+        return fd
+
+    def release(self, connection, handle):  # pylint: disable=unused-argument
+        """
+        Release the lock.
+        """
+        try:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        finally:
+            os.close(handle)
+
+
+LOCK_BACKENDS = {
+    'mysql': MySQLLockBackend(),
+    'postgresql': PostgreSQLLockBackend(),
+}
+FILE_LOCK_BACKEND = FileLockBackend()
+
+_held_locks = local()
+
+
+def get_held_locks():
+    """
+    Return the named locks held by the current thread as a dict of
+    [count, backend, handle] lists keyed by alias and name.
+    """
+    if not hasattr(_held_locks, 'locks'):
+        _held_locks.locks = {}
+    return _held_locks.locks
+
+
+class NamedLock(object):
+    """
+    A reentrant lock shared by all processes using the same database server.
+
+    The MySQL and PostgreSQL locks belong to the database session, so they
+    are not released by commits or rollbacks, but are lost if the
+    connection is closed. They are reentrant per thread: only the outermost
+    release of a thread releases the lock.
+    """
+    def __init__(self, name, using=None, timeout=LOCK_TIMEOUT):
+        """
+        Create the lock.
+
+        Args:
+            name (str): The name of the lock. Names longer than 64 characters
+                are hashed.
+            using (str): The database alias whose server holds the lock.
+            timeout (float): The time in seconds to wait for the lock before
+                raising LockTimeout, or None to wait forever.
+        """
+        self.name = get_lock_name(name)
+        self.alias = using or DEFAULT_DB_ALIAS
+        self.timeout = timeout
+
+    def acquire(self):
+        """
+        Acquire the lock or raise LockTimeout.
+        """
+        held_locks = get_held_locks()
+        held = held_locks.get((self.alias, self.name))
+        if held is not None:
+            held[0] += 1
+            return
+
+        connection = connections[self.alias]
+        backend = LOCK_BACKENDS.get(connection.vendor, FILE_LOCK_BACKEND)
+        handle = backend.acquire(connection, self.name, self.timeout)
+        if backend is not FILE_LOCK_BACKEND:
+            # Do not leave the transaction of the SELECT open outside of
+            # transaction management.
+            transaction.commit_unless_managed(using=self.alias)
+        if handle is None:
+            raise LockTimeout('Timeout acquiring lock {0}.'.format(self.name))
+        held_locks[(self.alias, self.name)] = [1, backend, handle]
+
+    def release(self):
+        """
+        Release the lock if this is the outermost release of the thread.
+        """
+        held_locks = get_held_locks()
+        held = held_locks[(self.alias, self.name)]
+        held[0] -= 1
+        if held[0]:
+            return
+
+        del held_locks[(self.alias, self.name)]
+        __, backend, handle = held
+        if backend is FILE_LOCK_BACKEND:
+            backend.release(None, handle)
+            return
+
+        try:
+            backend.release(connections[self.alias], handle)
+            transaction.commit_unless_managed(using=self.alias)
+        except DatabaseError:
+            # The lock is released by the server if the connection was lost.
+            log.warning('Unable to release lock %s.', self.name, exc_info=True)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.release()
+
+
+def named_lock(name, using=None, timeout=LOCK_TIMEOUT):
+    """
+    Return a context manager which holds a lock shared by all processes using
+    the same database server.
+
+    Args:
+        name (str): The name of the lock.
+        using (str): The database alias whose server holds the lock.
+        timeout (float): The time in seconds to wait for the lock before
+            raising LockTimeout, or None to wait forever.
+
+    Usage:
+        with named_lock('user:' + username):
+            with commit_on_success():
+                User.objects.get_or_create(username=username)
+    """
+    return NamedLock(name, using, timeout)
+
+
+def get_named_lock(name, using=None, timeout=LOCK_TIMEOUT):
+    """
+    Return a NamedLock, or None if name is None.
+    """
+    if name is None:
+        return None
+    return NamedLock(name, using, timeout)
@@ -0,0 +1,118 @@
+"""
+This module implements policies which decide how failed attempts are logged.
+
+The default policy logs every failed attempt with a traceback. During a
+contention spike formatting those tracebacks and writing them becomes a
+visible share of the CPU, so a policy can instead:
+
+    - log retries as a compact one-line record without a traceback,
+    - log only a sample of the retries,
+    - limit the retry records per function path,
+    - or not log retries at all.
+
+The final failure is always logged with a traceback. Records are only created,
+and tracebacks only formatted, when the policy and the logger decide to emit
+them.
+
+    QUIET = LogPolicy(retries=COMPACT, sample_rate=0.1, min_interval=1)
+
+    @commit_on_success_with_read_committed(log_policy=QUIET)
+    def view(request):
+        ...
+"""
+import logging
+import random
+from threading import Lock
+import time
+
+
+# How retries are logged.
+FULL = 'full'
+COMPACT = 'compact'
+NONE = None
+
+
+class LogPolicy(object):
+    """
+    A policy for logging failed attempts.
+    """
+    def __init__(self, retries=FULL, sample_rate=1.0, min_interval=0, level=logging.ERROR):
+        """
+        Create the policy.
+
+        Args:
+            retries (str): FULL to log retries with a traceback, COMPACT to log
+                them as one line or NONE to not log them.
+            sample_rate (float): The fraction of retries to log.
+            min_interval (float): The minimum time in seconds between two retry
+                records of the same function path.
+            level (int): The level of the retry records.
+        """
+        self.retries = retries
+        self.sample_rate = sample_rate
+        self.min_interval = min_interval
+        self.level = level
+        self.lock = Lock()
+        self.last_records = {}
+        self.suppressed = {}
+
+    def should_log_retry(self, func_path):
+        """
+        Return the number of retry records which were suppressed since the
+        last one if a retry of func_path should be logged, otherwise None.
+        """
+        if self.retries is NONE:
+            return None
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+        if not self.min_interval:
+            return 0
+
+        with self.lock:
+            now = time.time()
+            if now - self.last_records.get(func_path, 0) < self.min_interval:
+                self.suppressed[func_path] = self.suppressed.get(func_path, 0) + 1
+                return None
+            self.last_records[func_path] = now
+            return self.suppressed.pop(func_path, 0)
+
+    def log_retry(self, logger, func_path, attempt, exc_info, delay):
+        """
+        Log a failed attempt which is going to be retried.
+
+        Args:
+            logger (Logger): The logger to log to.
+            func_path (str): The path of the function.
+            attempt (int): The number of the attempt which failed.
+            exc_info (tuple): The exception which was raised.
+            delay (float): The time to wait before the next attempt.
+        """
+        if not logger.isEnabledFor(self.level):
+            return
+        suppressed = self.should_log_retry(func_path)
+        if suppressed is None:
+            return
+
+        if self.retries == COMPACT:
+            logger.log(
+                self.level, 'retry func_path=%s attempt=%d exception=%s delay=%.3f suppressed=%d message="%s"',
+                func_path, attempt, exc_info[0].__name__, delay, suppressed, exc_info[1],
+            )
+        else:
+            logger.log(self.level, 'Error in %s on attempt %d. Retrying.', func_path, attempt, exc_info=exc_info)
+
+    def log_failure(self, logger, func_path, attempt, exc_info, reason=''):
+        """
+        Log a failed attempt which is not going to be retried.
+
+        Args:
+            logger (Logger): The logger to log to.
+            func_path (str): The path of the function.
+            attempt (int): The number of the attempt which failed.
+            exc_info (tuple): The exception which was raised.
+            reason (str): Why the attempt is not retried.
+        """
+        logger.error('Error in %s on attempt %d. %sRaising.', func_path, attempt, reason, exc_info=exc_info)
+
+
+DEFAULT_LOG_POLICY = LogPolicy()
@@ -0,0 +1,294 @@
+"""
+This module implements hooks for collecting metrics about retried blocks of
+code and an in-process aggregator.
+
+Collectors are registered process wide:
+
+    aggregator = MetricsAggregator()
+    add_collector(aggregator)
+    ...
+    for func_path, stats in aggregator.snapshot(reset=True).iteritems():
+        statsd.gauge(func_path + '.retries', stats['retries'])
+
+Every attempt of a decorated function or a block retried by a generator is
+reported with the path of the function (module.function), the number of the
+attempt, its duration, the time spent setting up the isolation level, the
+time spent committing and the class of the exception it raised.
+"""
+from collections import defaultdict
+from threading import Lock
+import time
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_collectors = []
+
+
+class MetricsCollector(object):
+    """
+    Base class of the collectors. All hooks do nothing.
+    """
+    def record_attempt(self, func_path, attempt, duration, setup_duration, commit_duration, exception):
+        """
+        Record a finished attempt.
+
+        Args:
+            func_path (str): The path of the function.
+            attempt (int): The number of the attempt, starting at 1.
+            duration (float): The duration of the attempt, including setup
+                and commit.
+            setup_duration (float): The time spent setting up the isolation level.
+            commit_duration (float): The time spent committing or rolling back.
+            exception (type): The class of the exception which was raised or
+                None if the attempt succeeded.
+        """
+        pass
+
+    def record_sleep(self, func_path, duration):
+        """
+        Record the time waited before the next attempt.
+        """
+        pass
+
+    def record_long_transaction(self, func_path, attempt, duration):
+        """
+        Record a transaction which the TransactionWatchdog flagged because it
+        has been open for duration seconds.
+        """
+        pass
+
+    def record_profile(self, func_path, attempt, profile):
+        """
+        Record the AttemptProfile of the statements of an attempt. It is
+        reported before the attempt.
+        """
+        pass
+
+
+class Histogram(object):
+    """
+    A histogram with fixed buckets. Not thread-safe.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Create the histogram.
+
+        Args:
+            buckets (tuple): The upper bounds of the buckets in ascending
+                order. Larger values are counted in an overflow bucket.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Add a value to the histogram.
+        """
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """
+        Return the histogram as a dict with cumulative bucket counts.
+        """
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return {'buckets': buckets, 'count': self.count, 'sum': self.sum}
+
+
+class FunctionMetrics(object):
+    """
+    The aggregated metrics of a function.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.long_transactions = 0
+        self.exceptions = defaultdict(int)
+        self.attempt_duration = Histogram(buckets)
+        self.setup_duration = Histogram(buckets)
+        self.commit_duration = Histogram(buckets)
+        self.sleep_duration = Histogram(buckets)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.statement_duration = Histogram(buckets)
+        self.rows = 0
+
+    def snapshot(self):
+        """
+        Return the metrics as a dict.
+        """
+        return {
+            'calls': self.calls,
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'failures': self.failures,
+            'long_transactions': self.long_transactions,
+            'exceptions': dict(self.exceptions),
+            'attempt_duration': self.attempt_duration.snapshot(),
+            'setup_duration': self.setup_duration.snapshot(),
+            'commit_duration': self.commit_duration.snapshot(),
+            'sleep_duration': self.sleep_duration.snapshot(),
+            'statements': self.statements.snapshot(),
+            'statement_duration': self.statement_duration.snapshot(),
+            'rows': self.rows,
+        }
+
+
+class MetricsAggregator(MetricsCollector):
+    """
+    A thread-safe collector which aggregates the metrics per function path.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Create the aggregator.
+
+        Args:
+            buckets (tuple): The upper bounds of the histogram buckets in seconds.
+        """
+        self.buckets = buckets
+        self.lock = Lock()
+        self.functions = {}
+
+    def get_function_metrics(self, func_path):
+        """
+        Return the FunctionMetrics of a path. Must be called with the lock held.
+        """
+        metrics = self.functions.get(func_path)
+        if metrics is None:
+            metrics = self.functions[func_path] = FunctionMetrics(self.buckets)
+        return metrics
+
+    def record_attempt(self, func_path, attempt, duration, setup_duration, commit_duration, exception):
+        with self.lock:
+            metrics = self.get_function_metrics(func_path)
+            if attempt == 1:
+                metrics.calls += 1
+            else:
+                metrics.retries += 1
+            metrics.attempts += 1
+            if exception is not None:
+                metrics.failures += 1
+                metrics.exceptions[exception.__name__] += 1
+            metrics.attempt_duration.observe(duration)
+            metrics.setup_duration.observe(setup_duration)
+            metrics.commit_duration.observe(commit_duration)
+
+    def record_sleep(self, func_path, duration):
+        with self.lock:
+            self.get_function_metrics(func_path).sleep_duration.observe(duration)
+
+    def record_long_transaction(self, func_path, attempt, duration):
+        with self.lock:
+            self.get_function_metrics(func_path).long_transactions += 1
+
+    def record_profile(self, func_path, attempt, profile):
+        with self.lock:
+            metrics = self.get_function_metrics(func_path)
+            metrics.statements.observe(profile.statements)
+            metrics.statement_duration.observe(profile.duration)
+            metrics.rows += profile.rows
+
+    def snapshot(self, reset=False):
+        """
+        Return the metrics of all function paths as a dict.
+
+        Args:
+            reset (bool): Whether to reset the metrics after taking the snapshot.
+        """
+        with self.lock:
+            snapshot = dict(
+                (func_path, metrics.snapshot()) for func_path, metrics in self.functions.iteritems()
+            )
+            if reset:
+                self.functions = {}
+        return snapshot
+
+    def reset(self):
+        """
+        Reset all metrics.
+        """
+        with self.lock:
+            self.functions = {}
+
+
+class TimedContextManager(object):
+    """
+    A context manager which wraps another one and measures how long its
+    __exit__ takes, e.g. how long commit_on_success takes to commit.
+    """
+    def __init__(self, context_manager):
+        self.context_manager = context_manager
+        self.exit_duration = 0
+
+    def __enter__(self):
+        return self.context_manager.__enter__()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        started = time.time()
+        try:
+            return self.context_manager.__exit__(exc_type, exc_value, exc_traceback)
+        finally:
+            self.exit_duration = time.time() - started
+
+
+def add_collector(collector):
+    """
+    Register a MetricsCollector.
+    """
+    if collector not in _collectors:
+        _collectors.append(collector)
+
+
+def remove_collector(collector):
+    """
+    Unregister a MetricsCollector.
+    """
+    if collector in _collectors:
+        _collectors.remove(collector)
+
+
+def record_attempt(func_path, attempt, duration, setup_duration, commit_duration, exception):
+    """
+    Report an attempt to all registered collectors.
+    """
+    for collector in _collectors:
+        collector.record_attempt(func_path, attempt, duration, setup_duration, commit_duration, exception)
+
+
+def record_sleep(func_path, duration):
+    """
+    Report the time waited before an attempt to all registered collectors.
+    """
+    for collector in _collectors:
+        collector.record_sleep(func_path, duration)
+
+
+def record_long_transaction(func_path, attempt, duration):
+    """
+    Report a long transaction to all registered collectors.
+    """
+    for collector in _collectors:
+        collector.record_long_transaction(func_path, attempt, duration)
+
+
+def record_profile(func_path, attempt, profile):
+    """
+    Report the AttemptProfile of an attempt to all registered collectors.
+    """
+    for collector in _collectors:
+        collector.record_profile(func_path, attempt, profile)
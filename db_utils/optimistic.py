@@ -0,0 +1,150 @@
+"""
+This module implements retrying updates of rows with optimistic concurrency
+control instead of locks or isolation levels.
+
+The row has a version field which every update increments. The decorated
+function changes an instance, which is saved with an UPDATE which only
+matches the row while it still has the version which was read. If another
+transaction updated the row in between, nothing is updated, and the row is
+read again and the function called again with the attempts and backoff of
+the other decorators:
+
+    @optimistic_update(Course, version_field='version')
+    def enroll(course, user):
+        course.enrolled += 1
+
+    enroll(course_id, user)
+
+Each attempt runs in a savepoint, or in its own transaction outside of
+transactions, so the other writes of an attempt which read a stale version
+are rolled back. The isolation level is not changed and open transactions
+are only committed where savepoints are not supported, so it can be used
+inside of transactions. A read-mostly row is never locked for longer than
+the single UPDATE.
+"""
+from functools import partial, wraps
+
+from django.db import connections, transaction, IntegrityError, DEFAULT_DB_ALIAS
+
+from config import get_config
+from errors import ExceptionClassifier
+from transaction import savepoint_context_manager
+from utils import exception_managers_until_success
+
+
+class StaleVersionError(IntegrityError):
+    """
+    Raised when a row was updated by another transaction since it was read.
+
+    It is an IntegrityError, so the classifiers retry it like a row created
+    by another transaction.
+    """
+    pass
+
+
+def get_instance(model, pk, using, locking):
+    """
+    Read the instance of model with the primary key pk.
+
+    A locking read sees the rows committed after the snapshot of a
+    REPEATABLE READ transaction on MySQL was taken.
+    """
+    queryset = model._default_manager.db_manager(using).filter(pk=pk)  # pylint: disable=protected-access
+    if locking:
+        queryset = queryset.select_for_update()
+    return queryset.get()
+
+
+def update_version(obj, version_field, next_version, using):
+    """
+    Save all fields of an instance and its next version if the row still has
+    the version of the instance, or raise StaleVersionError.
+    """
+    model = type(obj)
+    version = getattr(obj, version_field)
+    values = dict(
+        (field.name, field.pre_save(obj, False))
+        for field in model._meta.local_fields  # pylint: disable=protected-access
+        if not field.primary_key and field.name != version_field
+    )
+    values[version_field] = next_version(version)
+    filters = {'pk': obj.pk, version_field: version}
+    if not model._default_manager.db_manager(using).filter(**filters).update(**values):  # pylint: disable=protected-access
+        raise StaleVersionError('{0} {1!r} is not at version {2!r}.'.format(model.__name__, obj.pk, version))
+    setattr(obj, version_field, values[version_field])
+
+
+def optimistic_update(
+    model, version_field='version', next_version=None, exceptions=None, delay=None, max_attempts=None,
+    backoff=None, using=None, budget=None, log_policy=None,
+):
+    """
+    Decorator factory for a function which changes an instance of model,
+    which is saved if no other transaction updated it since it was read, or
+    read again and changed again.
+
+    The decorated function is called with an instance or the primary key of
+    model followed by the other arguments and is passed the instance. If it
+    is passed an instance it is used in the first attempt. Each retry reads
+    the row again, with a locking read in transactions on MySQL, because the
+    snapshot of a REPEATABLE READ transaction keeps the stale version.
+
+    Each attempt runs in a savepoint_context_manager.
+
+    The exceptions, delay, max_attempts, backoff and log_policy default to
+    the DBUtilsConfig, which can also override them per function.
+
+    Args:
+        model (Model): The model of the instances.
+        version_field (str): The name of the field whose value is compared.
+        next_version (function): Return the version which replaces the
+            given one. Defaults to adding 1.
+        exceptions (tuple): A tuple of exceptions to catch, to which
+            StaleVersionError is added, or an ExceptionClassifier, which
+            should retry it.
+        delay (float): Time to wait between attempts.
+        max_attempts (int): Number of times to attempt the decorated function.
+        backoff (Backoff): A strategy to compute the time to wait between
+            attempts. Overrides delay.
+        using (str): The database alias. Defaults to the default database.
+        budget (RetryBudget): A budget shared with other functions.
+        log_policy (LogPolicy): Decides how failed attempts are logged.
+
+    Usage:
+        @optimistic_update(Course, version_field='version')
+        def enroll(course, user):
+            course.enrolled += 1
+    """
+    using = using or DEFAULT_DB_ALIAS
+    next_version = next_version or (lambda version: version + 1)
+
+    def decorator(func):
+
+        func_path = '{0}.{1}'.format(func.__module__, func.__name__)
+
+        @wraps(func)
+        def wrapper(obj, *args, **kwargs):  # pylint: disable=missing-docstring
+            options = get_config().get_retry_options(func_path, exceptions, delay, max_attempts, backoff, log_policy)
+            exceptions_to_retry = options.exceptions
+            if not isinstance(exceptions_to_retry, ExceptionClassifier):
+                exceptions_to_retry = tuple(exceptions_to_retry) + (StaleVersionError,)
+            pk = obj.pk if isinstance(obj, model) else obj
+            instance = obj if isinstance(obj, model) else None
+            for exception_manager in exception_managers_until_success(
+                exceptions_to_retry=exceptions_to_retry, delay=options.delay, max_attempts=options.max_attempts,
+                backoff=options.backoff, context_manager=partial(savepoint_context_manager, using=using),
+                func_path=func_path, budget=budget, log_policy=options.log_policy,
+            ):
+                with exception_manager:
+                    if instance is None or exception_manager.attempt > 1:
+                        instance = get_instance(
+                            model, pk, using,
+                            exception_manager.attempt > 1 and connections[using].vendor == 'mysql' and
+                            transaction.is_managed(using=using),
+                        )
+                    result = func(instance, *args, **kwargs)
+                    update_version(instance, version_field, next_version, using)
+            return result
+
+        return wrapper
+    return decorator
@@ -0,0 +1,193 @@
+"""
+This module implements a profiler of the SQL statements executed during each
+attempt of a retried block of code.
+
+Profiling is opt-in per decorator or generator:
+
+    @commit_on_success_with_read_committed(profile=True)
+    def view(request):
+        ...
+
+While an attempt runs, the cursors of its databases are wrapped like
+Django's debug cursor does, but instead of keeping every statement only a
+bounded AttemptProfile is kept: the number of statements, the time spent
+executing them, the rows they affected, the slowest ones and the ones which
+were executed repeatedly, e.g. by an N+1 query. The profile of each attempt
+is reported to the metrics collectors with record_profile() before the
+attempt itself.
+"""
+import heapq
+import time
+
+from django.db import connections
+from django.db.backends.util import CursorWrapper
+
+from metrics import record_profile
+
+
+MAX_SLOWEST = 5
+MAX_TEMPLATES = 100
+MAX_SQL_LENGTH = 1000
+
+
+class AttemptProfile(object):
+    """
+    The statements executed during an attempt. Its size does not depend on
+    the number of statements.
+    """
+    __slots__ = ('statements', 'duration', 'rows', 'slowest', 'templates')
+
+    def __init__(self):
+        self.statements = 0
+        self.duration = 0.0
+        self.rows = 0
+        self.slowest = []
+        self.templates = {}
+
+    def add(self, sql, duration, rows):
+        """
+        Add a statement.
+
+        Args:
+            sql (str): The statement without its parameters, so that repeated
+                queries have the same sql.
+            duration (float): The time spent executing it.
+            rows (int): The number of rows it affected, or -1 if unknown.
+        """
+        sql = sql[:MAX_SQL_LENGTH]
+        self.statements += 1
+        self.duration += duration
+        if rows > 0 and sql.lstrip()[:6].upper() != 'SELECT':
+            self.rows += rows
+
+        if len(self.slowest) < MAX_SLOWEST:
+            heapq.heappush(self.slowest, (duration, sql))
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, sql))
+
+        if sql in self.templates:
+            self.templates[sql] += 1
+        elif len(self.templates) < MAX_TEMPLATES:
+            self.templates[sql] = 1
+
+    def get_slowest(self):
+        """
+        Return a list of the slowest statements and their durations, slowest
+        first.
+        """
+        return [(sql, duration) for duration, sql in sorted(self.slowest, reverse=True)]
+
+    def get_repeated(self):
+        """
+        Return a list of the statements which were executed more than once
+        and how often, most frequent first.
+        """
+        repeated = [(sql, count) for sql, count in self.templates.iteritems() if count > 1]
+        return sorted(repeated, key=lambda item: (-item[1], item[0]))
+
+    def snapshot(self):
+        """
+        Return the profile as a dict.
+        """
+        return {
+            'statements': self.statements,
+            'duration': self.duration,
+            'rows': self.rows,
+            'slowest': self.get_slowest(),
+            'repeated': self.get_repeated(),
+        }
+
+
+class ProfilingCursorWrapper(CursorWrapper):
+    """
+    A cursor which adds the statements it executes to an AttemptProfile.
+    """
+    def __init__(self, cursor, db, profile):
+        super(ProfilingCursorWrapper, self).__init__(cursor, db)
+        self.profile = profile
+
+    def execute(self, sql, params=()):
+        self.set_dirty()
+        started = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.profile.add(sql, time.time() - started, getattr(self.cursor, 'rowcount', -1))
+
+    def executemany(self, sql, param_list):
+        self.set_dirty()
+        started = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.profile.add(sql, time.time() - started, getattr(self.cursor, 'rowcount', -1))
+
+
+class ProfiledContextManager(object):
+    """
+    A context manager which wraps another one, e.g. commit_on_success, and
+    profiles the statements executed on the connections of aliases while it
+    is open.
+
+    The connections of Django are per thread, so wrapping their cursors does
+    not affect other threads.
+    """
+    __slots__ = ('context_manager', 'aliases', 'func_path', 'attempt', 'profile', 'cursors')
+
+    def __init__(self, context_manager, aliases, func_path, attempt):
+        self.context_manager = context_manager
+        self.aliases = aliases
+        self.func_path = func_path
+        self.attempt = attempt
+        self.profile = AttemptProfile()
+        self.cursors = None
+
+    def __enter__(self):
+        self.cursors = []
+        for alias in self.aliases:
+            connection = connections[alias]
+            self.cursors.append((connection, connection.__dict__.get('cursor')))
+            connection.cursor = get_profiling_cursor_factory(connection, connection.cursor, self.profile)
+        try:
+            return self.context_manager.__enter__()
+        except:
+            self.restore_cursors()
+            raise
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        try:
+            return self.context_manager.__exit__(exc_type, exc_value, exc_traceback)
+        finally:
+            self.restore_cursors()
+            record_profile(self.func_path, self.attempt, self.profile)
+
+    def restore_cursors(self):
+        """
+        Restore the cursor methods of the connections.
+        """
+        for connection, cursor in reversed(self.cursors):
+            if cursor is None:
+                del connection.cursor
+            else:
+                connection.cursor = cursor
+        self.cursors = None
+
+
+def get_profiling_cursor_factory(connection, cursor_factory, profile):
+    """
+    Return a function which wraps the cursors created by cursor_factory in a
+    ProfilingCursorWrapper.
+    """
+    def cursor():  # pylint: disable=missing-docstring
+        return ProfilingCursorWrapper(cursor_factory(), connection, profile)
+    return cursor
+
+
+def profiled(context_manager, aliases, func_path, attempt):
+    """
+    Return context_manager wrapped in a ProfiledContextManager if aliases is
+    not None, or context_manager.
+    """
+    if aliases is None:
+        return context_manager
+    return ProfiledContextManager(context_manager, aliases, func_path, attempt)
@@ -1,2 +1,19 @@
+from test_adaptive import *
+from test_backoff import *
+from test_batch import *
+from test_breaker import *
+from test_config import *
+from test_budget import *
+from test_claim import *
+from test_errors import *
+from test_executor import *
+from test_faults import *
+from test_locks import *
+from test_log_policy import *
+from test_metrics import *
+from test_optimistic import *
+from test_profiler import *
 from test_transaction import *
+from test_upsert import *
 from test_utils import *
+from test_watchdog import *
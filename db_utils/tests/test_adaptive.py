@@ -0,0 +1,115 @@
+"""Tests for adaptive."""
+
+import ddt
+from mock import patch
+
+from django.db import DatabaseError, IntegrityError
+from django.test import TestCase
+
+from db_utils.adaptive import AdaptiveRetry
+from db_utils.budget import RetryBudget
+from db_utils.errors import MySQLErrorClassifier
+from db_utils.transaction import commit_on_success_with_read_committed
+
+from test_utils import mock_func
+
+
+@ddt.ddt
+class AdaptiveRetryTestCase(TestCase):
+    """
+    Test the AdaptiveRetry.
+    """
+
+    def setUp(self):
+        super(AdaptiveRetryTestCase, self).setUp()
+        self.adaptive = AdaptiveRetry(min_attempts=1, max_attempts=5, max_scale=8, sample_size=4, probe_interval=3)
+
+    @ddt.data((3, 3), (0, 1), (10, 5))
+    @ddt.unpack
+    def test_bounds(self, max_attempts, expected):
+        self.assertEqual(self.adaptive.get_options('app.view', max_attempts, 0.1), (expected, 1.0))
+
+    def test_fewer_attempts_when_retries_fail(self):
+        attempts = []
+        for __ in xrange(40):
+            max_attempts, __ = self.adaptive.get_options('app.view', 3, 0.1)
+            attempts.append(max_attempts)
+            self.adaptive.record_call('app.view', max_attempts, False, [0.01] * max_attempts)
+
+        self.assertEqual(attempts[0], 3)
+        self.assertEqual(self.adaptive.snapshot()['app.view']['max_attempts'], 1)
+        # Every probe_interval-th call still retries once.
+        self.assertIn(2, attempts[-6:])
+        self.assertIn(1, attempts[-6:])
+
+    def test_more_attempts_when_retries_succeed(self):
+        self.adaptive.get_options('app.view', 2, 0.1)
+        for __ in xrange(3):
+            self.adaptive.record_call('app.view', 2, True, [0.01])
+        self.adaptive.record_call('app.view', 2, False, [0.01, 0.01])
+
+        self.assertEqual(self.adaptive.get_options('app.view', 2, 0.1)[0], 3)
+
+    def test_clustered_conflicts_scale_delay(self):
+        self.adaptive.get_options('app.view', 5, 0.1)
+        self.adaptive.record_call('app.view', 3, True, [0.001, 0.001])
+        self.assertEqual(self.adaptive.get_options('app.view', 5, 0.1)[1], 2)
+
+        for __ in xrange(5):
+            self.adaptive.record_call('app.view', 4, True, [0.001] * 3)
+        self.assertEqual(self.adaptive.get_options('app.view', 5, 0.1)[1], 8)
+
+        self.adaptive.record_call('app.view', 2, True, [0.001])
+        self.assertAlmostEqual(self.adaptive.get_options('app.view', 5, 0.1)[1], 7.2)
+
+    def test_delay_covers_conflict_latency(self):
+        self.adaptive.get_options('app.view', 3, 0.1)
+        self.adaptive.record_call('app.view', 2, True, [0.3])
+        self.assertAlmostEqual(self.adaptive.get_options('app.view', 3, 0.1)[1], 3)
+        self.assertEqual(self.adaptive.get_options('app.view', 3, 0)[1], 0.9)
+
+    def test_reset(self):
+        self.adaptive.get_options('app.view', 3, 0.1)
+        self.adaptive.reset()
+        self.assertEqual(self.adaptive.snapshot(), {})
+
+    @patch('db_utils.transaction.time.sleep')
+    def test_decorator(self, mock_sleep):
+        decorated = commit_on_success_with_read_committed(
+            delay=0.1, max_attempts=3, adaptive=self.adaptive
+        )(mock_func)
+
+        mock_func.exceptions_to_raise = (IntegrityError, IntegrityError, None)
+        decorated()
+        self.assertEqual([call[0][0] for call in mock_sleep.call_args_list], [0.1, 0.1])
+        self.assertEqual(self.adaptive.snapshot()['db_utils.tests.test_utils.mock_func']['scale'], 2)
+
+        mock_sleep.reset_mock()
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        decorated()
+        mock_sleep.assert_called_once_with(0.2)
+
+    @patch('db_utils.transaction.time.sleep')
+    def test_decorator_ignores_other_exceptions(self, mock_sleep):  # pylint: disable=unused-argument
+        decorated = commit_on_success_with_read_committed(adaptive=self.adaptive)(mock_func)
+        mock_func.exceptions_to_raise = (DatabaseError,)
+        with self.assertRaises(DatabaseError):
+            decorated()
+
+        self.assertEqual(self.adaptive.snapshot()['db_utils.tests.test_utils.mock_func']['retry_success_rate'], 1)
+
+    @patch('db_utils.transaction.time.sleep')
+    def test_decorator_ignores_failures_which_are_not_retried(self, mock_sleep):  # pylint: disable=unused-argument
+        budget = RetryBudget(ratio=0, min_retries=0)
+        for kwargs, exception in (
+            ({'exceptions': MySQLErrorClassifier()}, DatabaseError(1146, "Table 'app.missing' doesn't exist")),
+            ({'budget': budget}, IntegrityError()),
+        ):
+            decorated = commit_on_success_with_read_committed(adaptive=self.adaptive, **kwargs)(mock_func)
+            mock_func.exceptions_to_raise = (exception,)
+            with self.assertRaises(type(exception)):
+                decorated()
+
+        stats = self.adaptive.stats['db_utils.tests.test_utils.mock_func']
+        self.assertEqual(stats.exhausted_calls, 0)
+        self.assertIsNone(stats.conflict_latency)
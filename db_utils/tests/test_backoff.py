@@ -0,0 +1,99 @@
+"""Tests for backoff."""
+
+import ddt
+from mock import patch
+
+from django.test import TestCase
+
+from db_utils.backoff import (
+    ConstantBackoff, LinearBackoff, ExponentialBackoff, FullJitterBackoff, DecorrelatedJitterBackoff, get_backoff,
+)
+from db_utils.utils import exception_managers_until_success
+
+from test_utils import mock_func
+
+
+@ddt.ddt
+class BackoffTestCase(TestCase):
+    """
+    Test the backoff strategies.
+    """
+
+    @ddt.data(
+        (ConstantBackoff(base=0.1), [0.1, 0.1, 0.1, 0.1]),
+        (LinearBackoff(base=0.1), [0.1, 0.2, 0.3, 0.4]),
+        (LinearBackoff(base=0.1, cap=0.25), [0.1, 0.2, 0.25, 0.25]),
+        (ExponentialBackoff(base=0.1), [0.1, 0.2, 0.4, 0.8]),
+        (ExponentialBackoff(base=0.1, factor=3, cap=0.5), [0.1, 0.3, 0.5, 0.5]),
+    )
+    @ddt.unpack
+    def test_deterministic_delays(self, backoff, delays):
+        schedule = backoff.start()
+        for attempt, delay in enumerate(delays, 1):
+            self.assertAlmostEqual(schedule.next_delay(attempt), delay)
+
+    def test_full_jitter(self):
+        schedule = FullJitterBackoff(base=0.1, cap=0.3).start()
+        for attempt, upper in enumerate([0.1, 0.2, 0.3, 0.3], 1):
+            delay = schedule.next_delay(attempt)
+            self.assertTrue(0 <= delay <= upper)
+
+    def test_decorrelated_jitter(self):
+        schedule = DecorrelatedJitterBackoff(base=0.1, cap=1).start()
+        previous = 0.1
+        for attempt in xrange(1, 10):
+            delay = schedule.next_delay(attempt)
+            self.assertTrue(0.1 <= delay <= min(1, previous * 3))
+            previous = delay
+
+    def test_scale(self):
+        schedule = ExponentialBackoff(base=0.1, cap=0.5).start(scale=2)
+        for attempt, delay in enumerate([0.2, 0.4, 0.5], 1):
+            self.assertAlmostEqual(schedule.next_delay(attempt), delay)
+
+    def test_scaled_decorrelated_jitter(self):
+        schedule = DecorrelatedJitterBackoff(base=0.1).start(scale=2)
+        previous = 0.1
+        for attempt in xrange(1, 10):
+            delay = schedule.next_delay(attempt)
+            self.assertTrue(0.2 <= delay <= previous * 6)
+            previous = delay / 2
+
+    @patch('db_utils.backoff.time.time')
+    def test_deadline(self, mock_time):
+        mock_time.return_value = 100
+        schedule = ConstantBackoff(base=1, deadline=2.5).start()
+
+        self.assertEqual(schedule.next_delay(1), 1)
+        mock_time.return_value = 101
+        self.assertEqual(schedule.next_delay(2), 1)
+        mock_time.return_value = 102
+        self.assertIsNone(schedule.next_delay(3))
+
+    def test_get_backoff(self):
+        backoff = ExponentialBackoff()
+        self.assertIs(get_backoff(backoff, delay=1), backoff)
+        self.assertEqual(get_backoff(None, delay=1).start().next_delay(1), 1)
+
+    @patch('db_utils.utils.time.sleep')
+    def test_generator_uses_backoff(self, mock_sleep):
+        mock_func.exceptions_to_raise = (ValueError, ValueError)
+        for exception_manager in exception_managers_until_success(
+            exceptions_to_retry=(ValueError,), max_attempts=3, backoff=ExponentialBackoff(base=0.1)
+        ):
+            with exception_manager:
+                mock_func()
+
+        self.assertEqual([call[0][0] for call in mock_sleep.call_args_list], [0.1, 0.2])
+
+    @patch('db_utils.utils.time.sleep')
+    def test_generator_deadline_exceeded(self, mock_sleep):
+        mock_func.exceptions_to_raise = (ValueError,)
+        with self.assertRaises(ValueError):
+            for exception_manager in exception_managers_until_success(
+                exceptions_to_retry=(ValueError,), max_attempts=3, backoff=ConstantBackoff(base=10, deadline=1)
+            ):
+                with exception_manager:
+                    mock_func()
+
+        self.assertFalse(mock_sleep.called)
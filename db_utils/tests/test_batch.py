@@ -0,0 +1,154 @@
+"""Tests for batch."""
+
+import ddt
+from mock import Mock, patch
+
+from django.contrib.auth.models import User
+from django.db import connection, DatabaseError, IntegrityError
+from django.test import TransactionTestCase
+
+from db_utils.batch import BatchError, WriteBatch
+from db_utils.faults import FaultInjector, DEADLOCK
+from db_utils.errors import MYSQL_ERRORS
+from db_utils.transaction import repeatable_read_transactions
+
+
+def create_user(username):
+    """Create a user and fail for the poison username."""
+    if username == 'poison':
+        raise IntegrityError('poison')
+    return User.objects.create(username=username, email=username + '@edx.org')
+
+
+@ddt.ddt
+class WriteBatchTestCase(TransactionTestCase):
+    """
+    Test the WriteBatch.
+    """
+
+    def setUp(self):
+        super(WriteBatchTestCase, self).setUp()
+        patcher = patch('db_utils.utils.time.sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_usernames(self):
+        """Return the usernames in the database."""
+        return sorted(User.objects.values_list('username', flat=True))
+
+    @ddt.data((1, 10), (3, 4), (10, 1), (20, 1))
+    @ddt.unpack
+    def test_chunks(self, chunk_size, transactions):
+        mock_generator = Mock(wraps=repeatable_read_transactions)
+        batch = WriteBatch(chunk_size=chunk_size, transactions=mock_generator)
+        with batch:
+            operations = [batch.create(User, username='user_{0}'.format(index)) for index in xrange(10)]
+
+        self.assertEqual(mock_generator.call_count, transactions)
+        self.assertEqual(len(self.get_usernames()), 10)
+        self.assertEqual([operation.result.username for operation in operations], [
+            'user_{0}'.format(index) for index in xrange(10)
+        ])
+        self.assertEqual(batch.pending, [])
+
+    def test_auto_flush(self):
+        batch = WriteBatch(chunk_size=2)
+        batch.create(User, username='user_1')
+        self.assertEqual(User.objects.count(), 0)
+        batch.create(User, username='user_2')
+        self.assertEqual(User.objects.count(), 2)
+
+        batch = WriteBatch(chunk_size=2, auto_flush=False)
+        for index in xrange(3, 6):
+            batch.create(User, username='user_{0}'.format(index))
+        self.assertEqual(User.objects.count(), 2)
+        batch.flush()
+        self.assertEqual(User.objects.count(), 5)
+
+    def test_update_and_get_or_create(self):
+        User.objects.create(username='student', email='old@edx.org')
+        with WriteBatch() as batch:
+            updated = batch.update(User, {'email': 'new@edx.org'}, username='student')
+            existing = batch.get_or_create(User, username='student')
+            created = batch.get_or_create(User, username='other')
+
+        self.assertEqual(updated.result, 1)
+        self.assertEqual(existing.result[0].email, 'new@edx.org')
+        self.assertFalse(existing.result[1])
+        self.assertTrue(created.result[1])
+
+    def test_poison_row_is_isolated(self):
+        usernames = ['user_{0}'.format(index) for index in xrange(7)]
+        usernames.insert(5, 'poison')
+        batch = WriteBatch(chunk_size=8, auto_flush=False, max_attempts=1)
+
+        with self.assertRaises(BatchError) as context:
+            with batch:
+                operations = [batch.add(create_user, username) for username in usernames]
+
+        [failed] = context.exception.failed
+        self.assertIs(failed, operations[5])
+        self.assertIsInstance(failed.exception, IntegrityError)
+        self.assertEqual(self.get_usernames(), sorted(set(usernames) - set(['poison'])))
+        self.assertTrue(all(operation.done for operation in operations))
+
+    def test_split_chunks_are_attempted_once(self):
+        mock_create_user = Mock(side_effect=create_user)
+        batch = WriteBatch(chunk_size=4, auto_flush=False, max_attempts=3)
+
+        with self.assertRaises(BatchError):
+            with batch:
+                for username in ['user_1', 'user_2', 'poison', 'user_3']:
+                    batch.add(mock_create_user, username)
+
+        # The chunk is attempted three times and the halves containing the
+        # poison row once each.
+        self.assertEqual([call[0][0] for call in mock_create_user.call_args_list].count('poison'), 5)
+        self.assertEqual(self.get_usernames(), ['user_1', 'user_2', 'user_3'])
+
+    @ddt.data(
+        ({}, '{0}.test_func_path'.format(__name__)),
+        ({'func_path': 'events.import_events'}, 'events.import_events'),
+    )
+    @ddt.unpack
+    def test_func_path(self, kwargs, func_path):
+        mock_generator = Mock(wraps=repeatable_read_transactions)
+        with WriteBatch(transactions=mock_generator, **kwargs) as batch:
+            batch.create(User, username='student')
+
+        self.assertEqual(mock_generator.call_args[1]['func_path'], func_path)
+
+    def test_auto_flush_collects_failures(self):
+        usernames = ['user_1', 'poison', 'user_2', 'user_3', 'user_4']
+        batch = WriteBatch(chunk_size=2, max_attempts=1)
+
+        with self.assertRaises(BatchError) as context:
+            with batch:
+                operations = [batch.add(create_user, username) for username in usernames]
+
+        self.assertEqual(context.exception.failed, [operations[1]])
+        self.assertEqual(self.get_usernames(), ['user_1', 'user_2', 'user_3', 'user_4'])
+        self.assertEqual(batch.failed, [])
+
+    def test_only_failing_chunk_is_retried(self):
+        with FaultInjector() as injector:
+            injector.add([None, None, DEADLOCK], sql=r'^INSERT')
+            with WriteBatch(chunk_size=2, exceptions_to_retry=MYSQL_ERRORS) as batch:
+                for index in xrange(4):
+                    batch.create(User, username='user_{0}'.format(index))
+
+        # The first chunk ran once, the second one twice.
+        self.assertEqual(dict(injector.injected), {DEADLOCK: 1})
+        self.assertEqual(len(self.get_usernames()), 4)
+
+    def test_other_exceptions_keep_pending_operations(self):
+        batch = WriteBatch(chunk_size=2, auto_flush=False, bisect_exceptions=(IntegrityError,))
+        batch.create(User, username='user_1')
+        batch.create(User, username='user_2')
+        batch.add(create_user, 'user_3')
+        batch.add(lambda: connection.cursor().execute('SELECT * FROM missing_table'))
+
+        with self.assertRaises(DatabaseError):
+            batch.flush()
+        self.assertEqual(len(batch.pending), 2)
+        self.assertEqual(User.objects.count(), 2)
@@ -0,0 +1,89 @@
+"""Tests for breaker."""
+
+from mock import patch
+
+from django.db import IntegrityError
+from django.test import TestCase
+
+from db_utils.breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from db_utils.transaction import commit_on_success_with_read_committed
+
+from test_utils import mock_func
+
+
+class CircuitBreakerTestCase(TestCase):
+    """
+    Test the CircuitBreaker.
+    """
+
+    def setUp(self):
+        super(CircuitBreakerTestCase, self).setUp()
+        patcher = patch('db_utils.breaker.time.time', return_value=1000.0)
+        self.mock_time = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, window=10, cooldown=30)
+
+    def test_opens_after_consecutive_failures(self):
+        self.assertFalse(self.breaker.record_failure('key'))
+        self.assertFalse(self.breaker.record_failure('key'))
+        self.assertTrue(self.breaker.record_failure('key'))
+
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call('key')
+        self.breaker.before_call('other')
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure('key')
+        self.breaker.record_failure('key')
+        self.breaker.record_success('key')
+        self.assertFalse(self.breaker.record_failure('key'))
+
+    def test_failures_outside_window(self):
+        self.breaker.record_failure('key')
+        self.breaker.record_failure('key')
+        self.mock_time.return_value = 1011.0
+        self.assertFalse(self.breaker.record_failure('key'))
+
+    def test_half_open(self):
+        for __ in xrange(3):
+            self.breaker.record_failure('key')
+
+        self.mock_time.return_value = 1030.0
+        self.breaker.before_call('key')
+        self.assertEqual(self.breaker.get_state('key'), HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call('key')
+
+        # A failed probe opens the circuit again.
+        self.assertTrue(self.breaker.record_failure('key'))
+        self.assertEqual(self.breaker.get_state('key'), OPEN)
+
+        self.mock_time.return_value = 1060.0
+        self.breaker.before_call('key')
+        self.breaker.record_success('key')
+        self.assertEqual(self.breaker.get_state('key'), CLOSED)
+        self.breaker.before_call('key')
+
+    def test_get_key(self):
+        self.assertEqual(self.breaker.get_key('app.view', ['default']), 'app.view')
+        self.assertEqual(CircuitBreaker(by='alias').get_key('app.view', ['default', 'other']), 'default,other')
+
+    @patch('db_utils.transaction.time.sleep')
+    def test_decorator(self, mock_sleep):
+        decorated = commit_on_success_with_read_committed(max_attempts=5, breaker=self.breaker)(mock_func)
+
+        mock_func.exceptions_to_raise = (IntegrityError,) * 5
+        with self.assertRaises(IntegrityError):
+            decorated()
+
+        # The circuit opened on the third attempt.
+        self.assertEqual(mock_func.exceptions_to_raise, (IntegrityError,) * 2)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+        with self.assertRaises(CircuitOpenError):
+            decorated()
+
+        self.mock_time.return_value = 1030.0
+        mock_func.exceptions_to_raise = ()
+        decorated()
+        self.assertEqual(self.breaker.get_state('db_utils.tests.test_utils.mock_func'), CLOSED)
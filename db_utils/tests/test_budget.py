@@ -0,0 +1,103 @@
+"""Tests for budget."""
+
+import os
+import shutil
+import tempfile
+import threading
+
+from mock import patch
+
+from django.db import IntegrityError
+from django.test import TestCase
+
+from db_utils.budget import RetryBudget
+from db_utils.transaction import commit_on_success_with_read_committed, read_committed_transactions
+
+from test_utils import mock_func
+
+
+class RetryBudgetTestCase(TestCase):
+    """
+    Test the RetryBudget.
+    """
+
+    def setUp(self):
+        super(RetryBudgetTestCase, self).setUp()
+        patcher = patch('db_utils.budget.time.time', return_value=1000.0)
+        self.mock_time = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ratio(self):
+        budget = RetryBudget(ratio=0.1, min_retries=1)
+        for __ in xrange(20):
+            budget.deposit()
+
+        self.assertEqual([budget.withdraw() for __ in xrange(4)], [True, True, True, False])
+
+    def test_sliding_window(self):
+        budget = RetryBudget(ratio=0, min_retries=2, window=10, slots=10)
+        self.assertTrue(budget.withdraw())
+        self.mock_time.return_value = 1005.0
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+
+        # The first retry leaves the window.
+        self.mock_time.return_value = 1010.0
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+
+    def test_thread_safety(self):
+        budget = RetryBudget(ratio=0, min_retries=100)
+        results = []
+
+        def withdraw():
+            """Withdraw repeatedly."""
+            for __ in xrange(50):
+                results.append(budget.withdraw())
+
+        threads = [threading.Thread(target=withdraw) for __ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 100)
+
+    def test_shared_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'budget')
+
+        budget_1 = RetryBudget(ratio=0.5, min_retries=0, path=path)
+        budget_2 = RetryBudget(ratio=0.5, min_retries=0, path=path)
+        self.addCleanup(budget_1.counters.close)
+        self.addCleanup(budget_2.counters.close)
+
+        budget_1.deposit()
+        budget_2.deposit()
+        self.assertTrue(budget_2.withdraw())
+        self.assertFalse(budget_1.withdraw())
+
+    @patch('db_utils.transaction.time.sleep')
+    def test_decorator_fails_fast(self, mock_sleep):
+        budget = RetryBudget(ratio=0, min_retries=1)
+        decorated = commit_on_success_with_read_committed(budget=budget)(mock_func)
+
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        decorated()
+
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        with self.assertRaises(IntegrityError):
+            decorated()
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    @patch('db_utils.utils.time.sleep')
+    def test_generator_fails_fast(self, mock_sleep):
+        budget = RetryBudget(ratio=0, min_retries=0)
+
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        with self.assertRaises(IntegrityError):
+            for transaction_manager in read_committed_transactions(budget=budget):
+                with transaction_manager:
+                    mock_func()
+        self.assertFalse(mock_sleep.called)
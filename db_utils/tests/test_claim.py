@@ -0,0 +1,103 @@
+"""Tests for claim."""
+
+from mock import Mock, patch
+
+from django.contrib.auth.models import User
+from django.db.models.expressions import ExpressionNode
+from django.test import TransactionTestCase
+
+from db_utils.backoff import ExponentialBackoff
+from db_utils.claim import claim_optimistic, claim_rows, claim_skip_locked, get_claim_values, set_claimed
+from db_utils.errors import MYSQL_ERRORS
+from db_utils.faults import FaultInjector, DEADLOCK
+
+
+class ClaimRowsTestCase(TransactionTestCase):
+    """
+    Test claim_rows.
+    """
+
+    def setUp(self):
+        super(ClaimRowsTestCase, self).setUp()
+        self.users = [User.objects.create(username='user_{0}'.format(index)) for index in xrange(5)]
+        patcher = patch('db_utils.utils.time.sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_queryset(self):
+        """Return the unclaimed users."""
+        return User.objects.filter(is_active=True)
+
+    def test_claim(self):
+        claimed = []
+        for user in claim_rows(self.get_queryset(), limit=2, claim={'is_active': False}):
+            self.assertFalse(user.is_active)
+            claimed.append(user.pk)
+
+        self.assertEqual(claimed, [user.pk for user in self.users])
+        self.assertFalse(self.get_queryset().exists())
+
+    def test_ordering(self):
+        users = list(claim_rows(self.get_queryset().order_by('-username'), limit=3, claim={'is_active': False}))
+        self.assertEqual(users, list(reversed(self.users)))
+
+    def test_rows_claimed_by_other_workers_are_skipped(self):
+        queryset = self.get_queryset().order_by('pk')
+        candidates = list(queryset[:3])
+        # Another worker claims a candidate after it was read.
+        User.objects.filter(pk=self.users[1].pk).update(is_active=False)
+        with patch('django.db.models.query.QuerySet.__getitem__', Mock(return_value=candidates)):
+            claimed = claim_optimistic(queryset, 3, {'is_active': False}, None)
+
+        self.assertEqual(claimed, [self.users[0], self.users[2]])
+        self.assertEqual(list(self.get_queryset()), self.users[3:])
+
+    def test_claim_is_required(self):
+        with self.assertRaises(ValueError):
+            list(claim_rows(self.get_queryset(), limit=2))
+
+    @patch('db_utils.claim.time.sleep')
+    def test_lost_batches_back_off(self, mock_sleep):
+        mock_claim = Mock(side_effect=[[], [], self.users[:2], None])
+        with patch('db_utils.claim.claim_optimistic', mock_claim):
+            claimed = list(claim_rows(self.get_queryset(), limit=2, claim={'is_active': False}, delay=0.5))
+
+        self.assertEqual(claimed, self.users[:2])
+        self.assertEqual(mock_sleep.call_args_list, [((0.5,),), ((0.5,),)])
+
+    @patch('db_utils.claim.time.sleep')
+    def test_lost_batches_stop_after_deadline(self, mock_sleep):
+        backoff = ExponentialBackoff(base=1, deadline=2)
+        with patch('db_utils.claim.claim_optimistic', Mock(return_value=[])):
+            claimed = list(claim_rows(self.get_queryset(), limit=2, claim={'is_active': False}, backoff=backoff))
+
+        self.assertEqual(claimed, [])
+        self.assertTrue(mock_sleep.called)
+
+    def test_version_field(self):
+        values = get_claim_values({'status': 'running'}, 'version')
+        self.assertEqual(values['status'], 'running')
+        self.assertIsInstance(values['version'], ExpressionNode)
+
+        job = Mock(status='queued', version=3)
+        set_claimed(job, {'status': 'running'}, 'version')
+        self.assertEqual((job.status, job.version), ('running', 4))
+
+    def test_failed_batch_is_retried(self):
+        with FaultInjector() as injector:
+            injector.add([None, None, DEADLOCK], sql=r'^UPDATE')
+            claimed = list(claim_rows(
+                self.get_queryset(), limit=2, claim={'is_active': False}, exceptions_to_retry=MYSQL_ERRORS
+            ))
+
+        self.assertEqual(dict(injector.injected), {DEADLOCK: 1})
+        self.assertEqual(claimed, self.users)
+
+    @patch('db_utils.claim.skip_locked_supported', Mock(return_value=True))
+    def test_skip_locked_statement(self):
+        with patch('django.db.models.query.RawQuerySet.__iter__', Mock(return_value=iter(self.users[:2]))):
+            claimed = claim_skip_locked(self.get_queryset().order_by('pk'), 2, {'is_active': False}, None)
+
+        self.assertEqual(claimed, self.users[:2])
+        self.assertEqual(self.get_queryset().count(), 3)
+        self.assertFalse(claimed[0].is_active)
@@ -0,0 +1,112 @@
+"""Tests for config."""
+
+import ddt
+from mock import patch
+
+from django.db import DatabaseError, IntegrityError
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from db_utils.backoff import ExponentialBackoff
+from db_utils.config import DBUtilsConfig, get_config, DATABASE_EXCEPTIONS, DELAY, MAX_ATTEMPTS
+from db_utils.errors import MYSQL_ERRORS
+from db_utils.log_policy import DEFAULT_LOG_POLICY
+from db_utils.transaction import commit_on_success_with_read_committed, read_committed_transactions
+
+from test_utils import mock_func
+
+
+BACKOFF = ExponentialBackoff(base=0.5)
+
+
+@ddt.ddt
+class DBUtilsConfigTestCase(TestCase):
+    """
+    Test the DBUtilsConfig.
+    """
+
+    def test_defaults(self):
+        options = DBUtilsConfig().get_retry_options('app.view')
+        self.assertEqual(options.exceptions, DATABASE_EXCEPTIONS)
+        self.assertEqual(options.classifier.exceptions, DATABASE_EXCEPTIONS)
+        self.assertEqual(options.delay, DELAY)
+        self.assertEqual(options.max_attempts, MAX_ATTEMPTS)
+        self.assertIsNone(options.backoff)
+        self.assertIs(options.log_policy, DEFAULT_LOG_POLICY)
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            DBUtilsConfig().delay = 1
+
+    def test_unknown_field(self):
+        with self.assertRaises(TypeError):
+            DBUtilsConfig(retries=1)
+
+    def test_dotted_paths(self):
+        db_utils_config = DBUtilsConfig(
+            exceptions='db_utils.errors.MYSQL_ERRORS', backoff='db_utils.tests.test_config.BACKOFF',
+            lock_directory='/tmp/locks', overrides={'app.view': {'backoff': 'db_utils.tests.test_config.BACKOFF'}},
+        )
+        self.assertIs(db_utils_config.exceptions, MYSQL_ERRORS)
+        self.assertIs(db_utils_config.backoff, BACKOFF)
+        self.assertEqual(db_utils_config.lock_directory, '/tmp/locks')
+        self.assertIs(db_utils_config.overrides['app.view']['backoff'], BACKOFF)
+
+    @ddt.data(
+        ('app.view', {}, 0.2),
+        ('app.view', {'delay': 0.3}, 0.2),
+        ('app.other', {'delay': 0.3}, 0.3),
+        ('app.other', {}, 0.1),
+    )
+    @ddt.unpack
+    def test_precedence(self, func_path, kwargs, delay):
+        db_utils_config = DBUtilsConfig(delay=0.1, overrides={'app.view': {'delay': 0.2}})
+        self.assertEqual(db_utils_config.get_retry_options(func_path, **kwargs).delay, delay)
+
+    def test_zero_is_passed(self):
+        self.assertEqual(DBUtilsConfig().get_retry_options('app.view', delay=0).delay, 0)
+
+    def test_cache(self):
+        db_utils_config = DBUtilsConfig()
+        options = db_utils_config.get_retry_options('app.view', max_attempts=2)
+        self.assertIs(db_utils_config.get_retry_options('app.view', max_attempts=2), options)
+
+        with patch('db_utils.config.MAX_CACHED_OPTIONS', 3):
+            for index in xrange(5):
+                db_utils_config.get_retry_options('app.view', delay=index)
+            self.assertLessEqual(len(db_utils_config.cache), 3)
+
+    @override_settings(DB_UTILS_MAX_ATTEMPTS=5, DB_UTILS_ENABLE_TRANSACTIONS=False)
+    def test_from_settings(self):
+        self.assertEqual(get_config().max_attempts, 5)
+        self.assertFalse(get_config().enable_transactions)
+
+    def test_setting_changed(self):
+        db_utils_config = get_config()
+        self.assertIs(get_config(), db_utils_config)
+
+        with override_settings(DB_UTILS_DELAY=1):
+            self.assertEqual(get_config().delay, 1)
+        self.assertEqual(get_config().delay, DELAY)
+
+        db_utils_config = get_config()
+        with override_settings(DEBUG=True):
+            self.assertIs(get_config(), db_utils_config)
+
+    @patch('db_utils.transaction.time.sleep')
+    def test_decorator_override(self, mock_sleep):
+        overrides = {'db_utils.tests.test_utils.mock_func': {'max_attempts': 4, 'delay': 0.5}}
+        mock_func.exceptions_to_raise = (IntegrityError, IntegrityError, IntegrityError, None)
+        with override_settings(DB_UTILS_OVERRIDES=overrides):
+            commit_on_success_with_read_committed(max_attempts=2)(mock_func)()
+
+        self.assertEqual(mock_sleep.call_count, 3)
+        mock_sleep.assert_called_with(0.5)
+
+    @override_settings(DB_UTILS_EXCEPTIONS=(DatabaseError,))
+    @patch('db_utils.utils.time.sleep')
+    def test_generator_default_exceptions(self, mock_sleep):  # pylint: disable=unused-argument
+        mock_func.exceptions_to_raise = (DatabaseError, None)
+        for transaction_manager in read_committed_transactions():
+            with transaction_manager:
+                mock_func()
@@ -0,0 +1,157 @@
+"""Tests for errors."""
+
+import ddt
+from mock import Mock, patch
+
+from django.db import DatabaseError, IntegrityError
+from django.test import TestCase
+
+from db_utils.errors import (
+    ExceptionClassifier, MySQLErrorClassifier, MYSQL_ERRORS, RETRY, RECONNECT, FAIL, get_classifier, get_error_code,
+    SavepointClassifier,
+)
+from db_utils.transaction import commit_on_success_with_read_committed, read_committed_transactions
+from db_utils.utils import ExceptionManager, exception_managers_until_success
+
+from test_utils import mock_func
+
+
+DEADLOCK = DatabaseError(1213, 'Deadlock found when trying to get lock; try restarting transaction')
+LOCK_WAIT_TIMEOUT = DatabaseError(1205, 'Lock wait timeout exceeded; try restarting transaction')
+GONE_AWAY = DatabaseError(2006, 'MySQL server has gone away')
+LOST = DatabaseError(2013, 'Lost connection to MySQL server during query')
+DUPLICATE = IntegrityError(1062, "Duplicate entry 'student' for key 'username'")
+FOREIGN_KEY = IntegrityError(1452, 'Cannot add or update a child row: a foreign key constraint fails')
+NO_TABLE = DatabaseError(1146, "Table 'dbutils.foo' doesn't exist")
+
+
+@ddt.ddt
+class MySQLErrorClassifierTestCase(TestCase):
+    """
+    Test the classification of synthetic MySQL and SQLite errors.
+    """
+
+    @ddt.data(
+        (DEADLOCK, RETRY),
+        (LOCK_WAIT_TIMEOUT, RETRY),
+        (DUPLICATE, RETRY),
+        (GONE_AWAY, RECONNECT),
+        (LOST, RECONNECT),
+        (FOREIGN_KEY, FAIL),
+        (NO_TABLE, FAIL),
+        (IntegrityError('column username is not unique'), RETRY),
+        (DatabaseError('database is locked'), RETRY),
+        (DatabaseError('no such table: foo'), FAIL),
+    )
+    @ddt.unpack
+    def test_classify(self, exception, action):
+        self.assertEqual(MYSQL_ERRORS.classify(exception), action)
+
+    @ddt.data(
+        (DEADLOCK, 1213),
+        (DatabaseError('database is locked'), None),
+        (ValueError(), None),
+    )
+    @ddt.unpack
+    def test_get_error_code(self, exception, code):
+        self.assertEqual(get_error_code(exception), code)
+
+    def test_custom_codes(self):
+        classifier = MySQLErrorClassifier(retry_codes=frozenset([1146]))
+        self.assertEqual(classifier.classify(NO_TABLE), RETRY)
+        self.assertEqual(classifier.classify(DEADLOCK), FAIL)
+
+    def test_get_classifier(self):
+        self.assertIs(get_classifier(MYSQL_ERRORS), MYSQL_ERRORS)
+
+        classifier = get_classifier((ValueError,))
+        self.assertIsInstance(classifier, ExceptionClassifier)
+        self.assertEqual(classifier.exceptions, (ValueError,))
+        self.assertEqual(classifier.classify(ValueError()), RETRY)
+
+    @ddt.data(
+        (MYSQL_ERRORS, DEADLOCK, FAIL),
+        (MYSQL_ERRORS, GONE_AWAY, FAIL),
+        (MYSQL_ERRORS, LOCK_WAIT_TIMEOUT, RETRY),
+        (MYSQL_ERRORS, NO_TABLE, FAIL),
+        ((DatabaseError,), DEADLOCK, FAIL),
+        ((DatabaseError,), DatabaseError('database is locked'), RETRY),
+        ((DatabaseError,), IntegrityError(), FAIL),
+    )
+    @ddt.unpack
+    def test_savepoint_classifier(self, exceptions, exception, action):
+        classifier = SavepointClassifier(exceptions)
+        self.assertEqual(classifier.exceptions, (DatabaseError,))
+        self.assertEqual(classifier.classify(exception), action)
+
+
+@ddt.ddt
+class ClassifiedRetryTestCase(TestCase):
+    """
+    Test the decorators and generators with a classifier.
+    """
+
+    @ddt.data(
+        ((GONE_AWAY,), False, RECONNECT),
+        ((DEADLOCK,), False, RETRY),
+        ((), True, None),
+    )
+    @ddt.unpack
+    def test_exception_manager_suppresses(self, exceptions_to_raise, success, action):
+        mock_func.exceptions_to_raise = exceptions_to_raise
+        with ExceptionManager(exceptions_to_suppress=MYSQL_ERRORS) as exception_manager:
+            mock_func()
+
+        self.assertEqual(exception_manager.success, success)
+        self.assertEqual(exception_manager.action, action)
+
+    @ddt.data(FOREIGN_KEY, NO_TABLE, ValueError())
+    def test_exception_manager_raises(self, exception):
+        mock_func.exceptions_to_raise = (exception,)
+        with self.assertRaises(type(exception)):
+            with ExceptionManager(exceptions_to_suppress=MYSQL_ERRORS):
+                mock_func()
+
+    def test_generator_fails_fast(self):
+        mock_func.exceptions_to_raise = (FOREIGN_KEY, None)
+        attempts = []
+        with self.assertRaises(IntegrityError):
+            for exception_manager in exception_managers_until_success(exceptions_to_retry=MYSQL_ERRORS):
+                attempts.append(exception_manager)
+                with exception_manager:
+                    mock_func()
+
+        self.assertEqual(len(attempts), 1)
+
+    def test_generator_reconnects(self):
+        mock_func.exceptions_to_raise = (DEADLOCK, GONE_AWAY, None)
+        reconnect = Mock()
+        for exception_manager in exception_managers_until_success(
+            exceptions_to_retry=MYSQL_ERRORS, reconnect=reconnect
+        ):
+            with exception_manager:
+                mock_func()
+
+        self.assertEqual(reconnect.call_count, 1)
+
+    @patch('db_utils.transaction.close_connections')
+    def test_transactions_reconnect(self, mock_close_connections):
+        mock_func.exceptions_to_raise = (LOST, None)
+        for transaction_manager in read_committed_transactions(exceptions_to_retry=MYSQL_ERRORS, delay=0):
+            with transaction_manager:
+                mock_func()
+
+        mock_close_connections.assert_called_once_with(using=None)
+
+    @patch('db_utils.transaction.close_connections')
+    def test_decorator(self, mock_close_connections):
+        decorated = commit_on_success_with_read_committed(exceptions=MYSQL_ERRORS, delay=0)(mock_func)
+
+        mock_func.exceptions_to_raise = (DEADLOCK, LOST, None)
+        decorated()
+        mock_close_connections.assert_called_once_with(None)
+
+        mock_func.exceptions_to_raise = (FOREIGN_KEY, None)
+        with self.assertRaises(IntegrityError):
+            decorated()
+        self.assertEqual(mock_func.exceptions_to_raise, (None,))
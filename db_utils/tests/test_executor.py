@@ -0,0 +1,204 @@
+"""Tests for executor."""
+
+from functools import partial
+import sys
+import threading
+
+import ddt
+from mock import patch
+
+from django.db import DatabaseError, IntegrityError
+from django.test import TestCase
+
+from db_utils.backoff import ConstantBackoff
+from db_utils.errors import MySQLErrorClassifier
+from db_utils.executor import Future, FutureTimeout, TransactionExecutor
+from db_utils.transaction import (
+    commit_on_success_with_isolation_level_async, read_committed_transactions_async, set_mode_read_committed,
+)
+from db_utils.utils import exception_managers_until_success_async
+
+from test_utils import mock_func
+
+
+def return_thread(value=None):
+    """Return the name of the current thread and value."""
+    mock_func()
+    return threading.current_thread().name, value
+
+
+class FutureTestCase(TestCase):
+    """
+    Test the Future.
+    """
+
+    def test_result(self):
+        future = Future()
+        self.assertFalse(future.done())
+        future.set_result(1)
+        self.assertTrue(future.done())
+        self.assertEqual(future.result(), 1)
+        self.assertIsNone(future.exception())
+
+    def test_exception(self):
+        future = Future()
+        try:
+            raise IntegrityError()
+        except IntegrityError:
+            future.set_exception(sys.exc_info())
+
+        self.assertIsInstance(future.exception(), IntegrityError)
+        with self.assertRaises(IntegrityError):
+            future.result()
+
+    def test_timeout(self):
+        with self.assertRaises(FutureTimeout):
+            Future().result(timeout=0.01)
+
+    def test_callbacks(self):
+        future = Future()
+        results = []
+        future.add_done_callback(lambda done: results.append(done.result()))
+        future.set_result(1)
+        future.add_done_callback(lambda done: results.append(done.result() + 1))
+
+        self.assertEqual(results, [1, 2])
+
+    def test_failing_callback(self):
+        future = Future()
+        results = []
+        future.add_done_callback(lambda done: 1 / 0)
+        future.add_done_callback(lambda done: results.append(done.result()))
+        future.set_result(1)
+
+        self.assertEqual(results, [1])
+
+
+@ddt.ddt
+class TransactionExecutorTestCase(TestCase):
+    """
+    Test the TransactionExecutor and the functions which use it.
+    """
+
+    def setUp(self):
+        super(TransactionExecutorTestCase, self).setUp()
+        self.executor = TransactionExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+        mock_func.exceptions_to_raise = ()
+
+    def test_submit(self):
+        thread, value = self.executor.submit(return_thread, 1).result(timeout=5)
+        self.assertEqual(thread, 'db_utils-worker')
+        self.assertEqual(value, 1)
+
+    def test_submit_exception(self):
+        mock_func.exceptions_to_raise = (IntegrityError,)
+        with self.assertRaises(IntegrityError):
+            self.executor.submit(return_thread).result(timeout=5)
+
+    def test_call_later(self):
+        called = threading.Event()
+        self.executor.call_later(0.2, called.set)
+        self.executor.call_later(0.01, lambda: self.assertFalse(called.is_set()))
+        self.assertTrue(called.wait(5))
+
+    def test_shutdown(self):
+        self.executor.submit(return_thread).result(timeout=5)
+        self.executor.shutdown()
+        with self.assertRaises(RuntimeError):
+            self.executor.submit(return_thread)
+
+    @ddt.data(
+        ((IntegrityError, None), None),
+        ((IntegrityError, IntegrityError, None), None),
+        ((IntegrityError, IntegrityError, IntegrityError), IntegrityError),
+        ((DatabaseError,), DatabaseError),
+    )
+    @ddt.unpack
+    def test_exception_managers_until_success_async(self, exceptions_to_raise, exception_to_assert):
+        mock_func.exceptions_to_raise = exceptions_to_raise
+        future = exception_managers_until_success_async(
+            partial(return_thread, 1), exceptions_to_retry=(IntegrityError,), executor=self.executor,
+        )
+
+        if exception_to_assert:
+            self.assertIsInstance(future.exception(timeout=5), exception_to_assert)
+        else:
+            self.assertEqual(future.result(timeout=5), ('db_utils-worker', 1))
+
+    @patch('db_utils.utils.time.sleep')
+    def test_backoff_does_not_sleep(self, mock_sleep):
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        future = exception_managers_until_success_async(
+            return_thread, exceptions_to_retry=(IntegrityError,), backoff=ConstantBackoff(base=0.05),
+            executor=self.executor,
+        )
+
+        future.result(timeout=5)
+        self.assertFalse(mock_sleep.called)
+
+    def test_reconnect_on_worker(self):
+        threads = []
+        mock_func.exceptions_to_raise = (DatabaseError(2006, 'MySQL server has gone away'), None)
+        future = exception_managers_until_success_async(
+            return_thread, exceptions_to_retry=MySQLErrorClassifier(),
+            reconnect=lambda: threads.append(threading.current_thread().name), executor=self.executor,
+        )
+
+        future.result(timeout=5)
+        self.assertEqual(threads, ['db_utils-worker'])
+
+    def test_failing_reconnect_fails_future(self):
+        mock_func.exceptions_to_raise = (DatabaseError(2006, 'MySQL server has gone away'), None)
+
+        def reconnect():
+            """Fail to reconnect."""
+            raise ValueError('reconnect')
+
+        future = exception_managers_until_success_async(
+            return_thread, exceptions_to_retry=MySQLErrorClassifier(), reconnect=reconnect, executor=self.executor,
+        )
+
+        self.assertIsInstance(future.exception(timeout=5), ValueError)
+
+    def test_shutdown_fails_scheduled_retries(self):
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        scheduled = threading.Event()
+        original_call_later = self.executor.call_later
+
+        def call_later(delay, func, *args, **kwargs):
+            """Signal that the retry was scheduled."""
+            original_call_later(delay, func, *args, **kwargs)
+            if delay:
+                scheduled.set()
+
+        with patch.object(self.executor, 'call_later', call_later):
+            future = exception_managers_until_success_async(
+                return_thread, exceptions_to_retry=(IntegrityError,), delay=60, executor=self.executor,
+            )
+            self.assertTrue(scheduled.wait(5))
+        self.executor.shutdown()
+
+        self.assertIsInstance(future.exception(timeout=5), RuntimeError)
+
+    @ddt.data(((IntegrityError, None), None), ((IntegrityError,) * 3, IntegrityError))
+    @ddt.unpack
+    def test_decorator(self, exceptions_to_raise, exception_to_assert):
+        mock_func.exceptions_to_raise = exceptions_to_raise
+        decorated = commit_on_success_with_isolation_level_async(
+            set_mode_read_committed, delay=0, executor=self.executor
+        )(return_thread)
+
+        future = decorated(value=1)
+        if exception_to_assert:
+            self.assertIsInstance(future.exception(timeout=5), exception_to_assert)
+        else:
+            self.assertEqual(future.result(timeout=5), ('db_utils-worker', 1))
+
+    def test_read_committed_transactions_async(self):
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        with patch('db_utils.transaction.set_mode_read_committed') as mock_set_mode:
+            future = read_committed_transactions_async(return_thread, delay=0, executor=self.executor)
+            self.assertEqual(future.result(timeout=5)[0], 'db_utils-worker')
+
+        self.assertEqual(mock_set_mode.call_count, 2)
@@ -0,0 +1,145 @@
+"""Tests for faults."""
+
+import ddt
+from mock import patch
+
+from django.contrib.auth.models import User
+from django.db import connection, DatabaseError, IntegrityError
+from django.test import TransactionTestCase
+
+from db_utils.budget import RetryBudget
+from db_utils.errors import MYSQL_ERRORS, RECONNECT, RETRY
+from db_utils.faults import (
+    FaultInjector, FaultRule, get_exception, DEADLOCK, DISCONNECT, INTEGRITY_ERROR, LOCK_WAIT_TIMEOUT,
+)
+from db_utils.transaction import commit_on_success_with_read_committed, read_committed_transactions
+
+
+def create_user(username='student'):
+    """Create a user."""
+    return User.objects.create(username=username, email=username + '@edx.org')
+
+
+@ddt.ddt
+class FaultRuleTestCase(TransactionTestCase):
+    """
+    Test the FaultRules.
+    """
+
+    @ddt.data(
+        (INTEGRITY_ERROR, IntegrityError, RETRY),
+        (DEADLOCK, DatabaseError, RETRY),
+        (LOCK_WAIT_TIMEOUT, DatabaseError, RETRY),
+        (DISCONNECT, DatabaseError, RECONNECT),
+    )
+    @ddt.unpack
+    def test_faults_are_classified(self, fault, exception_class, action):
+        exception = get_exception(fault)
+        self.assertIsInstance(exception, exception_class)
+        self.assertEqual(MYSQL_ERRORS.classify(exception), action)
+
+    def test_sequence(self):
+        rule = FaultRule([DEADLOCK, None, DEADLOCK])
+        self.assertEqual([rule.next_fault(None) for __ in xrange(3)], [DEADLOCK, None, DEADLOCK])
+        self.assertFalse(rule.matches('SELECT 1', set()))
+        self.assertEqual(rule.injected, 2)
+
+    def test_probability_is_deterministic(self):
+        first = FaultInjector(seed=1)
+        first.add(DEADLOCK, probability=0.5)
+        second = FaultInjector(seed=1)
+        second.add(DEADLOCK, probability=0.5)
+
+        faults = [first.get_fault('SELECT 1', set()) for __ in xrange(100)]
+        self.assertEqual(faults, [second.get_fault('SELECT 1', set()) for __ in xrange(100)])
+        self.assertTrue(20 < faults.count(DEADLOCK) < 80)
+
+    @ddt.data(
+        ({}, True),
+        ({'func_path': 'app.view'}, True),
+        ({'func_path': 'app.other'}, False),
+        ({'sql': r'^INSERT'}, True),
+        ({'sql': r'^SELECT'}, False),
+        ({'max_faults': 0}, False),
+    )
+    @ddt.unpack
+    def test_matches(self, kwargs, matches):
+        rule = FaultRule(DEADLOCK, **kwargs)
+        self.assertEqual(rule.matches('INSERT INTO a VALUES (%s)', set(['app.view'])), matches)
+
+
+class FaultInjectorTestCase(TransactionTestCase):
+    """
+    Test injecting faults into the decorators and generators.
+    """
+
+    def setUp(self):
+        super(FaultInjectorTestCase, self).setUp()
+        self.injector = FaultInjector(seed=0)
+        self.injector.install()
+        self.addCleanup(self.injector.uninstall)
+
+    def test_install(self):
+        with self.assertRaises(RuntimeError):
+            FaultInjector().install()
+
+        self.injector.add(DEADLOCK)
+        with self.assertRaises(DatabaseError):
+            create_user()
+
+        self.injector.uninstall()
+        create_user()
+        self.injector.uninstall()
+
+    @patch('db_utils.transaction.time.sleep')
+    def test_decorator_retries(self, mock_sleep):
+        self.injector.add([DEADLOCK, LOCK_WAIT_TIMEOUT], func_path='db_utils.tests.test_faults.create_user')
+        user = commit_on_success_with_read_committed(exceptions=MYSQL_ERRORS, delay=0.5)(create_user)()
+
+        self.assertEqual(User.objects.get().pk, user.pk)
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertEqual(dict(self.injector.injected), {DEADLOCK: 1, LOCK_WAIT_TIMEOUT: 1})
+
+    @patch('db_utils.transaction.time.sleep')
+    @patch('db_utils.transaction.close_connections')
+    def test_decorator_reconnects(self, mock_close_connections, mock_sleep):  # pylint: disable=unused-argument
+        self.injector.add([DISCONNECT], sql=r'^INSERT')
+        commit_on_success_with_read_committed(exceptions=MYSQL_ERRORS)(create_user)()
+
+        self.assertEqual(mock_close_connections.call_count, 1)
+        self.assertEqual(User.objects.count(), 1)
+
+    @patch('db_utils.transaction.time.sleep')
+    def test_decorator_gives_up(self, mock_sleep):  # pylint: disable=unused-argument
+        self.injector.add(INTEGRITY_ERROR, sql=r'^INSERT')
+        with self.assertRaises(IntegrityError):
+            commit_on_success_with_read_committed(max_attempts=4)(create_user)()
+
+        self.assertEqual(self.injector.injected[INTEGRITY_ERROR], 4)
+        self.injector.clear()
+        self.assertEqual(User.objects.count(), 0)
+
+    @patch('db_utils.transaction.time.sleep')
+    def test_budget(self, mock_sleep):  # pylint: disable=unused-argument
+        budget = RetryBudget(ratio=0, min_retries=1)
+        self.injector.add(DEADLOCK, sql=r'^INSERT')
+        decorated = commit_on_success_with_read_committed(exceptions=MYSQL_ERRORS, max_attempts=5, budget=budget)(
+            create_user
+        )
+        with self.assertRaises(DatabaseError):
+            decorated()
+
+        self.assertEqual(self.injector.injected[DEADLOCK], 2)
+
+    @patch('db_utils.utils.time.sleep')
+    def test_generator(self, mock_sleep):  # pylint: disable=unused-argument
+        self.injector.add([IntegrityError, None], func_path='db_utils.tests.test_faults.test_generator')
+        attempts = 0
+        for transaction_manager in read_committed_transactions():
+            with transaction_manager:
+                attempts += 1
+                create_user()
+
+        self.assertEqual(attempts, 2)
+        self.assertEqual(User.objects.count(), 1)
+        self.assertIsNotNone(connection.cursor())
@@ -0,0 +1,322 @@
+"""Tests for locks."""
+
+import shutil
+import tempfile
+import threading
+import time
+
+import ddt
+from mock import Mock, patch
+
+from django.db import connections, DatabaseError, IntegrityError, DEFAULT_DB_ALIAS
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from db_utils.locks import (
+    StripedLock, LockTimeout, get_lock_key, get_lock_name, locked_context_manager, named_lock,
+    MAX_LOCK_NAME_LENGTH,
+)
+from db_utils.transaction import (
+    commit_on_success_with_read_committed, read_committed_transactions, savepoint_transactions,
+)
+
+from test_utils import mock_func
+
+
+def acquire_in_thread(lock):
+    """Return True if another thread can acquire the lock without waiting."""
+    results = []
+
+    def acquire():
+        """Try to acquire the lock."""
+        acquired = lock.acquire(False)
+        if acquired:
+            lock.release()
+        results.append(acquired)
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+def named_lock_in_thread(name):
+    """Return True if another thread can acquire the named lock without waiting."""
+    results = []
+
+    def acquire():
+        """Try to acquire the lock."""
+        try:
+            with named_lock(name, timeout=0):
+                results.append(True)
+        except LockTimeout:
+            results.append(False)
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+def mock_connections(vendor, results):
+    """Return a dict with a mock default connection whose cursor returns results."""
+    cursor = Mock()
+    cursor.fetchone.side_effect = [(result,) for result in results]
+    return {'default': Mock(vendor=vendor, cursor=Mock(return_value=cursor))}
+
+
+@ddt.ddt
+class StripedLockTestCase(TestCase):
+    """
+    Test the StripedLock.
+    """
+
+    def test_same_key_same_lock(self):
+        locks = StripedLock()
+        self.assertIs(locks.get('student'), locks.get('student'))
+        self.assertIs(locks.get(('student', 1)), locks.get(('student', 1)))
+
+    def test_stripes(self):
+        locks = StripedLock(stripes=4)
+        self.assertEqual(len(set(locks.get(index) for index in xrange(100))), 4)
+
+    def test_none(self):
+        self.assertIsNone(StripedLock().get(None))
+
+    def test_reentrant(self):
+        lock = StripedLock().get('student')
+        with lock:
+            with lock:
+                self.assertFalse(acquire_in_thread(lock))
+        self.assertTrue(acquire_in_thread(lock))
+
+    def test_locked_context_manager(self):
+        lock = StripedLock().get('student')
+        with locked_context_manager(lock, threading.Lock)():
+            self.assertFalse(acquire_in_thread(lock))
+        self.assertTrue(acquire_in_thread(lock))
+
+    def test_locked_context_manager_exception(self):
+        lock = StripedLock().get('student')
+        with self.assertRaises(IntegrityError):
+            with locked_context_manager(lock, threading.Lock)():
+                raise IntegrityError()
+        self.assertTrue(acquire_in_thread(lock))
+
+    def test_no_lock(self):
+        self.assertIs(locked_context_manager(None, threading.Lock), threading.Lock)
+
+    @ddt.data(('student', 1), ('student', 'student'))
+    @ddt.unpack
+    def test_decorator_serializes_same_key(self, key_1, key_2):
+        locks = StripedLock()
+        active = []
+        overlaps = []
+
+        @commit_on_success_with_read_committed(key=lambda username: username, locks=locks)
+        def create(username):  # pylint: disable=unused-argument
+            """Record whether another call is running at the same time."""
+            active.append(username)
+            overlaps.append(len(active) > 1)
+            time.sleep(0.01)
+            active.remove(username)
+
+        threads = [threading.Thread(target=create, args=(key,)) for key in (key_1, key_2, key_1, key_2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(overlaps), 4)
+        if key_1 == key_2:
+            self.assertFalse(any(overlaps))
+
+    def test_decorator_lock_is_released_on_retry(self):
+        locks = StripedLock()
+        lock = locks.get('student')
+        held = []
+
+        @commit_on_success_with_read_committed(delay=0, key=lambda username: username, locks=locks)
+        def create(username):  # pylint: disable=unused-argument
+            """Record whether the lock is held and raise."""
+            held.append(not acquire_in_thread(lock))
+            mock_func()
+
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        create('student')
+
+        self.assertEqual(held, [True, True])
+        self.assertTrue(acquire_in_thread(lock))
+
+    @ddt.data(read_committed_transactions, savepoint_transactions)
+    def test_generator(self, transaction_manager_generator):
+        locks = StripedLock()
+        lock = locks.get('student')
+        held = []
+
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        for transaction_manager in transaction_manager_generator(delay=0, key='student', locks=locks):
+            with transaction_manager:
+                held.append(not acquire_in_thread(lock))
+                mock_func()
+
+        self.assertEqual(held, [True, True])
+        self.assertTrue(acquire_in_thread(lock))
+
+
+@ddt.ddt
+class NamedLockTestCase(TestCase):
+    """
+    Test the NamedLock.
+    """
+
+    def setUp(self):
+        super(NamedLockTestCase, self).setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(DB_UTILS_LOCK_DIRECTORY=directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    @ddt.data(
+        ('user:student', 'user:student'),
+        (u'user:\xfc', 'user:\xc3\xbc'),
+        (1, '1'),
+        ('x' * MAX_LOCK_NAME_LENGTH, 'x' * MAX_LOCK_NAME_LENGTH),
+    )
+    @ddt.unpack
+    def test_short_name(self, name, lock_name):
+        self.assertEqual(get_lock_name(name), lock_name)
+
+    def test_long_name(self):
+        name = get_lock_name('x' * (MAX_LOCK_NAME_LENGTH + 1))
+        self.assertLessEqual(len(name), MAX_LOCK_NAME_LENGTH)
+        self.assertNotEqual(name, get_lock_name('y' * (MAX_LOCK_NAME_LENGTH + 1)))
+
+    def test_lock_key(self):
+        key = get_lock_key('user:student')
+        self.assertEqual(key, get_lock_key('user:student'))
+        self.assertNotEqual(key, get_lock_key('user:staff'))
+        self.assertTrue(-2 ** 63 <= key < 2 ** 63)
+
+    def test_file_lock(self):
+        with named_lock('user:student'):
+            self.assertFalse(named_lock_in_thread('user:student'))
+            self.assertTrue(named_lock_in_thread('user:staff'))
+        self.assertTrue(named_lock_in_thread('user:student'))
+
+    def test_timeout(self):
+        acquired = threading.Event()
+
+        def hold():
+            """Hold the lock for a short time."""
+            with named_lock('user:student'):
+                acquired.set()
+                time.sleep(0.05)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        acquired.wait()
+        with self.assertRaises(LockTimeout):
+            named_lock('user:student', timeout=0).acquire()
+        with named_lock('user:student', timeout=5):
+            pass
+        thread.join()
+
+    def test_reentrant(self):
+        with named_lock('user:student'):
+            with named_lock('user:student'):
+                pass
+            self.assertFalse(named_lock_in_thread('user:student'))
+        self.assertTrue(named_lock_in_thread('user:student'))
+
+    @patch('db_utils.locks.transaction.commit_unless_managed')
+    def test_mysql(self, mock_commit_unless_managed):
+        connections = mock_connections('mysql', [1])
+        cursor = connections['default'].cursor()
+        with patch('db_utils.locks.connections', connections):
+            with named_lock('user:student', timeout=5):
+                cursor.execute.assert_called_once_with('SELECT GET_LOCK(%s, %s)', ['user:student', 5])
+            cursor.execute.assert_called_with('SELECT RELEASE_LOCK(%s)', ['user:student'])
+        self.assertEqual(mock_commit_unless_managed.call_count, 2)
+
+    @patch('db_utils.locks.transaction.commit_unless_managed')
+    def test_mysql_timeout(self, mock_commit_unless_managed):  # pylint: disable=unused-argument
+        with patch('db_utils.locks.connections', mock_connections('mysql', [0])):
+            with self.assertRaises(LockTimeout):
+                named_lock('user:student').acquire()
+
+    @patch('db_utils.locks.time.sleep')
+    @patch('db_utils.locks.transaction.commit_unless_managed')
+    def test_postgresql(self, mock_commit_unless_managed, mock_sleep):  # pylint: disable=unused-argument
+        connections = mock_connections('postgresql', [False, True])
+        cursor = connections['default'].cursor()
+        key = get_lock_key('user:student')
+        with patch('db_utils.locks.connections', connections):
+            with named_lock('user:student', timeout=None):
+                self.assertEqual(cursor.execute.call_count, 2)
+                cursor.execute.assert_called_with('SELECT pg_try_advisory_lock(%s)', [key])
+            cursor.execute.assert_called_with('SELECT pg_advisory_unlock(%s)', [key])
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    @patch('db_utils.locks.transaction.commit_unless_managed')
+    def test_release_lost_connection(self, mock_commit_unless_managed):  # pylint: disable=unused-argument
+        connections = mock_connections('mysql', [1])
+        with patch('db_utils.locks.connections', connections):
+            with named_lock('user:student'):
+                connections['default'].cursor().execute.side_effect = DatabaseError()
+        self.assertTrue(named_lock_in_thread('user:student'))
+
+    def test_decorator(self):
+        held = []
+
+        @commit_on_success_with_read_committed(delay=0, lock_name=lambda username: 'user:' + username)
+        def create(username):
+            """Record whether the lock is held and raise."""
+            held.append(not named_lock_in_thread('user:' + username))
+            mock_func()
+
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        create('student')
+
+        self.assertEqual(held, [True, True])
+        self.assertTrue(named_lock_in_thread('user:student'))
+
+    @override_settings(DB_UTILS_SESSION_ISOLATION_LEVEL=False)
+    @ddt.data(True, False)
+    def test_isolation_level_is_set_after_lock(self, use_decorator):
+        connections[DEFAULT_DB_ALIAS].cursor()  # Make sure the connection is open.
+        cursor = Mock()
+        cursor.fetchone.return_value = (1,)
+        for patcher in (
+            patch.object(connections[DEFAULT_DB_ALIAS], 'vendor', 'mysql'),
+            patch.object(connections[DEFAULT_DB_ALIAS], 'cursor', Mock(return_value=cursor)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        if use_decorator:
+            commit_on_success_with_read_committed(lock_name=lambda: 'user:student')(mock_func)()
+        else:
+            for transaction_manager in read_committed_transactions(lock_name='user:student'):
+                with transaction_manager:
+                    mock_func()
+
+        self.assertEqual([call[0][0] for call in cursor.execute.call_args_list], [
+            'SELECT GET_LOCK(%s, %s)',
+            'SET TRANSACTION ISOLATION LEVEL READ COMMITTED',
+            'SELECT RELEASE_LOCK(%s)',
+        ])
+
+    @ddt.data(read_committed_transactions, savepoint_transactions)
+    def test_generator(self, transaction_manager_generator):
+        held = []
+
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        for transaction_manager in transaction_manager_generator(delay=0, lock_name='user:student'):
+            with transaction_manager:
+                held.append(not named_lock_in_thread('user:student'))
+                mock_func()
+
+        self.assertEqual(held, [True, True])
+        self.assertTrue(named_lock_in_thread('user:student'))
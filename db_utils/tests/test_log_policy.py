@@ -0,0 +1,118 @@
+"""Tests for log_policy."""
+
+import logging
+import sys
+
+import ddt
+from mock import Mock, patch
+
+from django.db import IntegrityError
+from django.test import TestCase
+
+from db_utils.log_policy import LogPolicy, COMPACT, FULL, NONE
+from db_utils.transaction import commit_on_success_with_read_committed, read_committed_transactions
+
+from test_utils import mock_func
+
+
+def get_exc_info():
+    """Return the exc_info of an IntegrityError."""
+    try:
+        raise IntegrityError('column username is not unique')
+    except IntegrityError:
+        return sys.exc_info()
+
+
+@ddt.ddt
+class LogPolicyTestCase(TestCase):
+    """
+    Test the LogPolicy.
+    """
+
+    def setUp(self):
+        super(LogPolicyTestCase, self).setUp()
+        self.logger = Mock(isEnabledFor=Mock(return_value=True))
+        self.exc_info = get_exc_info()
+
+    def test_full(self):
+        LogPolicy(retries=FULL).log_retry(self.logger, 'app.view', 1, self.exc_info, 0.1)
+
+        self.logger.log.assert_called_once_with(
+            logging.ERROR, 'Error in %s on attempt %d. Retrying.', 'app.view', 1, exc_info=self.exc_info
+        )
+
+    def test_compact(self):
+        LogPolicy(retries=COMPACT, level=logging.WARNING).log_retry(self.logger, 'app.view', 2, self.exc_info, 0.1)
+
+        args, kwargs = self.logger.log.call_args
+        self.assertEqual(args[0], logging.WARNING)
+        self.assertEqual(
+            args[1] % args[2:],
+            'retry func_path=app.view attempt=2 exception=IntegrityError delay=0.100 suppressed=0 '
+            'message="column username is not unique"'
+        )
+        self.assertNotIn('exc_info', kwargs)
+
+    def test_none(self):
+        policy = LogPolicy(retries=NONE)
+        policy.log_retry(self.logger, 'app.view', 1, self.exc_info, 0.1)
+        policy.log_failure(self.logger, 'app.view', 2, self.exc_info)
+
+        self.assertFalse(self.logger.log.called)
+        self.logger.error.assert_called_once_with(
+            'Error in %s on attempt %d. %sRaising.', 'app.view', 2, '', exc_info=self.exc_info
+        )
+
+    def test_disabled_logger(self):
+        self.logger.isEnabledFor.return_value = False
+        policy = LogPolicy(min_interval=10)
+        policy.log_retry(self.logger, 'app.view', 1, self.exc_info, 0.1)
+
+        self.assertFalse(self.logger.log.called)
+        self.assertEqual(policy.last_records, {})
+
+    @ddt.data((0.0, 0), (0.5, 2), (1.0, 4))
+    @ddt.unpack
+    @patch('db_utils.log_policy.random.random')
+    def test_sample_rate(self, sample_rate, records, mock_random):
+        mock_random.side_effect = [0.1, 0.3, 0.6, 0.9]
+        policy = LogPolicy(sample_rate=sample_rate)
+        for attempt in xrange(1, 5):
+            policy.log_retry(self.logger, 'app.view', attempt, self.exc_info, 0.1)
+
+        self.assertEqual(self.logger.log.call_count, records)
+
+    @patch('db_utils.log_policy.time.time')
+    def test_min_interval(self, mock_time):
+        policy = LogPolicy(retries=COMPACT, min_interval=1)
+        for now in (100, 100.5, 100.9, 101.1):
+            mock_time.return_value = now
+            policy.log_retry(self.logger, 'app.view', 1, self.exc_info, 0.1)
+        policy.log_retry(self.logger, 'app.other', 1, self.exc_info, 0.1)
+
+        self.assertEqual(self.logger.log.call_count, 3)
+        # The second record of app.view reports the two suppressed ones.
+        self.assertEqual(self.logger.log.call_args_list[1][0][6], 2)
+
+    @patch('db_utils.transaction.time.sleep')
+    @patch('db_utils.transaction.log')
+    def test_decorator(self, mock_log, mock_sleep):
+        mock_log.isEnabledFor.return_value = True
+        mock_func.exceptions_to_raise = (IntegrityError, IntegrityError)
+        with self.assertRaises(IntegrityError):
+            commit_on_success_with_read_committed(max_attempts=2, log_policy=LogPolicy(retries=NONE))(mock_func)()
+
+        self.assertFalse(mock_log.log.called)
+        self.assertEqual(mock_log.error.call_count, 1)
+
+    @patch('db_utils.utils.time.sleep')
+    @patch('db_utils.utils.log')
+    def test_generator(self, mock_log, mock_sleep):
+        mock_log.isEnabledFor.return_value = True
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        for transaction_manager in read_committed_transactions(log_policy=LogPolicy(retries=COMPACT)):
+            with transaction_manager:
+                mock_func()
+
+        self.assertEqual(mock_log.log.call_count, 1)
+        self.assertEqual(mock_log.log.call_args[0][2], 'db_utils.tests.test_log_policy.test_generator')
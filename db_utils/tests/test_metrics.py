@@ -0,0 +1,102 @@
+"""Tests for metrics."""
+
+from mock import patch
+
+from django.db import IntegrityError
+from django.test import TestCase
+
+from db_utils.metrics import Histogram, MetricsAggregator, add_collector, remove_collector
+from db_utils.transaction import commit_on_success_with_read_committed, read_committed_transactions
+from db_utils.utils import exception_managers_until_success
+
+from test_utils import mock_func
+
+
+class HistogramTestCase(TestCase):
+    """
+    Test the Histogram.
+    """
+
+    def test_observe(self):
+        histogram = Histogram(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2, 3):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.snapshot(), {
+            'buckets': [(0.1, 2), (1, 3), ('+Inf', 5)],
+            'count': 5,
+            'sum': 5.65,
+        })
+
+
+class MetricsAggregatorTestCase(TestCase):
+    """
+    Test the MetricsAggregator.
+    """
+
+    def setUp(self):
+        super(MetricsAggregatorTestCase, self).setUp()
+        self.aggregator = MetricsAggregator(buckets=(0.1, 1))
+        add_collector(self.aggregator)
+        self.addCleanup(remove_collector, self.aggregator)
+
+    def test_record(self):
+        self.aggregator.record_attempt('app.view', 1, 0.5, 0.01, 0.02, IntegrityError)
+        self.aggregator.record_sleep('app.view', 0.1)
+        self.aggregator.record_attempt('app.view', 2, 0.2, 0.01, 0.02, None)
+
+        metrics = self.aggregator.snapshot()['app.view']
+        self.assertEqual(metrics['calls'], 1)
+        self.assertEqual(metrics['attempts'], 2)
+        self.assertEqual(metrics['retries'], 1)
+        self.assertEqual(metrics['failures'], 1)
+        self.assertEqual(metrics['exceptions'], {'IntegrityError': 1})
+        self.assertEqual(metrics['attempt_duration']['count'], 2)
+        self.assertEqual(metrics['sleep_duration']['buckets'], [(0.1, 1), (1, 1), ('+Inf', 1)])
+
+    def test_snapshot_reset(self):
+        self.aggregator.record_attempt('app.view', 1, 0.5, 0.01, 0.02, None)
+
+        self.assertEqual(self.aggregator.snapshot(reset=True).keys(), ['app.view'])
+        self.assertEqual(self.aggregator.snapshot(), {})
+
+        self.aggregator.record_attempt('app.view', 1, 0.5, 0.01, 0.02, None)
+        self.aggregator.reset()
+        self.assertEqual(self.aggregator.snapshot(), {})
+
+    @patch('db_utils.transaction.time.sleep')
+    def test_decorator(self, mock_sleep):
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        commit_on_success_with_read_committed(delay=0.1)(mock_func)()
+
+        metrics = self.aggregator.snapshot()['db_utils.tests.test_utils.mock_func']
+        self.assertEqual(metrics['calls'], 1)
+        self.assertEqual(metrics['attempts'], 2)
+        self.assertEqual(metrics['failures'], 1)
+        self.assertEqual(metrics['exceptions'], {'IntegrityError': 1})
+        self.assertEqual(metrics['sleep_duration']['sum'], 0.1)
+        self.assertEqual(metrics['setup_duration']['count'], 2)
+        self.assertEqual(metrics['commit_duration']['count'], 2)
+
+    @patch('db_utils.utils.time.sleep')
+    def test_generator(self, mock_sleep):
+        mock_func.exceptions_to_raise = (IntegrityError, IntegrityError, IntegrityError)
+        with self.assertRaises(IntegrityError):
+            for transaction_manager in read_committed_transactions(delay=0.1):
+                with transaction_manager:
+                    mock_func()
+
+        metrics = self.aggregator.snapshot()['db_utils.tests.test_metrics.test_generator']
+        self.assertEqual(metrics['calls'], 1)
+        self.assertEqual(metrics['attempts'], 3)
+        self.assertEqual(metrics['failures'], 3)
+        self.assertEqual(metrics['exceptions'], {'IntegrityError': 3})
+        self.assertEqual(metrics['sleep_duration']['count'], 2)
+
+    def test_generator_func_path(self):
+        mock_func.exceptions_to_raise = (ValueError,)
+        for exception_manager in exception_managers_until_success(exceptions_to_retry=(ValueError,), func_path='a.b'):
+            with exception_manager:
+                mock_func()
+
+        self.assertEqual(self.aggregator.snapshot()['a.b']['exceptions'], {'ValueError': 1})
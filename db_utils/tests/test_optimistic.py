@@ -0,0 +1,116 @@
+"""Tests for optimistic."""
+
+import threading
+
+from mock import Mock, patch
+
+from django.contrib.auth.models import Group, User
+from django.db import connection, connections, transaction
+from django.test import TransactionTestCase
+
+from db_utils.optimistic import get_instance, optimistic_update, StaleVersionError
+
+
+def next_version(version):
+    """Increment a version stored in a CharField."""
+    return str(int(version or 0) + 1)
+
+
+def update_concurrently(user):
+    """Increment the version of a user in another thread and connection."""
+    def update():  # pylint: disable=missing-docstring
+        try:
+            User.objects.filter(pk=user.pk).update(last_name=next_version(user.last_name))
+        finally:
+            connection.close()
+    thread = threading.Thread(target=update)
+    thread.start()
+    thread.join()
+
+
+@optimistic_update(User, version_field='last_name', next_version=next_version, delay=0)
+def rename(user, email, concurrent_updates=0):
+    """Change the email of a user, after other transactions updated it, and log the attempt."""
+    if rename.updates < concurrent_updates:
+        rename.updates += 1
+        update_concurrently(user)
+    Group.objects.create(name='attempt_{0}'.format(rename.updates))
+    user.email = email
+    return user.email
+
+
+class OptimisticUpdateTestCase(TransactionTestCase):
+    """
+    Test the optimistic_update decorator.
+    """
+
+    def setUp(self):
+        super(OptimisticUpdateTestCase, self).setUp()
+        self.user = User.objects.create(username='student', last_name='0')
+        rename.updates = 0
+
+    def test_update(self):
+        self.assertEqual(rename(self.user, 'new@edx.org'), 'new@edx.org')
+
+        self.assertEqual(self.user.last_name, '1')
+        user = User.objects.get()
+        self.assertEqual((user.email, user.last_name, user.username), ('new@edx.org', '1', 'student'))
+
+    def test_retry_reads_the_row_again(self):
+        self.assertEqual(rename(self.user.pk, 'new@edx.org', concurrent_updates=2), 'new@edx.org')
+
+        user = User.objects.get()
+        self.assertEqual((user.email, user.last_name), ('new@edx.org', '3'))
+        self.assertEqual(self.user.last_name, '0')
+        # The writes of the stale attempts were rolled back.
+        self.assertEqual(list(Group.objects.values_list('name', flat=True)), [u'attempt_2'])
+
+    def test_gives_up(self):
+        with self.assertRaises(StaleVersionError):
+            rename(self.user, 'new@edx.org', concurrent_updates=3)
+
+        user = User.objects.get()
+        self.assertEqual((user.email, user.last_name), ('', '3'))
+        self.assertFalse(Group.objects.exists())
+
+    def begin(self):
+        """
+        Start a transaction.
+
+        pysqlite only allows savepoints in transactions started with BEGIN
+        while the connection is in autocommit mode.
+        """
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        if connection.vendor == 'sqlite':
+            connection.cursor()
+            connection.connection.isolation_level = None
+            self.addCleanup(connection.close)
+            connection.cursor().execute('BEGIN')
+
+    def rollback(self):
+        """Roll back the transaction."""
+        transaction.rollback()
+        transaction.leave_transaction_management()
+
+    def test_open_transaction_is_not_committed(self):
+        self.begin()
+        User.objects.create(username='other')
+        with patch('db_utils.optimistic.update_version', side_effect=[StaleVersionError(), None]):
+            rename(self.user.pk, 'new@edx.org')
+        self.assertEqual(Group.objects.count(), 1)
+        self.rollback()
+
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), [u'student'])
+        self.assertFalse(Group.objects.exists())
+
+    @patch('db_utils.transaction.savepoints_supported', Mock(return_value=True))
+    def test_only_retries_lock_on_mysql(self):
+        self.begin()
+        with patch.object(connections['default'], 'vendor', 'mysql'):
+            with patch('db_utils.optimistic.get_instance', wraps=get_instance) as mock_get_instance:
+                with patch('db_utils.optimistic.update_version', side_effect=[StaleVersionError(), None]):
+                    rename(self.user.pk, 'new@edx.org')
+        self.rollback()
+
+        self.assertEqual([call[0][3] for call in mock_get_instance.call_args_list], [False, True])
@@ -0,0 +1,133 @@
+"""Tests for profiler."""
+
+from mock import patch
+
+from django.contrib.auth.models import User
+from django.db import connection, IntegrityError
+from django.test import TestCase, TransactionTestCase
+
+from db_utils.metrics import MetricsAggregator, MetricsCollector, add_collector, remove_collector
+from db_utils.profiler import AttemptProfile, MAX_SLOWEST
+from db_utils.transaction import commit_on_success_with_read_committed, read_committed_transactions
+
+from test_utils import mock_func
+
+
+USERNAMES = ('student_1', 'student_2', 'student_3')
+
+
+class ProfileCollector(MetricsCollector):
+    """
+    Collect the profiles of the attempts.
+    """
+    def __init__(self):
+        self.profiles = []
+
+    def record_profile(self, func_path, attempt, profile):
+        self.profiles.append((func_path, attempt, profile))
+
+
+def create_users():
+    """Create the users and look each of them up."""
+    for username in USERNAMES:
+        User.objects.create(username=username, email=username + '@edx.org')
+    for username in USERNAMES:
+        User.objects.get(username=username)
+    mock_func()
+
+
+class AttemptProfileTestCase(TestCase):
+    """
+    Test the AttemptProfile.
+    """
+
+    def test_add(self):
+        profile = AttemptProfile()
+        profile.add('SELECT 1', 0.5, 1)
+        profile.add('UPDATE a SET b = %s', 0.1, 3)
+        profile.add('UPDATE a SET b = %s', 0.2, -1)
+
+        self.assertEqual(profile.snapshot(), {
+            'statements': 3,
+            'duration': 0.8,
+            'rows': 3,
+            'slowest': [('SELECT 1', 0.5), ('UPDATE a SET b = %s', 0.2), ('UPDATE a SET b = %s', 0.1)],
+            'repeated': [('UPDATE a SET b = %s', 2)],
+        })
+
+    @patch('db_utils.profiler.MAX_TEMPLATES', 2)
+    def test_bounded(self):
+        profile = AttemptProfile()
+        for index in xrange(100):
+            profile.add('SELECT {0}'.format(index), index, -1)
+        profile.add('SELECT 0', 0, -1)
+
+        self.assertEqual(profile.statements, 101)
+        self.assertEqual([sql for sql, __ in profile.get_slowest()], [
+            'SELECT {0}'.format(index) for index in xrange(99, 99 - MAX_SLOWEST, -1)
+        ])
+        self.assertEqual(len(profile.templates), 2)
+        self.assertEqual(profile.get_repeated(), [('SELECT 0', 2)])
+
+
+class ProfilerTestCase(TransactionTestCase):
+    """
+    Test profiling the attempts of the decorators and generators.
+    """
+
+    def setUp(self):
+        super(ProfilerTestCase, self).setUp()
+        self.collector = ProfileCollector()
+        add_collector(self.collector)
+        self.addCleanup(remove_collector, self.collector)
+        mock_func.exceptions_to_raise = ()
+
+    def assert_profile(self, profile):
+        """Assert that profile contains the statements of create_users."""
+        self.assertGreaterEqual(profile.statements, 6)
+        self.assertGreater(profile.duration, 0)
+        self.assertEqual(profile.rows, len(USERNAMES))
+        repeated = dict(profile.get_repeated())
+        self.assertIn(len(USERNAMES), repeated.values())
+        self.assertNotIn('cursor', connection.__dict__)
+
+    def test_decorator(self):
+        commit_on_success_with_read_committed(profile=True)(create_users)()
+
+        [(func_path, attempt, profile)] = self.collector.profiles
+        self.assertEqual(func_path, 'db_utils.tests.test_profiler.create_users')
+        self.assertEqual(attempt, 1)
+        self.assert_profile(profile)
+
+    @patch('db_utils.transaction.time.sleep')
+    def test_decorator_retries(self, mock_sleep):  # pylint: disable=unused-argument
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        commit_on_success_with_read_committed(profile=True)(create_users)()
+
+        self.assertEqual([attempt for __, attempt, __ in self.collector.profiles], [1, 2])
+        for __, __, profile in self.collector.profiles:
+            self.assert_profile(profile)
+
+    def test_generator(self):
+        for transaction_manager in read_committed_transactions(profile=True):
+            with transaction_manager:
+                create_users()
+
+        [(func_path, attempt, profile)] = self.collector.profiles
+        self.assertEqual(func_path, 'db_utils.tests.test_profiler.test_generator')
+        self.assertEqual(attempt, 1)
+        self.assert_profile(profile)
+
+    def test_disabled(self):
+        commit_on_success_with_read_committed()(create_users)()
+        self.assertEqual(self.collector.profiles, [])
+
+    def test_aggregator(self):
+        aggregator = MetricsAggregator()
+        add_collector(aggregator)
+        self.addCleanup(remove_collector, aggregator)
+
+        commit_on_success_with_read_committed(profile=True)(create_users)()
+        metrics = aggregator.snapshot()['db_utils.tests.test_profiler.create_users']
+        self.assertEqual(metrics['statements']['count'], 1)
+        self.assertEqual(metrics['rows'], len(USERNAMES))
@@ -1,20 +1,24 @@
 """Tests for db module."""
 
 import ddt
-from mock import patch
+from mock import Mock, patch
 import threading
 import time
 import unittest
 
 from django.contrib.auth.models import User
-from django.db import connection, DatabaseError, IntegrityError
+from django.db import connection, connections, transaction, DatabaseError, DEFAULT_DB_ALIAS, IntegrityError
 from django.db.transaction import commit_on_success, TransactionManagementError
 from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
 
+from db_utils.backoff import ExponentialBackoff
 from db_utils.transaction import (
     commit_on_success_with_repeatable_read, commit_on_success_with_read_committed,
-    repeatable_read_transactions, read_committed_transactions,
+    repeatable_read_transactions, read_committed_transactions, reset_isolation_level_cache, set_isolation_level,
+    get_aliases, savepoint_transactions, restore_session_timeouts, read_committed_chunks,
 )
+from db_utils.faults import FaultInjector, DEADLOCK, DISCONNECT, LOCK_WAIT_TIMEOUT
 
 from test_utils import mock_func
 
@@ -236,6 +240,7 @@ class TransactionDecoratorsTestCase(TransactionTestCase):
         (commit_on_success_with_repeatable_read,),
     )
     @ddt.unpack
+    @override_settings(DB_UTILS_SESSION_ISOLATION_LEVEL=False)
     @patch('db_utils.transaction.commit_open_transactions')
     def test_decoraters_database_errors(self, decorator, mock_commit_open_transactions):
         """
@@ -286,3 +291,418 @@ class TransactionRetryPatternTestCase(TestCase):
             for transaction_manager in transaction_manager_generator(max_attempts=2):
                 with transaction_manager:
                     mock_func()
+
+    @ddt.data(
+        (commit_on_success_with_repeatable_read,),
+        (commit_on_success_with_read_committed,),
+    )
+    @ddt.unpack
+    @patch('db_utils.transaction.time.sleep')
+    def test_decorator_backoff(self, decorator, mock_sleep):
+
+        mock_func.exceptions_to_raise = (IntegrityError, IntegrityError)
+        decorator(backoff=ExponentialBackoff(base=0.1))(mock_func)()
+
+        self.assertEqual([call[0][0] for call in mock_sleep.call_args_list], [0.1, 0.2])
+
+
+class IsolationLevelCacheTestCase(TestCase):
+    """
+    Tests that the isolation level is only set when it changes.
+    """
+
+    def setUp(self):
+        super(IsolationLevelCacheTestCase, self).setUp()
+        connection.cursor()  # Make sure the connection is open.
+        reset_isolation_level_cache(connection=connection)
+        self.cursor = Mock()
+        for patcher in (
+            patch.object(connections[DEFAULT_DB_ALIAS], 'vendor', 'mysql'),
+            patch.object(connections[DEFAULT_DB_ALIAS], 'cursor', Mock(return_value=self.cursor)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def executed(self):
+        """Return the executed statements."""
+        return [call[0][0] for call in self.cursor.execute.call_args_list]
+
+    def test_same_level_is_set_once(self):
+        set_isolation_level('READ COMMITTED')
+        set_isolation_level('READ COMMITTED')
+
+        self.assertEqual(self.executed(), ['SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED'])
+
+    def test_changed_level_is_set(self):
+        set_isolation_level('READ COMMITTED')
+        set_isolation_level('REPEATABLE READ')
+        set_isolation_level('READ COMMITTED')
+
+        self.assertEqual(self.executed(), [
+            'SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED',
+            'SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ',
+            'SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED',
+        ])
+
+    def test_reconnect_invalidates_cache(self):
+        set_isolation_level('READ COMMITTED')
+        reset_isolation_level_cache(connection=connection)
+        set_isolation_level('READ COMMITTED')
+
+        self.assertEqual(len(self.executed()), 2)
+
+    def test_new_raw_connection_invalidates_cache(self):
+        set_isolation_level('READ COMMITTED')
+        with patch.object(connections[DEFAULT_DB_ALIAS], 'connection', object()):
+            set_isolation_level('READ COMMITTED')
+
+        self.assertEqual(len(self.executed()), 2)
+
+    @override_settings(DB_UTILS_SESSION_ISOLATION_LEVEL=False)
+    def test_transaction_scope(self):
+        set_isolation_level('READ COMMITTED')
+        set_isolation_level('READ COMMITTED')
+
+        self.assertEqual(self.executed(), ['SET TRANSACTION ISOLATION LEVEL READ COMMITTED'] * 2)
+
+
+@ddt.ddt
+class SessionTimeoutsTestCase(TestCase):
+    """
+    Tests that the timeouts are set with the isolation level and restored.
+    """
+
+    def setUp(self):
+        super(SessionTimeoutsTestCase, self).setUp()
+        connection.cursor()  # Make sure the connection is open.
+        reset_isolation_level_cache(connection=connection)
+        self.cursor = Mock()
+        self.cursor.fetchone.return_value = ('50s', '2500', '0', '1000')
+        self.mock_vendor = patch.object(connections[DEFAULT_DB_ALIAS], 'vendor', 'mysql')
+        for patcher in (
+            self.mock_vendor,
+            patch.object(connections[DEFAULT_DB_ALIAS], 'cursor', Mock(return_value=self.cursor)),
+            patch.object(
+                connections[DEFAULT_DB_ALIAS], 'get_server_version', Mock(return_value=(5, 7, 22)), create=True
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def executed(self):
+        """Return the executed statements and their parameters."""
+        return [(call[0] + (None,))[:2] for call in self.cursor.execute.call_args_list]
+
+    def test_mysql(self):
+        set_isolation_level('READ COMMITTED', lock_wait_timeout=2.5, statement_timeout=1)
+        restore_session_timeouts()
+
+        self.assertEqual(self.executed(), [
+            (
+                'SET SESSION transaction_isolation = %s, '
+                '@db_utils_innodb_lock_wait_timeout = @@SESSION.innodb_lock_wait_timeout, '
+                'SESSION innodb_lock_wait_timeout = %s, '
+                '@db_utils_max_execution_time = @@SESSION.max_execution_time, SESSION max_execution_time = %s',
+                ['READ-COMMITTED', 3, 1000],
+            ),
+            (
+                'SET SESSION innodb_lock_wait_timeout = @db_utils_innodb_lock_wait_timeout, '
+                'SESSION max_execution_time = @db_utils_max_execution_time',
+                None,
+            ),
+        ])
+
+    def test_mysql_previous_values_are_saved_once(self):
+        set_isolation_level('READ COMMITTED', lock_wait_timeout=1)
+        set_isolation_level('READ COMMITTED', lock_wait_timeout=2)
+
+        self.assertEqual(self.executed()[1], ('SET SESSION innodb_lock_wait_timeout = %s', [2]))
+
+    @ddt.data(((5, 7, 22), 'transaction_isolation'), ((5, 6, 40), 'tx_isolation'))
+    @ddt.unpack
+    @override_settings(DB_UTILS_SESSION_ISOLATION_LEVEL=False)
+    def test_mysql_transaction_scope(self, version, variable):
+        connection.get_server_version.return_value = version
+        set_isolation_level('REPEATABLE READ', lock_wait_timeout=1)
+
+        self.assertEqual(self.executed(), [(
+            'SET @@{0} = %s, @db_utils_innodb_lock_wait_timeout = @@SESSION.innodb_lock_wait_timeout, '
+            'SESSION innodb_lock_wait_timeout = %s'.format(variable),
+            ['REPEATABLE-READ', 1],
+        )])
+
+    def test_postgresql(self):
+        self.mock_vendor.stop()
+        with patch.object(connections[DEFAULT_DB_ALIAS], 'vendor', 'postgresql'):
+            set_isolation_level('READ COMMITTED', lock_wait_timeout=2, statement_timeout=0.5)
+            restore_session_timeouts()
+        self.mock_vendor.start()
+
+        self.assertEqual(self.executed(), [
+            (
+                'SELECT current_setting(%s), set_config(%s, %s, false), '
+                'current_setting(%s), set_config(%s, %s, false)',
+                ['lock_timeout', 'lock_timeout', '2000', 'statement_timeout', 'statement_timeout', '500'],
+            ),
+            (
+                'SELECT set_config(%s, %s, false), set_config(%s, %s, false)',
+                ['lock_timeout', '50s', 'statement_timeout', '0'],
+            ),
+        ])
+
+    def test_restore_error_is_logged(self):
+        set_isolation_level('READ COMMITTED', lock_wait_timeout=1)
+        self.cursor.execute.side_effect = DatabaseError(2006, 'MySQL server has gone away')
+        with patch('db_utils.transaction.log') as mock_log:
+            restore_session_timeouts()
+        self.assertTrue(mock_log.exception.called)
+
+        self.cursor.execute.reset_mock()
+        restore_session_timeouts()
+        self.assertFalse(self.cursor.execute.called)
+
+    @ddt.data(commit_on_success_with_read_committed, commit_on_success_with_repeatable_read)
+    @patch('db_utils.transaction.time.sleep')
+    def test_decorator_restores_after_each_attempt(self, decorator, mock_sleep):  # pylint: disable=unused-argument
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        decorator(lock_wait_timeout=1)(mock_func)()
+
+        statements = [statement for statement, __ in self.executed()]
+        self.assertEqual(len(statements), 4)
+        self.assertEqual(statements[1], statements[3])
+        self.assertIn('SESSION innodb_lock_wait_timeout = @db_utils_innodb_lock_wait_timeout', statements[1])
+
+    def test_generator_restores(self):
+        for transaction_manager in read_committed_transactions(statement_timeout=2):
+            with transaction_manager:
+                self.assertEqual(len(self.executed()), 1)
+
+        self.assertEqual(self.executed()[1][0], 'SET SESSION max_execution_time = @db_utils_max_execution_time')
+
+
+@ddt.ddt
+class MultipleDatabasesTestCase(TransactionTestCase):
+    """
+    Tests using the decorators and generators on other databases.
+    """
+    multi_db = True
+
+    @ddt.data(
+        (None, [DEFAULT_DB_ALIAS]),
+        ('other', ['other']),
+        (['default', 'other'], ['default', 'other']),
+        (('other',), ['other']),
+    )
+    @ddt.unpack
+    def test_get_aliases(self, using, aliases):
+        self.assertEqual(get_aliases(using), aliases)
+
+    @ddt.data(
+        (commit_on_success_with_read_committed, 'READ COMMITTED'),
+        (commit_on_success_with_repeatable_read, 'REPEATABLE READ'),
+    )
+    @ddt.unpack
+    @patch('db_utils.transaction.set_isolation_level')
+    def test_decorator_sets_isolation_level_per_alias(self, decorator, isolation_level, mock_set_isolation_level):
+        decorator(using=['default', 'other'])(do_nothing)()
+
+        mock_set_isolation_level.assert_called_once_with(isolation_level, ['default', 'other'], None, None)
+
+    @ddt.data(
+        commit_on_success_with_read_committed,
+        commit_on_success_with_repeatable_read,
+    )
+    def test_decorator_commits_on_alias(self, decorator):
+
+        @decorator(using='other')
+        def create_user():
+            """Create a user on the other database."""
+            User.objects.using('other').create(username='student', email='student@edx.org')
+
+        create_user()
+
+        transaction.rollback(using='other')
+        self.assertTrue(User.objects.using('other').filter(username='student').exists())
+        self.assertFalse(User.objects.filter(username='student').exists())
+
+    @ddt.data(
+        repeatable_read_transactions,
+        read_committed_transactions,
+    )
+    def test_generator_commits_on_all_aliases(self, transaction_manager_generator):
+
+        for transaction_manager in transaction_manager_generator(using=['default', 'other']):
+            with transaction_manager:
+                User.objects.create(username='student', email='student@edx.org')
+                User.objects.using('other').create(username='student', email='student@edx.org')
+
+        for alias in ('default', 'other'):
+            transaction.rollback(using=alias)
+            self.assertTrue(User.objects.using(alias).filter(username='student').exists())
+
+    @ddt.data(
+        repeatable_read_transactions,
+        read_committed_transactions,
+    )
+    def test_generator_rolls_back_on_all_aliases(self, transaction_manager_generator):
+
+        with self.assertRaises(IntegrityError):
+            for transaction_manager in transaction_manager_generator(using=['default', 'other'], max_attempts=1):
+                with transaction_manager:
+                    User.objects.create(username='student', email='student@edx.org')
+                    User.objects.using('other').create(username='student', email='student@edx.org')
+                    User.objects.using('other').create(username='student', email='student@edx.org')
+
+        for alias in ('default', 'other'):
+            self.assertFalse(User.objects.using(alias).filter(username='student').exists())
+
+
+class SavepointTransactionsTestCase(TransactionTestCase):
+    """
+    Tests the savepoint_transactions generator.
+    """
+
+    def begin(self, autocommit=True):
+        """
+        Start the outer transaction.
+
+        pysqlite only allows savepoints in transactions started with BEGIN
+        while the connection is in autocommit mode.
+        """
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        if connection.vendor == 'sqlite' and autocommit:
+            connection.cursor()
+            connection.connection.isolation_level = None
+            self.addCleanup(connection.close)
+            connection.cursor().execute('BEGIN')
+
+    def end(self, commit):
+        """End the outer transaction."""
+        if commit:
+            transaction.commit()
+        else:
+            transaction.rollback()
+        transaction.leave_transaction_management()
+
+    def create_users(self, exceptions_to_raise):
+        """Create a user in the outer transaction and one in a retried block."""
+        User.objects.create(username='outer')
+        mock_func.exceptions_to_raise = exceptions_to_raise
+        attempts = 0
+        for transaction_manager in savepoint_transactions(delay=0):
+            with transaction_manager:
+                attempts += 1
+                User.objects.create(username='inner_{0}'.format(attempts))
+                mock_func()
+        return attempts
+
+    @patch('db_utils.transaction.commit_open_transactions')
+    def test_failed_attempts_are_rolled_back(self, mock_commit_open_transactions):
+        self.begin()
+        attempts = self.create_users((IntegrityError, IntegrityError))
+        self.end(commit=True)
+
+        self.assertEqual(attempts, 3)
+        self.assertEqual(
+            sorted(User.objects.values_list('username', flat=True)), [u'inner_3', u'outer']
+        )
+        self.assertFalse(mock_commit_open_transactions.called)
+
+    def test_outer_transaction_stays_open(self):
+        self.begin()
+        self.create_users((IntegrityError,))
+        self.end(commit=False)
+
+        self.assertFalse(User.objects.exists())
+
+    def test_outside_transaction(self):
+        self.create_users((IntegrityError,))
+
+        self.assertEqual(
+            sorted(User.objects.values_list('username', flat=True)), [u'inner_2', u'outer']
+        )
+
+    def test_deadlock_is_not_retried_in_transaction(self):
+        self.begin()
+        User.objects.create(username='outer')
+        deadlock = DatabaseError(1213, 'Deadlock found when trying to get lock; try restarting transaction')
+        mock_func.exceptions_to_raise = (deadlock, None)
+        attempts = 0
+        lost_savepoint = DatabaseError(1305, 'SAVEPOINT does not exist')
+        with patch('db_utils.transaction.savepoint_rollback', side_effect=lost_savepoint):
+            with self.assertRaises(DatabaseError) as context:
+                for transaction_manager in savepoint_transactions(exceptions_to_retry=(DatabaseError,), delay=0):
+                    with transaction_manager:
+                        attempts += 1
+                        mock_func()
+        self.end(commit=False)
+
+        self.assertIs(context.exception, deadlock)
+        self.assertEqual(attempts, 1)
+
+    @patch('db_utils.transaction.savepoints_supported', Mock(return_value=False))
+    def test_savepoints_not_supported(self):
+        self.begin(autocommit=False)
+        self.create_users((IntegrityError,))
+        self.end(commit=False)
+
+        # The open transaction was committed before the first attempt.
+        self.assertEqual(
+            sorted(User.objects.values_list('username', flat=True)), [u'inner_2', u'outer']
+        )
+
+
+@ddt.ddt
+class ReadCommittedChunksTestCase(TransactionTestCase):
+    """
+    Tests the read_committed_chunks generator.
+    """
+
+    def setUp(self):
+        super(ReadCommittedChunksTestCase, self).setUp()
+        self.users = [User.objects.create(username='user_{0}'.format(index)) for index in xrange(10)]
+        patcher = patch('db_utils.utils.time.sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @ddt.data((3, 4), (5, 3), (10, 2), (20, 1))
+    @ddt.unpack
+    def test_chunks(self, chunk_size, transactions):
+        mock_generator = Mock(wraps=read_committed_transactions)
+        with patch('db_utils.transaction.read_committed_transactions', mock_generator):
+            pks = []
+            for user in read_committed_chunks(User.objects.order_by('pk'), chunk_size=chunk_size):
+                self.assertFalse(transaction.is_managed())
+                pks.append(user.pk)
+
+        self.assertEqual(pks, [user.pk for user in self.users])
+        self.assertEqual(mock_generator.call_count, transactions)
+
+    def test_start_after(self):
+        queryset = User.objects.filter(username__in=['user_2', 'user_5', 'user_8'])
+        users = list(read_committed_chunks(queryset, chunk_size=1, start_after=self.users[2].pk))
+        self.assertEqual(users, [self.users[5], self.users[8]])
+        self.assertEqual(list(read_committed_chunks(User.objects.none())), [])
+
+    @ddt.data(DEADLOCK, LOCK_WAIT_TIMEOUT, DISCONNECT)
+    def test_failed_chunk_is_resumed(self, fault):
+        with FaultInjector() as injector:
+            injector.add([None, fault], sql=r'^SELECT')
+            users = list(read_committed_chunks(User.objects.all(), chunk_size=4))
+
+        self.assertEqual(dict(injector.injected), {fault: 1})
+        self.assertEqual(users, self.users)
+
+    def test_other_ordering(self):
+        with self.assertRaises(ValueError):
+            list(read_committed_chunks(User.objects.order_by('-username')))
+
+    def test_rows_committed_between_chunks_are_read(self):
+        usernames = []
+        for user in read_committed_chunks(User.objects.all(), chunk_size=5):
+            usernames.append(user.username)
+            if user.username == 'user_0':
+                User.objects.filter(username='user_9').update(username='renamed')
+
+        self.assertEqual(usernames[-1], 'renamed')
@@ -0,0 +1,96 @@
+"""Tests for upsert."""
+
+from mock import Mock, patch
+
+from django.contrib.auth.models import Group, User
+from django.db import connections, IntegrityError
+from django.test import TransactionTestCase
+
+from db_utils.upsert import safe_get_or_create, safe_get_or_create_many, upsert_supported
+
+
+class SafeGetOrCreateTestCase(TransactionTestCase):
+    """
+    Test safe_get_or_create.
+    """
+
+    def test_create(self):
+        with self.assertNumQueries(1):
+            user, created = safe_get_or_create(User, username='student', defaults={'email': 'student@edx.org'})
+
+        self.assertTrue(created)
+        self.assertEqual(User.objects.get(), user)
+        self.assertEqual(user.email, 'student@edx.org')
+        self.assertFalse(user._state.adding)  # pylint: disable=protected-access
+
+    def test_get(self):
+        existing = User.objects.create(username='student', email='old@edx.org')
+        with self.assertNumQueries(2):
+            user, created = safe_get_or_create(User, username='student', defaults={'email': 'new@edx.org'})
+
+        self.assertFalse(created)
+        self.assertEqual(user, existing)
+        self.assertEqual(user.email, 'old@edx.org')
+
+    def test_conflict_on_other_key(self):
+        User.objects.create(username='student')
+        with self.assertRaises(IntegrityError):
+            safe_get_or_create(User, email='student@edx.org', defaults={'username': 'student'})
+
+    def test_mysql_warnings_are_ignored(self):
+        connection = connections['default']
+        with patch.object(connection, 'vendor', 'mysql'), patch.object(connection, 'cursor') as mock_cursor:
+            cursor = mock_cursor.return_value
+            cursor.execute.side_effect = Warning("Duplicate entry 'student' for key 'username'")
+            cursor.rowcount = 0
+            with patch('db_utils.upsert.get_existing') as mock_get_existing:
+                result = safe_get_or_create(User, username='student')
+
+        self.assertEqual(result, (mock_get_existing.return_value, False))
+        self.assertTrue(cursor.execute.call_args[0][0].startswith('INSERT IGNORE INTO'))
+
+    def test_old_sqlite_is_not_supported(self):
+        with patch('django.db.backends.sqlite3.base.Database.sqlite_version_info', (3, 23, 1)):
+            self.assertFalse(upsert_supported('default'))
+        self.assertTrue(upsert_supported('default'))
+
+    @patch('db_utils.upsert.upsert_supported', Mock(return_value=False))
+    def test_fallback(self):
+        self.assertTrue(safe_get_or_create(User, username='student')[1])
+        self.assertFalse(safe_get_or_create(User, username='student')[1])
+        self.assertEqual(User.objects.count(), 1)
+
+
+class SafeGetOrCreateManyTestCase(TransactionTestCase):
+    """
+    Test safe_get_or_create_many.
+    """
+
+    def test_get_or_create_many(self):
+        existing = Group.objects.create(name='group_1')
+        rows = [{'name': 'group_{0}'.format(index)} for index in (2, 1, 3, 2)]
+        with self.assertNumQueries(2):
+            groups = safe_get_or_create_many(Group, rows, key_fields=['name'])
+
+        self.assertEqual([group.name for group in groups], ['group_2', 'group_1', 'group_3', 'group_2'])
+        self.assertEqual(groups[1], existing)
+        self.assertEqual(groups[0].pk, groups[3].pk)
+        self.assertEqual(Group.objects.count(), 3)
+        self.assertEqual(safe_get_or_create_many(Group, [], key_fields=['name']), [])
+
+    @patch('django.db.backends.sqlite3.base.DatabaseOperations.bulk_batch_size', lambda self, fields, objs: 2)
+    def test_batches(self):
+        rows = [{'username': 'user_{0}'.format(index), 'email': 'user@edx.org'} for index in xrange(5)]
+        with self.assertNumQueries(6):
+            users = safe_get_or_create_many(User, rows, key_fields=['username'])
+
+        self.assertEqual([user.username for user in users], [row['username'] for row in rows])
+        self.assertEqual(User.objects.count(), 5)
+
+    @patch('db_utils.upsert.upsert_supported', Mock(return_value=False))
+    def test_fallback(self):
+        Group.objects.create(name='group_1')
+        groups = safe_get_or_create_many(Group, [{'name': 'group_1'}, {'name': 'group_2'}], key_fields=['name'])
+
+        self.assertEqual([group.name for group in groups], ['group_1', 'group_2'])
+        self.assertEqual(Group.objects.count(), 2)
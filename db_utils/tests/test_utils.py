@@ -1,5 +1,7 @@
 """Tests for utils."""
 
+import sys
+
 import ddt
 
 from django.test import TestCase
@@ -129,6 +131,44 @@ class ExceptionManagerTestCase(TestCase):
 
         self.assertFalse(exception_manager.success)
 
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            ExceptionManager().attribute = True
+
+    def test_reset(self):
+        exception_manager = ExceptionManager(exceptions_to_suppress=(ValueError,))
+        with exception_manager:
+            raise ValueError()
+        self.assertFalse(exception_manager.success)
+        self.assertEqual(exception_manager.exception, ValueError)
+
+        exception_manager.reset()
+        with exception_manager:
+            pass
+        self.assertTrue(exception_manager.success)
+        self.assertIsNone(exception_manager.exc_info)
+        self.assertIsNone(exception_manager.exception)
+
+    def test_context_manager_per_block(self):
+        exception_manager = ExceptionManager(context_manager=MockContextManager)
+        MockContextManager.exception_to_raise = None
+        sub_context_managers = []
+        for __ in xrange(2):
+            exception_manager.reset()
+            with exception_manager:
+                sub_context_managers.append(exception_manager.sub_context_manager)
+
+        self.assertIsNot(sub_context_managers[0], sub_context_managers[1])
+
+    def test_clear_traceback(self):
+        with ExceptionManager(exceptions_to_suppress=(ValueError,)) as exception_manager:
+            raise ValueError()
+        self.assertIsNotNone(exception_manager.exc_info[2])
+
+        exception_manager.clear_traceback()
+        self.assertIs(exception_manager.exc_info[0], ValueError)
+        self.assertIsNone(exception_manager.exc_info[2])
+
 
 @ddt.ddt
 class RetryPatternTestCase(TestCase):
@@ -160,3 +200,25 @@ class RetryPatternTestCase(TestCase):
             for exception_manager in exception_managers_until_success(exceptions_to_retry=exceptions_to_retry, max_attempts=3):
                 with exception_manager:
                     mock_func()
+
+    def test_manager_is_reused(self):
+        mock_func.exceptions_to_raise = (ValueError, ValueError, None)
+        managers = []
+        for exception_manager in exception_managers_until_success(exceptions_to_retry=(ValueError,), max_attempts=3):
+            with exception_manager:
+                managers.append((exception_manager, exception_manager.attempt, exception_manager.exc_info))
+                mock_func()
+
+        self.assertEqual(len(set(manager for manager, __, __ in managers)), 1)
+        self.assertEqual([attempt for __, attempt, __ in managers], [1, 2, 3])
+        self.assertEqual([exc_info for __, __, exc_info in managers], [None, None, None])
+
+    def test_traceback_is_released_before_retry(self):
+        mock_func.exceptions_to_raise = (ValueError, None)
+        current_exceptions = []
+        for exception_manager in exception_managers_until_success(exceptions_to_retry=(ValueError,), max_attempts=3):
+            with exception_manager:
+                current_exceptions.append(sys.exc_info())
+                mock_func()
+
+        self.assertEqual(current_exceptions[1], (None, None, None))
@@ -0,0 +1,130 @@
+"""Tests for watchdog."""
+
+import threading
+
+from mock import patch
+
+from django.db import IntegrityError
+from django.test import TestCase
+
+from db_utils.metrics import MetricsAggregator, add_collector, remove_collector
+from db_utils.transaction import commit_on_success_with_read_committed, read_committed_transactions
+from db_utils.watchdog import TransactionWatchdog, get_watchdog, install_watchdog, uninstall_watchdog
+
+from test_utils import mock_func
+
+
+class TransactionWatchdogTestCase(TestCase):
+    """
+    Test the TransactionWatchdog.
+    """
+
+    def setUp(self):
+        super(TransactionWatchdogTestCase, self).setUp()
+        self.flagged = []
+        self.watchdog = TransactionWatchdog(threshold=5, interval=60, callbacks=[self.flagged.append])
+        self.addCleanup(self.watchdog.stop)
+
+    @patch('db_utils.watchdog.time.time', return_value=1000.0)
+    def test_flags_once(self, mock_time):  # pylint: disable=unused-argument
+        token = self.watchdog.watch('app.view', 2)
+        self.watchdog.watch('app.other', 1)
+
+        self.assertEqual(self.watchdog.check(now=1005.0), [])
+        long_transactions = self.watchdog.check(now=1006.0)
+        self.assertEqual(len(long_transactions), 2)
+        self.assertEqual(self.watchdog.check(now=1007.0), [])
+
+        long_transaction = [item for item in self.flagged if item.func_path == 'app.view'][0]
+        self.assertEqual(long_transaction.attempt, 2)
+        self.assertEqual(long_transaction.thread_id, threading.current_thread().ident)
+        self.assertEqual(long_transaction.duration, 6.0)
+
+        self.watchdog.unwatch(token)
+        self.assertEqual(len(self.watchdog.transactions), 1)
+
+    def test_failing_callback(self):
+        self.watchdog.callbacks.insert(0, lambda long_transaction: 1 / 0)
+        self.watchdog.watch('app.view', 1)
+        with patch('db_utils.watchdog.log') as mock_log:
+            self.watchdog.check(now=self.watchdog.transactions.values()[0].started + 10)
+
+        self.assertTrue(mock_log.exception.called)
+        self.assertEqual(len(self.flagged), 1)
+
+    def test_metrics(self):
+        aggregator = MetricsAggregator()
+        add_collector(aggregator)
+        self.addCleanup(remove_collector, aggregator)
+
+        self.watchdog.watch('app.view', 1)
+        self.watchdog.check(now=self.watchdog.transactions.values()[0].started + 10)
+        self.assertEqual(aggregator.snapshot()['app.view']['long_transactions'], 1)
+
+    def test_thread(self):
+        flagged = threading.Event()
+        watchdog = TransactionWatchdog(threshold=0, interval=0.01, callbacks=[lambda item: flagged.set()])
+        self.addCleanup(watchdog.stop)
+
+        watchdog.watch('app.view', 1)
+        self.assertEqual(watchdog.thread.name, 'db_utils-watchdog')
+        self.assertTrue(flagged.wait(5))
+
+        thread = watchdog.thread
+        watchdog.stop()
+        self.assertFalse(thread.is_alive())
+
+
+class InstalledWatchdogTestCase(TestCase):
+    """
+    Test that the decorators and generators register their transactions.
+    """
+
+    def setUp(self):
+        super(InstalledWatchdogTestCase, self).setUp()
+        self.flagged = []
+        self.watchdog = TransactionWatchdog(threshold=0, interval=60, callbacks=[self.flagged.append])
+        install_watchdog(self.watchdog)
+        self.addCleanup(uninstall_watchdog)
+
+    def check(self):
+        """Flag the open transactions."""
+        self.watchdog.check(now=max(item.started for item in self.watchdog.transactions.values()) + 1)
+
+    @patch('db_utils.transaction.time.sleep')
+    def test_decorator(self, mock_sleep):  # pylint: disable=unused-argument
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+
+        @commit_on_success_with_read_committed()
+        def view():
+            """Fail once and flag the open transaction."""
+            mock_func()
+            self.check()
+
+        view()
+        self.assertEqual([(item.func_path, item.attempt) for item in self.flagged], [
+            ('db_utils.tests.test_watchdog.view', 2),
+        ])
+        self.assertEqual(self.watchdog.transactions, {})
+
+    @patch('db_utils.utils.time.sleep')
+    def test_generator(self, mock_sleep):  # pylint: disable=unused-argument
+        mock_func.exceptions_to_raise = (IntegrityError, None)
+        for transaction_manager in read_committed_transactions():
+            with transaction_manager:
+                self.check()
+                mock_func()
+
+        self.assertEqual([(item.func_path, item.attempt) for item in self.flagged], [
+            ('db_utils.tests.test_watchdog.test_generator', 1),
+            ('db_utils.tests.test_watchdog.test_generator', 2),
+        ])
+        self.assertEqual(self.watchdog.transactions, {})
+
+    def test_uninstall(self):
+        self.watchdog.watch('app.view', 1)
+        self.assertIs(get_watchdog(), self.watchdog)
+
+        uninstall_watchdog()
+        self.assertIsNone(get_watchdog())
+        self.assertIsNone(self.watchdog.thread)
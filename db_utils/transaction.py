@@ -4,23 +4,44 @@ REPEATABLE READ and READ COMMITTED transactions and retrying in case of
 DatabaseErrors.
 """
 
-from contextlib import contextmanager
+from contextlib import contextmanager, nested
 import logging
+import math
+import sys
 import time
 
 from functools import partial, wraps
 
-from django.conf import settings
-from django.db import connection, transaction, IntegrityError
+from django.db import connections, transaction, DatabaseError, DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
 
-from utils import exception_managers_until_success
+from backoff import get_backoff
+from config import get_config, DATABASE_EXCEPTIONS, DELAY, MAX_ATTEMPTS  # pylint: disable=unused-import
+from errors import FAIL, RECONNECT, MYSQL_READ_ERRORS, SavepointClassifier
+from locks import get_named_lock, locked_context_manager, DEFAULT_LOCKS, LOCK_TIMEOUT
+from metrics import record_attempt, record_sleep, TimedContextManager
+from profiler import profiled
+from utils import exception_managers_until_success, exception_managers_until_success_async, get_caller_path
+from watchdog import watched
 
 
 log = logging.getLogger(__name__)
 
-DATABASE_EXCEPTIONS = (IntegrityError,)
-DELAY = 0.1
-MAX_ATTEMPTS = 3
+# The default number of rows read in one transaction by read_committed_chunks.
+CHUNK_SIZE = 1000
+
+# The session variables which implement the lock wait and statement timeouts
+# on each vendor and the functions converting seconds to their units.
+SESSION_TIMEOUTS = {
+    'mysql': (
+        ('lock_wait_timeout', 'innodb_lock_wait_timeout', lambda seconds: max(int(math.ceil(seconds)), 1)),
+        ('statement_timeout', 'max_execution_time', lambda seconds: int(seconds * 1000)),
+    ),
+    'postgresql': (
+        ('lock_wait_timeout', 'lock_timeout', lambda seconds: str(int(seconds * 1000))),
+        ('statement_timeout', 'statement_timeout', lambda seconds: str(int(seconds * 1000))),
+    ),
+}
 
 
 @contextmanager
@@ -28,110 +49,609 @@ def mock_commit_on_success():
     yield
 
 
-def transaction_context_manager():
-    if getattr(settings, 'DB_UTILS_ENABLE_TRANSACTIONS', True):
-        return transaction.commit_on_success
-    else:
+def get_aliases(using=None):
+    """
+    Return a list of database aliases.
+
+    Args:
+        using (str|list): A database alias, a list of aliases or None for the
+            default database.
+    """
+    if using is None:
+        return [DEFAULT_DB_ALIAS]
+    if isinstance(using, basestring):
+        return [using]
+    return list(using)
+
+
+def transaction_context_manager(using=None):
+    """
+    Return a function which creates a commit_on_success context manager for
+    each database in using.
+    """
+    if not get_config().enable_transactions:
         return mock_commit_on_success
 
+    aliases = get_aliases(using)
+    if len(aliases) == 1:
+        return partial(transaction.commit_on_success, using=aliases[0])
+    return lambda: nested(*[transaction.commit_on_success(using=alias) for alias in aliases])
 
-def commit_open_transactions():
+
+def commit_open_transactions(using=None):
     """
     Commit all open transactions.
+
+    Args:
+        using (str|list): The database aliases to commit on.
     """
-    if connection.transaction_state:
-        # Since MySQl does not have nested transactions we just need
-        # to do one commit to commit all.
-        # However, we do not call leave_transaction_management()
-        # because any surrounding context managers or decorators
-        # expect to handle that themselves when they exit.
-        connection.commit()
+    for alias in get_aliases(using):
+        connection = connections[alias]
+        if connection.transaction_state:
+            # Since MySQl does not have nested transactions we just need
+            # to do one commit to commit all.
+            # However, we do not call leave_transaction_management()
+            # because any surrounding context managers or decorators
+            # expect to handle that themselves when they exit.
+            connection.commit()
+
+
+def close_connections(using=None):
+    """
+    Close the connections so that the next query reconnects.
+
+    Args:
+        using (str|list): The database aliases to close.
+    """
+    for alias in get_aliases(using):
+        connections[alias].close()
+
+
+def reset_isolation_level_cache(sender=None, connection=None, **kwargs):  # pylint: disable=unused-argument
+    """
+    Forget the isolation level and the session timeouts which were set on the
+    connection.
+
+    This is connected to the connection_created signal so that the cache is
+    invalidated whenever Django reconnects to the database.
+    """
+    connection.db_utils_isolation_level = None
+    connection.db_utils_session_timeouts = None
+
+
+connection_created.connect(reset_isolation_level_cache, dispatch_uid='db_utils.reset_isolation_level_cache')
 
 
-def set_mode_read_committed():
+def get_session_timeouts(connection, lock_wait_timeout=None, statement_timeout=None):
+    """
+    Return a list of the session variables of the connection which implement
+    the timeouts that are not None and their values.
+    """
+    timeouts = {'lock_wait_timeout': lock_wait_timeout, 'statement_timeout': statement_timeout}
+    return [
+        (variable, convert(timeouts[name]))
+        for name, variable, convert in SESSION_TIMEOUTS.get(connection.vendor, ())
+        if timeouts[name] is not None
+    ]
+
+
+def get_isolation_level_variable(connection):
+    """
+    Return the name of the MySQL variable holding the isolation level.
+    """
+    if connection.get_server_version() >= (5, 7, 20):
+        return 'transaction_isolation'
+    return 'tx_isolation'
+
+
+def set_mysql_session(connection, isolation_level, session, variables):
+    """
+    Set the isolation level and the session variables of a MySQL connection
+    in a single SET statement.
+
+    The previous values of the variables are saved in user variables, unless
+    they were saved and not restored yet, so restore_session_timeouts() can
+    restore them without another round trip.
+    """
+    # The raw connection is part of the key so a new connection, which
+    # starts with the server default, never matches a stale entry.
+    state = (id(connection.connection), isolation_level)
+    pending = getattr(connection, 'db_utils_session_timeouts', None) or {}
+    assignments = []
+    params = []
+
+    if not session:
+        assignments.append('@@{0} = %s'.format(get_isolation_level_variable(connection)))
+        params.append(isolation_level.replace(' ', '-'))
+    elif getattr(connection, 'db_utils_isolation_level', None) != state:
+        assignments.append('SESSION {0} = %s'.format(get_isolation_level_variable(connection)))
+        params.append(isolation_level.replace(' ', '-'))
+
+    for variable, value in variables:
+        if variable not in pending:
+            assignments.append('@db_utils_{0} = @@SESSION.{0}'.format(variable))
+            pending[variable] = None
+        assignments.append('SESSION {0} = %s'.format(variable))
+        params.append(value)
+
+    connection.cursor().execute('SET {0}'.format(', '.join(assignments)), params)
+    connection.db_utils_session_timeouts = pending
+    if session:
+        connection.db_utils_isolation_level = state
+
+
+def set_postgresql_session(connection, variables):
+    """
+    Set the session variables of a PostgreSQL connection in a single query
+    which also returns the previous values, unless they were saved and not
+    restored yet.
+    """
+    pending = getattr(connection, 'db_utils_session_timeouts', None) or {}
+    columns = []
+    params = []
+    saved = []
+    for variable, value in variables:
+        if variable not in pending:
+            columns.append('current_setting(%s)')
+            params.append(variable)
+            saved.append((variable, len(columns) - 1))
+        columns.append('set_config(%s, %s, false)')
+        params.extend((variable, value))
+
+    cursor = connection.cursor()
+    cursor.execute('SELECT {0}'.format(', '.join(columns)), params)
+    row = cursor.fetchone()
+    for variable, index in saved:
+        pending[variable] = row[index]
+    connection.db_utils_session_timeouts = pending
+
+
+def set_isolation_level(isolation_level, using=None, lock_wait_timeout=None, statement_timeout=None):
+    """
+    If a database is MySQL set its isolation level of the next transaction.
+
+    If DB_UTILS_SESSION_ISOLATION_LEVEL is True (the default) the level is set
+    for the session and remembered per connection, so setting the level the
+    connection already has does not cost a round trip. Otherwise only the
+    level of the next transaction is set, on every call.
+
+    The timeouts are set for the session on MySQL and PostgreSQL, in the same
+    statement as the isolation level. restore_session_timeouts() restores
+    their previous values.
+
+    Args:
+        isolation_level (str): READ COMMITTED or REPEATABLE READ.
+        using (str|list): The database aliases to set the isolation level on.
+        lock_wait_timeout (float): The time in seconds a statement waits for
+            a row lock (innodb_lock_wait_timeout on MySQL, lock_timeout on
+            PostgreSQL).
+        statement_timeout (float): The time in seconds a statement may run
+            (max_execution_time on MySQL, which only limits SELECTs, and
+            statement_timeout on PostgreSQL).
+    """
+    session = get_config().session_isolation_level
+
+    for alias in get_aliases(using):
+        connection = connections[alias]
+        variables = get_session_timeouts(connection, lock_wait_timeout, statement_timeout)
+        if connection.vendor != 'mysql':
+            log.warning('Not MySQL. Unable to change transaction isolation level to %s.', isolation_level)
+            if variables:
+                connection.cursor()  # Make sure the connection is open.
+                set_postgresql_session(connection, variables)
+            continue
+
+        if variables:
+            connection.cursor()  # Make sure the connection is open.
+            set_mysql_session(connection, isolation_level, session, variables)
+            continue
+
+        cursor = connection.cursor()
+        if not session:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL {0}".format(isolation_level))
+            continue
+
+        # The raw connection is part of the key so a new connection, which
+        # starts with the server default, never matches a stale entry.
+        state = (id(connection.connection), isolation_level)
+        if getattr(connection, 'db_utils_isolation_level', None) == state:
+            continue
+
+        cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL {0}".format(isolation_level))
+        connection.db_utils_isolation_level = state
+
+
+def restore_session_timeouts(using=None):
+    """
+    Restore the session timeouts which set_isolation_level() changed to their
+    previous values, in a single statement per database.
+
+    Errors are logged, because the connection may be lost, in which case the
+    next one starts with the defaults anyway.
+
+    Args:
+        using (str|list): The database aliases to restore the timeouts on.
+    """
+    for alias in get_aliases(using):
+        connection = connections[alias]
+        pending = getattr(connection, 'db_utils_session_timeouts', None)
+        if not pending:
+            continue
+
+        connection.db_utils_session_timeouts = None
+        variables = sorted(pending.iteritems())
+        try:
+            cursor = connection.cursor()
+            if connection.vendor == 'mysql':
+                cursor.execute('SET {0}'.format(', '.join(
+                    'SESSION {0} = @db_utils_{0}'.format(variable) for variable, __ in variables
+                )))
+            else:
+                cursor.execute(
+                    'SELECT {0}'.format(', '.join(['set_config(%s, %s, false)'] * len(variables))),
+                    [param for variable in variables for param in variable],
+                )
+            transaction.commit_unless_managed(using=alias)
+        except DatabaseError:
+            log.exception('Unable to restore the session timeouts of %s.', alias)
+
+
+def session_timeouts_context_manager(context_manager, using=None):
+    """
+    Return a function which creates context_manager and restores the session
+    timeouts after it exits.
+    """
+    @contextmanager
+    def restoring_context_manager():  # pylint: disable=missing-docstring
+        try:
+            with context_manager():
+                yield
+        finally:
+            restore_session_timeouts(using)
+    return restoring_context_manager
+
+
+def set_mode_read_committed(using=None, lock_wait_timeout=None, statement_timeout=None):
     """
     Commit open transactions and if database is MySQL set isolation level
     of next transaction to READ COMMITTED.
+
+    Args:
+        using (str|list): The database aliases to change.
+        lock_wait_timeout (float): The time in seconds a statement waits for
+            a row lock, set for the session.
+        statement_timeout (float): The time in seconds a statement may run,
+            set for the session.
     """
-    if not getattr(settings, 'DB_UTILS_ENABLE_TRANSACTIONS', True):
+    if not get_config().enable_transactions:
         return
 
     # The isolation level cannot be changed while a transaction is in
     # progress. So we close any existing ones.
-    commit_open_transactions()
+    commit_open_transactions(using)
 
-    if connection.vendor == 'mysql':
-        cursor = connection.cursor()
-        cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
-    else:
-        log.warning('Not MySQL. Unable to change transaction isolation level to READ COMMITTED.')
+    set_isolation_level('READ COMMITTED', using, lock_wait_timeout, statement_timeout)
 
 
-def set_mode_repeatable_read():
+def set_mode_repeatable_read(using=None, lock_wait_timeout=None, statement_timeout=None):
     """
     Commit open transactions and if database is MySQL set isolation level
     of next transaction to REPEATABLE READ.
+
+    Args:
+        using (str|list): The database aliases to change.
+        lock_wait_timeout (float): The time in seconds a statement waits for
+            a row lock, set for the session.
+        statement_timeout (float): The time in seconds a statement may run,
+            set for the session.
     """
-    if not getattr(settings, 'DB_UTILS_ENABLE_TRANSACTIONS', True):
+    if not get_config().enable_transactions:
         return
 
     # The isolation level cannot be changed while a transaction is in
     # progress. So we close any existing ones.
-    commit_open_transactions()
+    commit_open_transactions(using)
 
-    if connection.vendor == 'mysql':
-        cursor = connection.cursor()
-        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+    set_isolation_level('REPEATABLE READ', using, lock_wait_timeout, statement_timeout)
+
+
+def savepoints_supported(connection):
+    """
+    Return True if savepoints can be created inside the open transaction of
+    the connection.
+
+    Django only uses savepoints on MySQL and PostgreSQL. On SQLite they work
+    if the connection is in autocommit mode and the transaction was started
+    with an explicit BEGIN, because otherwise pysqlite commits the open
+    transaction before executing a SAVEPOINT statement.
+    """
+    if connection.features.uses_savepoints:
+        return True
+    return (
+        connection.vendor == 'sqlite' and
+        connection.connection is not None and
+        connection.connection.isolation_level is None
+    )
+
+
+def savepoint_create(connection):
+    """
+    Create a savepoint and return its id.
+    """
+    sid = connection.savepoint()
+    if not connection.features.uses_savepoints:
+        connection.cursor().execute('SAVEPOINT {0}'.format(connection.ops.quote_name(sid)))
+    return sid
+
+
+def savepoint_rollback(connection, sid):
+    """
+    Roll back to a savepoint and release it.
+    """
+    connection.savepoint_rollback(sid)
+    if not connection.features.uses_savepoints:
+        connection.cursor().execute('ROLLBACK TO SAVEPOINT {0}'.format(connection.ops.quote_name(sid)))
+    savepoint_commit(connection, sid)
+
+
+def savepoint_commit(connection, sid):
+    """
+    Release a savepoint.
+    """
+    connection.savepoint_commit(sid)
+    if not connection.features.uses_savepoints:
+        connection.cursor().execute('RELEASE SAVEPOINT {0}'.format(connection.ops.quote_name(sid)))
+
+
+@contextmanager
+def savepoint_context_manager(using=None):
+    """
+    A context manager which runs the block in a savepoint on each database in
+    using and rolls back to the savepoints if the block raises an exception.
+
+    Outside of a transaction the block is run in a commit_on_success context
+    manager instead. If a transaction is open but savepoints are not
+    supported, the open transactions are committed first.
+    """
+    if not get_config().enable_transactions:
+        yield
+        return
+
+    aliases = get_aliases(using)
+    if not any(transaction.is_managed(using=alias) for alias in aliases):
+        with transaction_context_manager(aliases)():
+            yield
+        return
+
+    if not all(savepoints_supported(connections[alias]) for alias in aliases):
+        log.warning('Savepoints are not supported. Committing open transactions.')
+        commit_open_transactions(aliases)
+        with transaction_context_manager(aliases)():
+            yield
+        return
+
+    savepoints = [(connections[alias], savepoint_create(connections[alias])) for alias in aliases]
+    try:
+        yield
+    except:
+        exc_info = sys.exc_info()
+        try:
+            for connection, sid in reversed(savepoints):
+                savepoint_rollback(connection, sid)
+        except DatabaseError:
+            # E.g. a deadlock on MySQL rolled back the whole transaction and
+            # the savepoints with it. The original exception is raised.
+            log.warning('Could not roll back to the savepoint after %r.', exc_info[1], exc_info=True)
+        raise exc_info[0], exc_info[1], exc_info[2]
     else:
-        log.warning('Not MySQL. Unable to change transaction isolation level to REPEATABLE READ.')
+        for connection, sid in reversed(savepoints):
+            savepoint_commit(connection, sid)
+
+
+@contextmanager
+def setup_context_manager(setup, context_manager):
+    """
+    A context manager which calls setup and then enters context_manager.
+    """
+    setup()
+    with context_manager():
+        yield
+
+
+def locked_block_context_manager(context_manager, using, locks, key, lock_name, lock_timeout, setup=None):
+    """
+    Return a function which creates context_manager holding the striped lock
+    of key and the named lock called lock_name, if they are not None, and the
+    setup which is left to call before it.
+
+    The named lock is held on the first database in using. If a lock is held
+    the setup is called after acquiring it, right before entering
+    context_manager, and None is returned instead of it. Acquiring a named
+    lock runs a transaction, which would use up an isolation level that was
+    only set for the next transaction.
+    """
+    lock = locks.get(key)
+    named_lock = get_named_lock(lock_name, get_aliases(using)[0], lock_timeout)
+    if setup is not None and (lock is not None or named_lock is not None):
+        context_manager = partial(setup_context_manager, setup, context_manager)
+        setup = None
+    return locked_context_manager(lock, locked_context_manager(named_lock, context_manager)), setup
 
 
 def commit_on_success_with_isolation_level(
-    isolation_level_setup, exceptions=DATABASE_EXCEPTIONS, delay=DELAY, max_attempts=MAX_ATTEMPTS
+    isolation_level_setup, exceptions=None, delay=None, max_attempts=None, backoff=None,
+    using=None, budget=None, breaker=None, log_policy=None, key=None, locks=DEFAULT_LOCKS,
+    lock_name=None, lock_timeout=LOCK_TIMEOUT, adaptive=None, lock_wait_timeout=None, statement_timeout=None,
+    profile=False,
 ):
     """
     Decorator factory which accepts a function to set an isolation level,
     executes it and then runs the decorated function inside a
     commit_on_success context manager.
     If an exception which is in the exceptions tuple is raised, the above is
-    retried after a delay.
+    retried after a delay. If a lock is held, the isolation level is set
+    after acquiring it.
     
+    The exceptions, delay, max_attempts, backoff and log_policy default to
+    the DBUtilsConfig, which can also override them per function.
+
     Args:
         isolation_level_setup (function): A function to setup the
             the isolation level.
-        exceptions (tuple): A tuple of exceptions to catch.
+        exceptions (tuple): A tuple of exceptions to catch or an
+            ExceptionClassifier which decides whether to retry, reconnect and
+            retry, or raise.
         delay (float): Time to wait between attempts.
         max_attempts (int): Number of times to attempt the decorated function.
+        backoff (Backoff): A strategy to compute the time to wait between
+            attempts. Overrides delay. If the deadline of the strategy is
+            exceeded the last exception is raised.
+        using (str|list): The database aliases to run commit_on_success on.
+            isolation_level_setup has to handle the same aliases.
+        budget (RetryBudget): A budget shared with other functions. If it is
+            exhausted the exception is raised instead of retrying.
+        breaker (CircuitBreaker): A circuit breaker which raises
+            CircuitOpenError instead of calling the function after too many
+            consecutive retriable failures.
+        log_policy (LogPolicy): Decides how failed attempts are logged.
+        key (function): A function which is called with the arguments of the
+            decorated function and returns a hashable key, or None. Calls
+            with the same key run their transactions one at a time in this
+            process instead of racing each other in the database.
+        locks (StripedLock): The locks the keys are mapped to.
+        lock_name (function): A function which is called with the arguments
+            of the decorated function and returns the name of a NamedLock,
+            or None. Calls with the same name run their transactions one at
+            a time across all processes using the database.
+        lock_timeout (float): The time to wait for the named lock before
+            raising LockTimeout.
+        adaptive (AdaptiveRetry): Tunes the number of attempts and scales
+            the delays of the function based on how often its retries
+            succeeded. max_attempts is the starting point.
+        lock_wait_timeout (float): The time in seconds a statement waits for
+            a row lock. If it or statement_timeout is set, both are passed to
+            isolation_level_setup as keyword arguments and the previous
+            values are restored after each attempt.
+        statement_timeout (float): The time in seconds a statement may run.
+        profile (bool): Profile the statements of each attempt on the
+            databases in using and report them to the metrics collectors.
     """
+    context_manager_factory = transaction_context_manager
+    profile_aliases = get_aliases(using) if profile else None
+    if lock_wait_timeout is not None or statement_timeout is not None:
+        isolation_level_setup = partial(
+            isolation_level_setup, lock_wait_timeout=lock_wait_timeout, statement_timeout=statement_timeout
+        )
+        context_manager_factory = lambda using: session_timeouts_context_manager(
+            transaction_context_manager(using), using
+        )
 
     def decorator(func):
 
         func_path = '{0}.{1}'.format(func.__module__, func.__name__)
+        breaker_key = breaker.get_key(func_path, get_aliases(using)) if breaker is not None else None
 
         @wraps(func)
         def wrapper(*args, **kwargs):  # pylint: disable=missing-docstring
 
-            for attempt in xrange(1, max_attempts + 1):
+            options = get_config().get_retry_options(func_path, exceptions, delay, max_attempts, backoff, log_policy)
+            classifier = options.classifier
+
+            if breaker is not None:
+                breaker.before_call(breaker_key)
+            if budget is not None:
+                budget.deposit()
+
+            block_context_manager, setup = locked_block_context_manager(
+                context_manager_factory(using), using, locks,
+                key(*args, **kwargs) if key is not None else None,
+                lock_name(*args, **kwargs) if lock_name is not None else None,
+                lock_timeout, isolation_level_setup,
+            )
+
+            strategy = get_backoff(options.backoff, options.delay)
+            attempts = options.max_attempts
+            if adaptive is not None:
+                attempts, scale = adaptive.get_options(func_path, attempts, strategy.base)
+                schedule = strategy.start(scale)
+                conflict_durations = []
+            else:
+                schedule = strategy.start()
+
+            for attempt in xrange(1, attempts + 1):
+                started = time.time()
+                setup_duration = 0
+                context_manager = None
                 try:
-                    isolation_level_setup()
-                    with transaction_context_manager()():
-                        return func(*args, **kwargs)
-                except exceptions:
-                    if attempt == max_attempts:
-                        log.exception('Error in %s on attempt %d. Raising.', func_path, attempt)
+                    if setup is not None:
+                        setup()
+                    setup_duration = time.time() - started
+                    context_manager = TimedContextManager(watched(
+                        profiled(block_context_manager(), profile_aliases, func_path, attempt), func_path, attempt
+                    ))
+                    with context_manager:
+                        result = func(*args, **kwargs)
+                except:
+                    exc_type, exception = sys.exc_info()[:2]
+                    duration = time.time() - started
+                    record_attempt(
+                        func_path, attempt, duration, setup_duration,
+                        context_manager.exit_duration if context_manager else 0, exc_type,
+                    )
+                    if not isinstance(exception, classifier.exceptions):
+                        if breaker is not None:
+                            breaker.record_success(breaker_key)
+                        raise
+                    action = classifier.classify(exception)
+                    # Only retriable exceptions are outcomes of the retries
+                    # which the adaptive tuning learns from.
+                    retriable = action != FAIL
+                    if adaptive is not None and retriable:
+                        conflict_durations.append(duration)
+                    if breaker is not None:
+                        if action == FAIL:
+                            breaker.record_success(breaker_key)
+                        elif breaker.record_failure(breaker_key):
+                            log.warning('Circuit of %s is open.', breaker_key)
+                            action = FAIL
+                            retriable = False
+                    wait = schedule.next_delay(attempt) if attempt < attempts and action != FAIL else None
+                    if wait is not None and budget is not None and not budget.withdraw():
+                        log.warning('Retry budget exhausted in %s.', func_path)
+                        wait = None
+                        retriable = False
+                    if wait is None:
+                        options.log_policy.log_failure(log, func_path, attempt, sys.exc_info())
+                        if adaptive is not None and retriable:
+                            adaptive.record_call(func_path, attempt, False, conflict_durations)
                         raise
                     else:
-                        log.exception('Error in %s on attempt %d. Retrying.', func_path, attempt)
+                        options.log_policy.log_retry(log, func_path, attempt, sys.exc_info(), wait)
 
-                if delay > 0:
-                    time.sleep(delay)
+                    if action == RECONNECT:
+                        close_connections(using)
+                else:
+                    record_attempt(
+                        func_path, attempt, time.time() - started, setup_duration, context_manager.exit_duration, None
+                    )
+                    if breaker is not None:
+                        breaker.record_success(breaker_key)
+                    if adaptive is not None:
+                        adaptive.record_call(func_path, attempt, True, conflict_durations)
+                    return result
+
+                if wait > 0:
+                    record_sleep(func_path, wait)
+                    time.sleep(wait)
 
         return wrapper
     return decorator
 
 
 def commit_on_success_with_repeatable_read(
-        exceptions=DATABASE_EXCEPTIONS, delay=DELAY, max_attempts=MAX_ATTEMPTS,
+        exceptions=None, delay=None, max_attempts=None, backoff=None, using=None,
+        budget=None, breaker=None, log_policy=None, key=None, locks=DEFAULT_LOCKS, lock_name=None,
+        lock_timeout=LOCK_TIMEOUT, adaptive=None, lock_wait_timeout=None, statement_timeout=None, profile=False,
     ):
     """
     Decorator factory which sets isolation level to REPEATABLE READ, and
@@ -143,21 +663,69 @@ def commit_on_success_with_repeatable_read(
 
     Note: The isolation level is only changed on MySQL.
 
+    The exceptions, delay, max_attempts, backoff and log_policy default to
+    the DBUtilsConfig, which can also override them per function.
+
     Args:
-        exceptions (tuple): A tuple of exceptions to catch.
+        exceptions (tuple): A tuple of exceptions to catch or an
+            ExceptionClassifier.
         delay (float): Time to wait between attempts.
         max_attempts (int): Number of times to attempt the decorated function.
+        backoff (Backoff): A strategy to compute the time to wait between
+            attempts. Overrides delay.
+        using (str|list): A database alias or a list of aliases. Defaults to
+            the default database.
+        budget (RetryBudget): A budget shared with other functions. If it is
+            exhausted the exception is raised instead of retrying.
+        breaker (CircuitBreaker): A circuit breaker which raises
+            CircuitOpenError instead of calling the function after too many
+            consecutive retriable failures.
+        log_policy (LogPolicy): Decides how failed attempts are logged.
+        key (function): A function which is called with the arguments of the
+            decorated function and returns a hashable key, or None. Calls
+            with the same key run their transactions one at a time in this
+            process instead of racing each other in the database.
+        locks (StripedLock): The locks the keys are mapped to.
+        lock_name (function): A function which is called with the arguments
+            of the decorated function and returns the name of a NamedLock,
+            or None. Calls with the same name run their transactions one at
+            a time across all processes using the database.
+        lock_timeout (float): The time to wait for the named lock before
+            raising LockTimeout.
+        adaptive (AdaptiveRetry): Tunes the number of attempts and scales
+            the delays based on how often retries succeeded.
+        lock_wait_timeout (float): The time in seconds a statement waits for
+            a row lock. The previous value is restored after each attempt.
+        statement_timeout (float): The time in seconds a statement may run.
+            The previous value is restored after each attempt.
+        profile (bool): Profile the statements of each attempt and report
+            them to the metrics collectors.
     """
     return commit_on_success_with_isolation_level(
-        isolation_level_setup=set_mode_repeatable_read,
+        isolation_level_setup=partial(set_mode_repeatable_read, using=using),
         exceptions=exceptions,
         delay=delay,
         max_attempts=max_attempts,
+        backoff=backoff,
+        using=using,
+        budget=budget,
+        breaker=breaker,
+        log_policy=log_policy,
+        key=key,
+        locks=locks,
+        lock_name=lock_name,
+        lock_timeout=lock_timeout,
+        adaptive=adaptive,
+        lock_wait_timeout=lock_wait_timeout,
+        statement_timeout=statement_timeout,
+        profile=profile,
     )
 
 
 def commit_on_success_with_read_committed(
-        exceptions=DATABASE_EXCEPTIONS, delay=DELAY, max_attempts=MAX_ATTEMPTS,
+        exceptions=None, delay=None, max_attempts=None, backoff=None, using=None,
+        budget=None, breaker=None, log_policy=None, key=None, locks=DEFAULT_LOCKS, lock_name=None,
+        lock_timeout=LOCK_TIMEOUT, adaptive=None, lock_wait_timeout=None, statement_timeout=None, profile=False,
     ):
     """
     Decorator factory which sets isolation level to READ COMMITTED, and
@@ -169,21 +737,69 @@ def commit_on_success_with_read_committed(
 
     Note: The isolation level is only changed on MySQL.
 
+    The exceptions, delay, max_attempts, backoff and log_policy default to
+    the DBUtilsConfig, which can also override them per function.
+
     Args:
-        exceptions (tuple): A tuple of exceptions to catch.
+        exceptions (tuple): A tuple of exceptions to catch or an
+            ExceptionClassifier.
         delay (float): Time to wait between attempts.
         max_attempts (int): Number of times to attempt the decorated function.
+        backoff (Backoff): A strategy to compute the time to wait between
+            attempts. Overrides delay.
+        using (str|list): A database alias or a list of aliases. Defaults to
+            the default database.
+        budget (RetryBudget): A budget shared with other functions. If it is
+            exhausted the exception is raised instead of retrying.
+        breaker (CircuitBreaker): A circuit breaker which raises
+            CircuitOpenError instead of calling the function after too many
+            consecutive retriable failures.
+        log_policy (LogPolicy): Decides how failed attempts are logged.
+        key (function): A function which is called with the arguments of the
+            decorated function and returns a hashable key, or None. Calls
+            with the same key run their transactions one at a time in this
+            process instead of racing each other in the database.
+        locks (StripedLock): The locks the keys are mapped to.
+        lock_name (function): A function which is called with the arguments
+            of the decorated function and returns the name of a NamedLock,
+            or None. Calls with the same name run their transactions one at
+            a time across all processes using the database.
+        lock_timeout (float): The time to wait for the named lock before
+            raising LockTimeout.
+        adaptive (AdaptiveRetry): Tunes the number of attempts and scales
+            the delays based on how often retries succeeded.
+        lock_wait_timeout (float): The time in seconds a statement waits for
+            a row lock. The previous value is restored after each attempt.
+        statement_timeout (float): The time in seconds a statement may run.
+            The previous value is restored after each attempt.
+        profile (bool): Profile the statements of each attempt and report
+            them to the metrics collectors.
     """
     return commit_on_success_with_isolation_level(
-        isolation_level_setup=set_mode_read_committed,
+        isolation_level_setup=partial(set_mode_read_committed, using=using),
         exceptions=exceptions,
         delay=delay,
         max_attempts=max_attempts,
+        backoff=backoff,
+        using=using,
+        budget=budget,
+        breaker=breaker,
+        log_policy=log_policy,
+        key=key,
+        locks=locks,
+        lock_name=lock_name,
+        lock_timeout=lock_timeout,
+        adaptive=adaptive,
+        lock_wait_timeout=lock_wait_timeout,
+        statement_timeout=statement_timeout,
+        profile=profile,
     )
 
 
 def repeatable_read_transactions(
-        exceptions_to_retry=DATABASE_EXCEPTIONS, delay=DELAY, max_attempts=MAX_ATTEMPTS,
+        exceptions_to_retry=None, delay=None, max_attempts=None, backoff=None, using=None,
+        budget=None, log_policy=None, key=None, locks=DEFAULT_LOCKS, lock_name=None,
+        lock_timeout=LOCK_TIMEOUT, lock_wait_timeout=None, statement_timeout=None, profile=False, func_path=None,
     ):
     """
     A generator which can be used to retry a block of code in case the block
@@ -201,10 +817,39 @@ def repeatable_read_transactions(
 
     Any open transactions are committed.
 
+    The exceptions, delay, max_attempts, backoff and log_policy default to
+    the DBUtilsConfig, which can also override them per function.
+
     Args:
-        exceptions_to_retry (tuple): A tuple of exceptions to catch.
+        exceptions_to_retry (tuple): A tuple of exceptions to catch or an
+            ExceptionClassifier.
         delay (float): Time to wait between attempts.
         max_attempts (int): Number of times to attempt the block.
+        backoff (Backoff): A strategy to compute the time to wait between
+            attempts. Overrides delay.
+        using (str|list): A database alias or a list of aliases. Defaults to
+            the default database.
+        budget (RetryBudget): A budget shared with other functions. If it is
+            exhausted the exception is raised instead of retrying.
+        log_policy (LogPolicy): Decides how failed attempts are logged.
+        key: A hashable key, e.g. the value of a unique column the block
+            writes. Blocks with the same key run their transactions one at a
+            time in this process.
+        locks (StripedLock): The locks the keys are mapped to.
+        lock_name (str): The name of a NamedLock. Blocks with the same name
+            run their transactions one at a time across all processes using
+            the database.
+        lock_timeout (float): The time to wait for the named lock before
+            raising LockTimeout.
+        lock_wait_timeout (float): The time in seconds a statement waits for
+            a row lock. The previous value is restored after each attempt.
+        statement_timeout (float): The time in seconds a statement may run.
+            The previous value is restored after each attempt.
+        profile (bool): Profile the statements of each attempt and report
+            them to the metrics collectors.
+        func_path (str): The path the options are overridden and the attempts
+            are reported under. Defaults to the function iterating over the
+            generator.
 
     Usage:
         for transaction_manager in repeatable_read_transactions(transactions_to_close=1):
@@ -212,14 +857,28 @@ def repeatable_read_transactions(
                 submission = Submission(user=user, text=text)
                 submission.save()
     """
+    func_path = func_path or get_caller_path()
+    options = get_config().get_retry_options(func_path, exceptions_to_retry, delay, max_attempts, backoff, log_policy)
+    context_manager, setup = locked_block_context_manager(
+        session_timeouts_context_manager(transaction_context_manager(using), using)
+        if lock_wait_timeout is not None or statement_timeout is not None else transaction_context_manager(using),
+        using, locks, key, lock_name, lock_timeout,
+        partial(
+            set_mode_repeatable_read, using=using, lock_wait_timeout=lock_wait_timeout, statement_timeout=statement_timeout
+        ),
+    )
     return exception_managers_until_success(
-        exceptions_to_retry=exceptions_to_retry, delay=delay, max_attempts=max_attempts,
-        context_manager=transaction_context_manager(), setup=set_mode_repeatable_read,
+        exceptions_to_retry=options.exceptions, delay=options.delay, max_attempts=options.max_attempts,
+        backoff=options.backoff, context_manager=context_manager, setup=setup,
+        reconnect=partial(close_connections, using=using), func_path=func_path, budget=budget,
+        log_policy=options.log_policy, profile=get_aliases(using) if profile else None,
     )
 
 
 def read_committed_transactions(
-        exceptions_to_retry=DATABASE_EXCEPTIONS, delay=DELAY, max_attempts=MAX_ATTEMPTS,
+        exceptions_to_retry=None, delay=None, max_attempts=None, backoff=None, using=None,
+        budget=None, log_policy=None, key=None, locks=DEFAULT_LOCKS, lock_name=None,
+        lock_timeout=LOCK_TIMEOUT, lock_wait_timeout=None, statement_timeout=None, profile=False, func_path=None,
     ):
     """
     A generator which can be used to retry a block of code in case the block
@@ -237,10 +896,39 @@ def read_committed_transactions(
 
     Any open transactions are committed.
 
+    The exceptions, delay, max_attempts, backoff and log_policy default to
+    the DBUtilsConfig, which can also override them per function.
+
     Args:
-        exceptions_to_retry (tuple): A tuple of exceptions to catch.
+        exceptions_to_retry (tuple): A tuple of exceptions to catch or an
+            ExceptionClassifier.
         delay (float): Time to wait between attempts.
         max_attempts (int): Number of times to attempt the block.
+        backoff (Backoff): A strategy to compute the time to wait between
+            attempts. Overrides delay.
+        using (str|list): A database alias or a list of aliases. Defaults to
+            the default database.
+        budget (RetryBudget): A budget shared with other functions. If it is
+            exhausted the exception is raised instead of retrying.
+        log_policy (LogPolicy): Decides how failed attempts are logged.
+        key: A hashable key, e.g. the value of a unique column the block
+            writes. Blocks with the same key run their transactions one at a
+            time in this process.
+        locks (StripedLock): The locks the keys are mapped to.
+        lock_name (str): The name of a NamedLock. Blocks with the same name
+            run their transactions one at a time across all processes using
+            the database.
+        lock_timeout (float): The time to wait for the named lock before
+            raising LockTimeout.
+        lock_wait_timeout (float): The time in seconds a statement waits for
+            a row lock. The previous value is restored after each attempt.
+        statement_timeout (float): The time in seconds a statement may run.
+            The previous value is restored after each attempt.
+        profile (bool): Profile the statements of each attempt and report
+            them to the metrics collectors.
+        func_path (str): The path the options are overridden and the attempts
+            are reported under. Defaults to the function iterating over the
+            generator.
 
     Usage:
         for transaction_manager in read_committed_transactions(transactions_to_close=1):
@@ -248,7 +936,240 @@ def read_committed_transactions(
                 submission = Submission(user=user, text=text)
                 submission.save()
     """
+    func_path = func_path or get_caller_path()
+    options = get_config().get_retry_options(func_path, exceptions_to_retry, delay, max_attempts, backoff, log_policy)
+    context_manager, setup = locked_block_context_manager(
+        session_timeouts_context_manager(transaction_context_manager(using), using)
+        if lock_wait_timeout is not None or statement_timeout is not None else transaction_context_manager(using),
+        using, locks, key, lock_name, lock_timeout,
+        partial(
+            set_mode_read_committed, using=using, lock_wait_timeout=lock_wait_timeout, statement_timeout=statement_timeout
+        ),
+    )
     return exception_managers_until_success(
-        exceptions_to_retry=exceptions_to_retry, delay=delay, max_attempts=max_attempts,
-        context_manager=transaction_context_manager(), setup=set_mode_read_committed,
+        exceptions_to_retry=options.exceptions, delay=options.delay, max_attempts=options.max_attempts,
+        backoff=options.backoff, context_manager=context_manager, setup=setup,
+        reconnect=partial(close_connections, using=using), func_path=func_path, budget=budget,
+        log_policy=options.log_policy, profile=get_aliases(using) if profile else None,
+    )
+
+
+def read_committed_chunks(queryset, chunk_size=CHUNK_SIZE, start_after=None, **kwargs):
+    """
+    A generator which iterates over the rows of a queryset in chunks, each
+    read in its own short READ COMMITTED transaction.
+
+    The rows are ordered by primary key and each chunk continues after the
+    last key of the previous one instead of using an OFFSET, so reading a
+    chunk costs the same at any depth and only one chunk is held in memory.
+    A queryset ordered by other fields raises a ValueError, the default
+    ordering of the model is replaced.
+
+    A chunk which raises a retriable exception is read again from the same
+    key. Unless exceptions_to_retry is given, lock wait timeouts, deadlocks
+    and lost connections are retried with MYSQL_READ_ERRORS instead of the
+    default exceptions of the DBUtilsConfig, which a read does not raise. No
+    transaction is open while the rows are processed, so each chunk sees the
+    rows committed before it was read.
+
+    The iteration can be resumed, e.g. after a crash, by passing the primary
+    key of the last processed row as start_after.
+
+    Any open transactions are committed before each chunk.
+
+    Args:
+        queryset (QuerySet): The rows to iterate over. It may only be
+            ordered by the primary key.
+        chunk_size (int): The number of rows read in one transaction.
+        start_after: Only iterate over the rows with a greater primary key.
+        kwargs: The retry options passed to read_committed_transactions, e.g.
+            exceptions_to_retry, max_attempts or statement_timeout. using
+            defaults to the database of the queryset.
+
+    Usage:
+        for submission in read_committed_chunks(Submission.objects.filter(graded=False), chunk_size=500):
+            grade(submission)
+    """
+    order_by = list(queryset.query.order_by)
+    if order_by and order_by not in (['pk'], [queryset.model._meta.pk.name]):  # pylint: disable=protected-access
+        raise ValueError('The rows are read in the order of the primary key, not of {0!r}.'.format(order_by))
+    func_path = kwargs.pop('func_path', None) or get_caller_path()
+    kwargs.setdefault('using', queryset.db)
+    if kwargs.get('exceptions_to_retry') is None:
+        kwargs['exceptions_to_retry'] = MYSQL_READ_ERRORS
+    queryset = queryset.order_by('pk')
+    last_pk = start_after
+    while True:
+        chunk_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        for transaction_manager in read_committed_transactions(func_path=func_path, **kwargs):
+            with transaction_manager:
+                rows = list(chunk_queryset[:chunk_size])
+
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        last_pk = rows[-1].pk
+
+
+def savepoint_transactions(
+        exceptions_to_retry=None, delay=None, max_attempts=None, backoff=None, using=None,
+        budget=None, log_policy=None, key=None, locks=DEFAULT_LOCKS, lock_name=None,
+        lock_timeout=LOCK_TIMEOUT, func_path=None,
+    ):
+    """
+    A generator which can be used to retry a block of code in case the block
+    raises IntegrityErrors, without committing open transactions.
+
+    Each attempt is run in a savepoint, which is rolled back if the attempt
+    fails. The isolation level is not changed, so the surrounding transaction
+    stays open and the block runs at its isolation level. Outside of a
+    transaction each attempt runs in its own transaction.
+
+    Lost connections are not reconnected. Inside a transaction, they and
+    MySQL deadlocks are raised instead of retried, because the surrounding
+    transaction is lost or rolled back with them, including its savepoints.
+
+    The exceptions, delay, max_attempts, backoff and log_policy default to
+    the DBUtilsConfig, which can also override them per function.
+
+    Args:
+        exceptions_to_retry (tuple): A tuple of exceptions to catch or an
+            ExceptionClassifier.
+        delay (float): Time to wait between attempts.
+        max_attempts (int): Number of times to attempt the block.
+        backoff (Backoff): A strategy to compute the time to wait between
+            attempts. Overrides delay.
+        using (str|list): A database alias or a list of aliases. Defaults to
+            the default database.
+        budget (RetryBudget): A budget shared with other functions. If it is
+            exhausted the exception is raised instead of retrying.
+        log_policy (LogPolicy): Decides how failed attempts are logged.
+        key: A hashable key, e.g. the value of a unique column the block
+            writes. Blocks with the same key run their transactions one at a
+            time in this process.
+        locks (StripedLock): The locks the keys are mapped to.
+        lock_name (str): The name of a NamedLock. Blocks with the same name
+            run their transactions one at a time across all processes using
+            the database.
+        lock_timeout (float): The time to wait for the named lock before
+            raising LockTimeout.
+        func_path (str): The path the options are overridden and the attempts
+            are reported under. Defaults to the function iterating over the
+            generator.
+
+    Usage:
+        with commit_on_success():
+            order = Order.objects.create(user=user)
+            for transaction_manager in savepoint_transactions():
+                with transaction_manager:
+                    Submission.objects.get_or_create(user=user, order=order)
+    """
+    func_path = func_path or get_caller_path()
+    options = get_config().get_retry_options(func_path, exceptions_to_retry, delay, max_attempts, backoff, log_policy)
+    exceptions = options.exceptions
+    if any(transaction.is_managed(using=alias) for alias in get_aliases(using)):
+        exceptions = SavepointClassifier(exceptions)
+    return exception_managers_until_success(
+        exceptions_to_retry=exceptions, delay=options.delay, max_attempts=options.max_attempts,
+        backoff=options.backoff,
+        context_manager=locked_block_context_manager(
+            partial(savepoint_context_manager, using=using), using, locks, key, lock_name, lock_timeout
+        )[0],
+        func_path=func_path, budget=budget, log_policy=options.log_policy,
+    )
+
+
+def commit_on_success_with_isolation_level_async(
+    isolation_level_setup, exceptions=None, delay=None, max_attempts=None, backoff=None,
+    using=None, budget=None, log_policy=None, executor=None,
+):
+    """
+    Decorator factory like commit_on_success_with_isolation_level, but the
+    decorated function returns a Future of its result right away.
+
+    The attempts run on the workers of an executor and the next attempt is
+    scheduled instead of sleeping, so the calling thread is not blocked.
+    The setup has to act on the connections of the worker, e.g. a partial
+    of set_mode_read_committed.
+
+    The exceptions, delay, max_attempts, backoff and log_policy default to
+    the DBUtilsConfig, which can also override them per function.
+
+    Args:
+        isolation_level_setup (function): A function to setup the
+            the isolation level.
+        exceptions (tuple): A tuple of exceptions to catch or an
+            ExceptionClassifier.
+        delay (float): Time to wait between attempts.
+        max_attempts (int): Number of times to attempt the decorated function.
+        backoff (Backoff): A strategy to compute the time to wait between
+            attempts. Overrides delay.
+        using (str|list): The database aliases to run commit_on_success on.
+        budget (RetryBudget): A budget shared with other functions.
+        log_policy (LogPolicy): Decides how failed attempts are logged.
+        executor (TransactionExecutor): The executor to run the attempts on.
+            Defaults to a shared one.
+    """
+
+    def decorator(func):
+
+        func_path = '{0}.{1}'.format(func.__module__, func.__name__)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):  # pylint: disable=missing-docstring
+            options = get_config().get_retry_options(func_path, exceptions, delay, max_attempts, backoff, log_policy)
+            return exception_managers_until_success_async(
+                partial(func, *args, **kwargs), exceptions_to_retry=options.classifier, delay=options.delay,
+                max_attempts=options.max_attempts, context_manager=transaction_context_manager(using),
+                setup=isolation_level_setup, backoff=options.backoff, reconnect=partial(close_connections, using=using),
+                func_path=func_path, budget=budget, log_policy=options.log_policy, executor=executor,
+            )
+
+        return wrapper
+    return decorator
+
+
+def read_committed_transactions_async(
+        block, exceptions_to_retry=None, delay=None, max_attempts=None, backoff=None,
+        using=None, budget=None, log_policy=None, executor=None,
+    ):
+    """
+    Run block in READ COMMITTED transactions on a worker of an executor until
+    it does not raise any exceptions from the exceptions_to_retry tuple and
+    return a Future of its result.
+
+    This is the counterpart of read_committed_transactions which does not
+    block the calling thread, neither during the queries nor between
+    attempts.
+
+    The exceptions, delay, max_attempts, backoff and log_policy default to
+    the DBUtilsConfig, which can also override them per function.
+
+    Args:
+        block (function): The function to call in each attempt.
+        exceptions_to_retry (tuple): A tuple of exceptions to catch or an
+            ExceptionClassifier.
+        delay (float): Time to wait between attempts.
+        max_attempts (int): Number of times to attempt the block.
+        backoff (Backoff): A strategy to compute the time to wait between
+            attempts. Overrides delay.
+        using (str|list): A database alias or a list of aliases. Defaults to
+            the default database.
+        budget (RetryBudget): A budget shared with other functions.
+        log_policy (LogPolicy): Decides how failed attempts are logged.
+        executor (TransactionExecutor): The executor to run the attempts on.
+            Defaults to a shared one.
+
+    Usage:
+        future = read_committed_transactions_async(partial(Submission.objects.create, user=user, text=text))
+        future.add_done_callback(on_submitted)
+    """
+    func_path = get_caller_path()
+    options = get_config().get_retry_options(func_path, exceptions_to_retry, delay, max_attempts, backoff, log_policy)
+    return exception_managers_until_success_async(
+        block, exceptions_to_retry=options.exceptions, delay=options.delay, max_attempts=options.max_attempts,
+        backoff=options.backoff, context_manager=transaction_context_manager(using),
+        setup=partial(set_mode_read_committed, using=using), reconnect=partial(close_connections, using=using),
+        func_path=func_path, budget=budget, log_policy=options.log_policy, executor=executor,
     )
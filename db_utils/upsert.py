@@ -0,0 +1,250 @@
+"""
+This module implements get_or_create without races or retries.
+
+Model.objects.get_or_create() runs a SELECT and an INSERT. If two
+transactions create the same row between them, one gets an IntegrityError,
+rolls back, waits and retries. safe_get_or_create() instead inserts the row
+with a statement which skips rows violating a unique key, INSERT IGNORE on
+MySQL and INSERT ... ON CONFLICT DO NOTHING on PostgreSQL and SQLite, and
+only reads the existing row if nothing was inserted:
+
+    user, created = safe_get_or_create(User, username=username, defaults={'email': email})
+
+safe_get_or_create_many() does the same for many rows with one INSERT and
+one SELECT per batch:
+
+    tags = safe_get_or_create_many(Tag, [{'name': name} for name in names], key_fields=['name'])
+
+The lookup or the key fields have to cover a unique key of the table. On
+other databases and older versions the rows are got or created with
+get_or_create() in retried READ COMMITTED transactions.
+
+INSERT IGNORE also turns other errors, e.g. missing values of NOT NULL
+columns, into warnings, so the rows should be complete.
+"""
+from django.db import connections, transaction, IntegrityError, DEFAULT_DB_ALIAS
+from django.db.models import AutoField, Q
+
+from transaction import read_committed_transactions
+from utils import get_caller_path
+
+
+def upsert_supported(using):
+    """
+    Return whether the database using can insert rows skipping the ones
+    violating a unique key, i.e. MySQL, PostgreSQL 9.5 or SQLite 3.24 and
+    later.
+    """
+    connection = connections[using]
+    if connection.vendor == 'mysql':
+        return True
+    if connection.vendor == 'postgresql':
+        connection.cursor()
+        return connection.pg_version >= 90500
+    if connection.vendor == 'sqlite':
+        from django.db.backends.sqlite3.base import Database
+        return Database.sqlite_version_info >= (3, 24, 0)
+    return False
+
+
+def get_insert_fields(model, objs):
+    """
+    Return the fields which are inserted for the instances of model.
+
+    The auto-incremented primary key is only inserted if it is set on all
+    instances.
+    """
+    if model._meta.parents:  # pylint: disable=protected-access
+        raise ValueError('Models with parents are not supported.')
+    return [
+        field for field in model._meta.local_fields  # pylint: disable=protected-access
+        if not isinstance(field, AutoField) or all(obj.pk is not None for obj in objs)
+    ]
+
+
+def get_insert_sql(connection, model, fields, rows):
+    """
+    Return the statement inserting rows rows into the table of model which
+    skips the rows violating a unique key.
+    """
+    quote_name = connection.ops.quote_name
+    values = ', '.join(['({0})'.format(', '.join(['%s'] * len(fields)))] * rows)
+    sql = '{0} INTO {1} ({2}) VALUES {3}'.format(
+        'INSERT IGNORE' if connection.vendor == 'mysql' else 'INSERT',
+        quote_name(model._meta.db_table),  # pylint: disable=protected-access
+        ', '.join(quote_name(field.column) for field in fields),
+        values,
+    )
+    if connection.vendor != 'mysql':
+        sql += ' ON CONFLICT DO NOTHING'
+    return sql
+
+
+def insert_ignore(connection, model, objs):
+    """
+    Insert the instances of model, skipping the ones violating a unique key,
+    and return the cursor.
+    """
+    fields = get_insert_fields(model, objs)
+    sql = get_insert_sql(connection, model, fields, len(objs))
+    if len(objs) == 1 and connection.vendor == 'postgresql':
+        sql += ' RETURNING {0}'.format(connection.ops.quote_name(model._meta.pk.column))  # pylint: disable=protected-access
+    params = [
+        field.get_db_prep_save(field.pre_save(obj, True), connection=connection)
+        for obj in objs for field in fields
+    ]
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+    except Warning:
+        # With DEBUG on, Django turns the warnings of MySQLdb into exceptions,
+        # e.g. the one about the ignored duplicate. They are raised after the
+        # statement completed, so the row count is still set.
+        if connection.vendor != 'mysql':
+            raise
+    return cursor
+
+
+def get_existing(model, using, **kwargs):
+    """
+    Return the instance of model matching kwargs.
+
+    In a transaction on MySQL the row is read with a locking read, which
+    sees the rows committed after the snapshot of a REPEATABLE READ
+    transaction was taken.
+    """
+    queryset = model._default_manager.db_manager(using).filter(**kwargs)  # pylint: disable=protected-access
+    if connections[using].vendor == 'mysql' and transaction.is_managed(using=using):
+        queryset = queryset.select_for_update()
+    try:
+        return queryset.get()
+    except model.DoesNotExist:
+        raise IntegrityError('The row violating a unique key of {0} does not match {1!r}.'.format(
+            model._meta.db_table, kwargs  # pylint: disable=protected-access
+        ))
+
+
+def set_saved(obj, using):
+    """
+    Mark an instance as saved in the database using.
+    """
+    obj._state.adding = False  # pylint: disable=protected-access
+    obj._state.db = using  # pylint: disable=protected-access
+
+
+def safe_get_or_create(model, using=None, defaults=None, **kwargs):
+    """
+    Return a tuple of the instance of model matching kwargs, which is
+    created if it does not exist, and whether it was created.
+
+    Unlike get_or_create() it does not raise an IntegrityError if another
+    transaction creates the row concurrently. The kwargs have to cover a
+    unique key. If the row exists it costs one INSERT and one SELECT, if not
+    only the INSERT.
+
+    Args:
+        model (Model): The model of the instance.
+        using (str): The database alias. Defaults to the default database.
+        defaults (dict): The values of the other fields of a new instance.
+        kwargs: The lookups of the instance. Lookups containing '__' are not
+            set on a new instance.
+
+    Usage:
+        user, created = safe_get_or_create(User, username=username, defaults={'email': email})
+    """
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    if not upsert_supported(using):
+        for transaction_manager in read_committed_transactions(using=using, func_path=get_caller_path()):
+            with transaction_manager:
+                result = model._default_manager.db_manager(using).get_or_create(  # pylint: disable=protected-access
+                    defaults=defaults or {}, **kwargs
+                )
+        return result
+
+    values = dict((name, value) for name, value in kwargs.iteritems() if '__' not in name)
+    values.update(defaults or {})
+    obj = model(**values)
+    cursor = insert_ignore(connection, model, [obj])
+    if connection.vendor == 'postgresql':
+        row = cursor.fetchone()
+        created = row is not None
+        if created and obj.pk is None:
+            obj.pk = row[0]
+    else:
+        created = cursor.rowcount == 1
+        if created and obj.pk is None:
+            obj.pk = cursor.lastrowid
+    transaction.commit_unless_managed(using=using)
+
+    if not created:
+        return get_existing(model, using, **kwargs), False
+    set_saved(obj, using)
+    return obj, True
+
+
+def safe_get_or_create_many(model, rows, key_fields, using=None):
+    """
+    Return a list of the instances of model with the values of the dicts of
+    rows, in the same order, creating the ones which do not exist.
+
+    Unlike get_or_create() it does not raise an IntegrityError if another
+    transaction creates the rows concurrently. The rows are inserted with
+    one INSERT per batch, skipping the existing ones, and read with one
+    SELECT per batch. Whether a row was created is not known.
+
+    Args:
+        model (Model): The model of the instances.
+        rows (list): A list of dicts of field values.
+        key_fields (list): The names of the fields of a unique key. The
+            existing instances are matched to the rows by their values.
+        using (str): The database alias. Defaults to the default database.
+
+    Usage:
+        tags = safe_get_or_create_many(Tag, [{'name': name} for name in names], key_fields=['name'])
+    """
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    if not upsert_supported(using):
+        func_path = get_caller_path()
+        results = []
+        for row in rows:
+            lookup = dict((name, row[name]) for name in key_fields)
+            defaults = dict((name, value) for name, value in row.iteritems() if name not in key_fields)
+            for transaction_manager in read_committed_transactions(using=using, func_path=func_path):
+                with transaction_manager:
+                    obj, __ = model._default_manager.db_manager(using).get_or_create(  # pylint: disable=protected-access
+                        defaults=defaults, **lookup
+                    )
+            results.append(obj)
+        return results
+
+    objs = [model(**row) for row in rows]
+    if not objs:
+        return []
+    batch_size = max(connection.ops.bulk_batch_size(get_insert_fields(model, objs), objs), 1)
+    for start in xrange(0, len(objs), batch_size):
+        insert_ignore(connection, model, objs[start:start + batch_size])
+    transaction.commit_unless_managed(using=using)
+
+    attnames = [model._meta.get_field(name).attname for name in key_fields]  # pylint: disable=protected-access
+    keys = list(set(tuple(getattr(obj, attname) for attname in attnames) for obj in objs))
+    existing = {}
+    batch_size = max(connection.ops.bulk_batch_size(attnames, keys), 1)
+    manager = model._default_manager.db_manager(using)  # pylint: disable=protected-access
+    for start in xrange(0, len(keys), batch_size):
+        query = Q()
+        for key in keys[start:start + batch_size]:
+            query |= Q(**dict(zip(attnames, key)))
+        for obj in manager.filter(query):
+            existing[tuple(getattr(obj, attname) for attname in attnames)] = obj
+
+    results = []
+    for obj in objs:
+        key = tuple(getattr(obj, attname) for attname in attnames)
+        if key not in existing:
+            raise IntegrityError('The row violating a unique key of {0} does not match {1!r}.'.format(
+                model._meta.db_table, dict(zip(key_fields, key))  # pylint: disable=protected-access
+            ))
+        results.append(existing[key])
+    return results
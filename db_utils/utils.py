@@ -6,6 +6,16 @@ import logging
 import sys
 import time
 
+from functools import partial
+
+from backoff import get_backoff
+from errors import ExceptionClassifier, FAIL, RECONNECT
+from executor import get_default_executor, Future
+from log_policy import DEFAULT_LOG_POLICY
+from metrics import record_attempt, record_sleep
+from profiler import profiled
+from watchdog import watched
+
 
 log = logging.getLogger(__name__)
 
@@ -32,35 +42,150 @@ class ExceptionManager(object):
     called in the time_block context manager. If post_data or the
     time_block context manager raises a ConnectionError, exception_manager.success
     will be False. Otherwise, it will be True.
+
+    A manager can be reused for another block after calling reset().
     """
-    def __init__(self, exceptions_to_suppress=(), setup=None, context_manager=None):
+    __slots__ = (
+        'success', 'exc_info', 'action', 'exception', 'started', 'duration', 'setup_duration', 'commit_duration',
+        'attempt', 'on_exit', 'setup', 'context_manager', 'sub_context_manager', 'exceptions_to_suppress',
+        'classifier', 'exceptions_to_catch', 'func_path', 'profile',
+    )
+
+    def __init__(self, exceptions_to_suppress=(), setup=None, context_manager=None, on_exit=None, func_path=None,
+                 profile=None):
         """
         Create the context manager.
 
         Args:
             exceptions_to_suppress (tuple): A tuple of exceptions to suppress. If
                 any of these exceptions are raised, self.success is set to False.
+                An ExceptionClassifier can be passed instead, in which case
+                the exceptions it does not classify as FAIL are suppressed.
             setup (function): A function to execute when entering context.
-            context_manager: A context manager to wrap the block in.
+            context_manager: A function which creates a context manager to
+                wrap the block in. It is called when entering the context.
+            on_exit (function): A function which is called with the
+                ExceptionManager when leaving the context, e.g. to record
+                the durations and the exception.
+            func_path (str): The path under which the context manager is
+                registered with the TransactionWatchdog, if one is installed,
+                and its statements are profiled.
+            profile (list): The database aliases whose statements are
+                profiled while the context manager is open, or None.
+        """
+        self.attempt = 1
+        self.func_path = func_path
+        self.profile = profile
+        self.on_exit = on_exit
+        self.setup = setup
+        self.context_manager = context_manager
+        self.set_exceptions(exceptions_to_suppress)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the outcome of the last block, so the manager can be reused.
         """
         self.success = False
         self.exc_info = None
+        self.action = None
+        self.exception = None
+        self.started = None
+        self.duration = 0
+        self.setup_duration = 0
+        self.commit_duration = 0
+        self.sub_context_manager = None
+
+    def set_exceptions(self, exceptions_to_suppress):
+        """
+        Set the tuple of exceptions or the ExceptionClassifier which decides
+        which exceptions are suppressed.
+        """
         self.exceptions_to_suppress = exceptions_to_suppress
-        self.setup = setup
-        self.sub_context_manager = context_manager() if context_manager else None
+        if isinstance(exceptions_to_suppress, ExceptionClassifier):
+            self.classifier = exceptions_to_suppress
+            self.exceptions_to_catch = exceptions_to_suppress.exceptions
+        else:
+            self.classifier = None
+            self.exceptions_to_catch = exceptions_to_suppress
+
+    def classify(self, exc_value):
+        """
+        Return True if a caught exception should be suppressed and record the
+        action of the classifier.
+        """
+        if self.classifier is None:
+            return True
+        self.action = self.classifier.classify(exc_value)
+        return self.action != FAIL
     
+    def clear_traceback(self):
+        """
+        Drop the traceback of the suppressed exception, which references the
+        frames of the block, once it is no longer needed.
+        """
+        if self.exc_info is not None:
+            self.exc_info = (self.exc_info[0], self.exc_info[1], None)
+
     def __enter__(self):
-        if self.setup:
+        self.started = time.time()
+        if self.setup is not None:
             self.setup()
-        if self.sub_context_manager:
+            self.setup_duration = time.time() - self.started
+        if self.context_manager is not None:
+            self.sub_context_manager = watched(
+                profiled(self.context_manager(), self.profile, self.func_path, self.attempt),
+                self.func_path, self.attempt,
+            )
             self.sub_context_manager.__enter__()
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None and self.sub_context_manager is None:
+            # Nothing can go wrong without an exception or a context manager.
+            self.success = True
+            self.finish(None)
+            return None
+
+        try:
+            suppressed = self.exit_block(exc_type, exc_value, exc_traceback)
+        except:
+            exc_info = sys.exc_info()
+            self.finish(exc_info[0])
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        if self.success:
+            self.finish(None)
+        else:
+            self.finish(self.exc_info[0] if self.exc_info else exc_type)
+        return suppressed
+
+    def finish(self, exception):
+        """
+        Record the duration and the exception of the block and call on_exit.
+        """
+        self.duration = time.time() - self.started
+        self.exception = exception
+        if self.on_exit is not None:
+            self.on_exit(self)
+
+    def exit_block(self, exc_type, exc_value, exc_traceback):
+        """
+        Exit the sub context manager and return True if the exception should
+        be suppressed.
+        """
         if self.sub_context_manager:
             try:
-                sub_context_manager_suppressed = self.sub_context_manager.__exit__(exc_type, exc_value, exc_traceback)
-            except self.exceptions_to_suppress:
+                exit_started = time.time()
+                try:
+                    sub_context_manager_suppressed = self.sub_context_manager.__exit__(
+                        exc_type, exc_value, exc_traceback
+                    )
+                finally:
+                    self.commit_duration = time.time() - exit_started
+            except self.exceptions_to_catch:
+                if not self.classify(sys.exc_info()[1]):
+                    raise
                 self.exc_info = sys.exc_info()
                 return True  # Supress it.
             # If the sub_context_manager raises any other exception let it propogate.
@@ -70,7 +195,12 @@ class ExceptionManager(object):
                     return True   # Suppress it.
 
         if exc_type:
-            if exc_type in self.exceptions_to_suppress:
+            if self.classifier is None:
+                suppress = exc_type in self.exceptions_to_suppress
+            else:
+                suppress = issubclass(exc_type, self.exceptions_to_catch) and self.classify(exc_value)
+
+            if suppress:
                 self.exc_info = (exc_type, exc_value, exc_traceback)
                 return True  # Suppress it.
             else:
@@ -79,7 +209,45 @@ class ExceptionManager(object):
         self.success = True
 
 
-def exception_managers_until_success(exceptions_to_retry=(), delay=0, max_attempts=3, context_manager=None, setup=None):
+def get_caller_path(depth=1):
+    """
+    Return the path (module.function) of the function which called the
+    caller of this function, or of a function further up the stack.
+
+    For a generator this is the function which iterates over it.
+    """
+    frame = sys._getframe(depth + 1)  # pylint: disable=protected-access
+    return '{0}.{1}'.format(frame.f_globals.get('__name__'), frame.f_code.co_name)
+
+
+def record_exception_manager(func_path, exception_manager):
+    """
+    Report an attempt wrapped by an ExceptionManager to the metrics collectors.
+    """
+    record_attempt(
+        func_path, exception_manager.attempt, exception_manager.duration, exception_manager.setup_duration,
+        exception_manager.commit_duration, exception_manager.exception,
+    )
+
+
+def get_retry_delay(schedule, attempt, budget, log_policy, func_path, exc_info):
+    """
+    Return the time to wait before the next attempt, or None and log the
+    failure if the deadline is exceeded or the budget is exhausted.
+    """
+    wait = schedule.next_delay(attempt)
+    if wait is None:
+        log_policy.log_failure(log, func_path, attempt, exc_info, 'Deadline exceeded. ')
+    elif budget is not None and not budget.withdraw():
+        log_policy.log_failure(log, func_path, attempt, exc_info, 'Retry budget exhausted. ')
+        wait = None
+    return wait
+
+
+def exception_managers_until_success(
+    exceptions_to_retry=(), delay=0, max_attempts=3, context_manager=None, setup=None, backoff=None,
+    reconnect=None, func_path=None, budget=None, log_policy=DEFAULT_LOG_POLICY, profile=None,
+):
     """
     A generator which can be used to retry a block of code in case the block
     raises an exception.
@@ -91,12 +259,26 @@ def exception_managers_until_success(exceptions_to_retry=(), delay=0, max_attemp
     No exceptions are caught in the last attempt.
 
     Args:
-        exceptions (tuple): A tuple of exceptions to catch and retry on.
+        exceptions (tuple): A tuple of exceptions to catch and retry on or an
+            ExceptionClassifier.
         delay (float): Time to wait between attempts.
         max_attempts (int): Number of times to attempt the block.
         context_manager: A context manager to wrap the block in. Exceptions
             raised by the context_manager also result in a retry.
         setup (func): A func to call before executing the block.
+        backoff (Backoff): A strategy to compute the time to wait between
+            attempts. If it is not set, delay seconds are waited. If the
+            deadline of the strategy is exceeded the last exception is raised.
+        reconnect (func): A func to call before the next attempt if the
+            classifier returned RECONNECT.
+        func_path (str): The path under which the attempts are reported to
+            the metrics collectors. Defaults to the function iterating over
+            the generator.
+        budget (RetryBudget): A budget shared with other blocks. If it is
+            exhausted the last exception is raised instead of retrying.
+        log_policy (LogPolicy): Decides how failed attempts are logged.
+        profile (list): The database aliases whose statements are profiled
+            per attempt and reported to the metrics collectors, or None.
 
     Usage:
         for exception_manager in exception_managers_until_success(exceptions=(DatabaseError,), retries=3):
@@ -106,15 +288,137 @@ def exception_managers_until_success(exceptions_to_retry=(), delay=0, max_attemp
 
     In case there are any DatabaseErrors, the block will be tried up to 3 times.
     """
+    if func_path is None:
+        func_path = get_caller_path()
+
+    if budget is not None:
+        budget.deposit()
+
+    schedule = get_backoff(backoff, delay).start()
+    # One manager is reused for all attempts.
+    exception_manager = ExceptionManager(
+        exceptions_to_retry, setup, context_manager, partial(record_exception_manager, func_path), func_path, profile
+    )
     for attempt in xrange(1, max_attempts + 1):
-        if attempt < max_attempts:
-            exception_manager = ExceptionManager(exceptions_to_retry, setup, context_manager)
-        else:
-            exception_manager = ExceptionManager((), setup, context_manager)
+        if attempt > 1:
+            exception_manager.reset()
+            exception_manager.attempt = attempt
+        if attempt == max_attempts:
+            exception_manager.set_exceptions(())
         yield exception_manager
         if exception_manager.success is True:
             return
 
-        log.error('Error on attempt %d. Retrying.', attempt, exc_info=exception_manager.exc_info)
-        if delay:
-            time.sleep(delay)
+        wait = get_retry_delay(schedule, attempt, budget, log_policy, func_path, exception_manager.exc_info)
+        if wait is None:
+            exc_type, exc_value, exc_traceback = exception_manager.exc_info
+            raise exc_type, exc_value, exc_traceback
+
+        log_policy.log_retry(log, func_path, attempt, exception_manager.exc_info, wait)
+        exception_manager.clear_traceback()
+        # Python 2 keeps an exception suppressed by a with statement as the
+        # current exception of the thread until the calling function returns,
+        # and the current exception at this point is the suppressed one.
+        sys.exc_clear()
+        if exception_manager.action == RECONNECT and reconnect:
+            reconnect()
+        if wait:
+            record_sleep(func_path, wait)
+            time.sleep(wait)
+
+
+def exception_managers_until_success_async(
+    block, exceptions_to_retry=(), delay=0, max_attempts=3, context_manager=None, setup=None, backoff=None,
+    reconnect=None, func_path=None, budget=None, log_policy=DEFAULT_LOG_POLICY, executor=None,
+):
+    """
+    Run block on a worker of an executor until it does not raise any
+    exceptions from the exceptions_to_retry tuple and return a Future of its
+    result.
+
+    Each attempt is wrapped in an ExceptionManager like the attempts of
+    exception_managers_until_success, but the time between attempts is not
+    slept away. The next attempt is scheduled on the executor instead, so
+    neither the calling thread nor a worker is blocked.
+
+    Args:
+        block (function): The function to call in each attempt.
+        exceptions_to_retry (tuple): A tuple of exceptions to catch and retry
+            on or an ExceptionClassifier.
+        delay (float): Time to wait between attempts.
+        max_attempts (int): Number of times to attempt the block.
+        context_manager: A context manager to wrap the block in.
+        setup (func): A func to call before executing the block.
+        backoff (Backoff): A strategy to compute the time to wait between
+            attempts. Overrides delay.
+        reconnect (func): A func to call on the worker if the classifier
+            returned RECONNECT.
+        func_path (str): The path under which the attempts are reported to
+            the metrics collectors. Defaults to the calling function.
+        budget (RetryBudget): A budget shared with other blocks.
+        log_policy (LogPolicy): Decides how failed attempts are logged.
+        executor (TransactionExecutor): The executor to run the attempts on.
+            Defaults to a shared one.
+
+    Usage:
+        future = exception_managers_until_success_async(
+            partial(post_data, data), exceptions_to_retry=(ConnectionError,)
+        )
+        future.add_done_callback(on_posted)
+    """
+    if func_path is None:
+        func_path = get_caller_path()
+    if executor is None:
+        executor = get_default_executor()
+
+    if budget is not None:
+        budget.deposit()
+
+    schedule = get_backoff(backoff, delay).start()
+    future = Future()
+    # The attempts run one after another, so they can share a manager.
+    exception_manager = ExceptionManager(
+        exceptions_to_retry, setup, context_manager, partial(record_exception_manager, func_path), func_path
+    )
+
+    def run_attempt(attempt):
+        """
+        Run an attempt and finish the future or schedule the next attempt.
+        """
+        exception_manager.reset()
+        exception_manager.attempt = attempt
+        if attempt == max_attempts:
+            exception_manager.set_exceptions(())
+        result = None
+        try:
+            with exception_manager:
+                result = block()
+        except:
+            future.set_exception(sys.exc_info())
+            return
+
+        if exception_manager.success is True:
+            future.set_result(result)
+            return
+
+        try:
+            wait = get_retry_delay(schedule, attempt, budget, log_policy, func_path, exception_manager.exc_info)
+            if wait is None:
+                future.set_exception(exception_manager.exc_info)
+                return
+
+            log_policy.log_retry(log, func_path, attempt, exception_manager.exc_info, wait)
+            exception_manager.clear_traceback()
+            if exception_manager.action == RECONNECT and reconnect:
+                # This closes the connections of this worker, which are the
+                # ones which were lost.
+                reconnect()
+            if wait:
+                record_sleep(func_path, wait)
+            executor.call_later(wait, run_attempt, attempt + 1, future=future)
+        except:
+            # E.g. a failing reconnect or an executor which is shut down.
+            future.set_exception(sys.exc_info())
+
+    executor.call_later(0, run_attempt, 1)
+    return future
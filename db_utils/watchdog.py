@@ -0,0 +1,223 @@
+"""
+This module implements a watchdog which flags transactions that stay open
+for too long.
+
+Long transactions at REPEATABLE READ keep InnoDB from purging its undo
+history, which slows down the queries of everybody else. The watchdog is
+installed process wide:
+
+    install_watchdog(TransactionWatchdog(threshold=5, callbacks=[report_to_sentry]))
+
+From then on the transactions of the decorators and the ExceptionManagers
+are registered when they start and unregistered when they finish. A daemon
+thread checks every interval seconds for transactions which have been open
+for longer than threshold seconds. Each of them is flagged once: it is
+logged, reported to the metrics collectors and passed to the callbacks as a
+LongTransaction.
+"""
+from collections import namedtuple
+import itertools
+import logging
+import threading
+import time
+
+from metrics import record_long_transaction
+
+
+log = logging.getLogger(__name__)
+
+LongTransaction = namedtuple('LongTransaction', 'func_path thread_id thread_name attempt started duration')
+
+_watchdog = None
+
+
+class WatchedTransaction(object):
+    """
+    A transaction which is open.
+    """
+    __slots__ = ('func_path', 'thread_id', 'thread_name', 'attempt', 'started', 'flagged')
+
+    def __init__(self, func_path, attempt):
+        thread = threading.current_thread()
+        self.func_path = func_path
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+        self.attempt = attempt
+        self.started = time.time()
+        self.flagged = False
+
+
+class TransactionWatchdog(object):
+    """
+    A thread-safe registry of the open transactions and a thread which flags
+    the long ones.
+    """
+    def __init__(self, threshold=10, interval=1, callbacks=()):
+        """
+        Create the watchdog. The thread is started with the first transaction.
+
+        Args:
+            threshold (float): The time in seconds after which an open
+                transaction is flagged.
+            interval (float): The time in seconds between two checks.
+            callbacks (list): Functions which are called with the
+                LongTransaction of each flagged transaction.
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.callbacks = list(callbacks)
+        self.lock = threading.Lock()
+        self.tokens = itertools.count()
+        self.transactions = {}
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def watch(self, func_path, attempt):
+        """
+        Register a transaction which starts now and return its token.
+        """
+        if self.thread is None:
+            self.start()
+        # Taking the next token and setting or popping a key of a dict are
+        # atomic, so registering does not need the lock.
+        token = next(self.tokens)
+        self.transactions[token] = WatchedTransaction(func_path, attempt)
+        return token
+
+    def unwatch(self, token):
+        """
+        Unregister the transaction of token, which finished.
+        """
+        self.transactions.pop(token, None)
+
+    def check(self, now=None):
+        """
+        Flag the transactions which have been open for longer than the
+        threshold and were not flagged yet, and return their LongTransactions.
+        """
+        if now is None:
+            now = time.time()
+        flagged = []
+        for transaction in self.transactions.values():
+            duration = now - transaction.started
+            if transaction.flagged or duration <= self.threshold:
+                continue
+            transaction.flagged = True
+            flagged.append(LongTransaction(
+                transaction.func_path, transaction.thread_id, transaction.thread_name, transaction.attempt,
+                transaction.started, duration,
+            ))
+
+        for long_transaction in flagged:
+            self.flag(long_transaction)
+        return flagged
+
+    def flag(self, long_transaction):
+        """
+        Log a long transaction, report it to the metrics collectors and call
+        the callbacks with it.
+        """
+        log.warning(
+            'Transaction of %s (attempt %d) in thread %s (%s) has been open for %.1f seconds.',
+            long_transaction.func_path, long_transaction.attempt, long_transaction.thread_name,
+            long_transaction.thread_id, long_transaction.duration,
+        )
+        record_long_transaction(long_transaction.func_path, long_transaction.attempt, long_transaction.duration)
+        for callback in self.callbacks:
+            try:
+                callback(long_transaction)
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Long transaction callback failed.')
+
+    def start(self):
+        """
+        Start the thread which checks the transactions.
+        """
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name='db_utils-watchdog')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        """
+        Check the transactions every interval seconds until stopped.
+        """
+        while not self.stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Checking the transactions failed.')
+
+    def stop(self):
+        """
+        Stop the thread. It is started again by the next transaction.
+        """
+        with self.lock:
+            thread, self.thread = self.thread, None
+            self.stopped.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+
+class WatchedContextManager(object):
+    """
+    A context manager which wraps another one, e.g. commit_on_success, and
+    registers the transaction with the watchdog while it is open.
+    """
+    __slots__ = ('context_manager', 'watchdog', 'func_path', 'attempt', 'token')
+
+    def __init__(self, context_manager, watchdog, func_path, attempt):
+        self.context_manager = context_manager
+        self.watchdog = watchdog
+        self.func_path = func_path
+        self.attempt = attempt
+        self.token = None
+
+    def __enter__(self):
+        result = self.context_manager.__enter__()
+        self.token = self.watchdog.watch(self.func_path, self.attempt)
+        return result
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        try:
+            return self.context_manager.__exit__(exc_type, exc_value, exc_traceback)
+        finally:
+            self.watchdog.unwatch(self.token)
+
+
+def watched(context_manager, func_path, attempt):
+    """
+    Return context_manager wrapped in a WatchedContextManager if a watchdog
+    is installed, or context_manager.
+    """
+    watchdog = _watchdog
+    if watchdog is None:
+        return context_manager
+    return WatchedContextManager(context_manager, watchdog, func_path, attempt)
+
+
+def install_watchdog(watchdog):
+    """
+    Install a TransactionWatchdog process wide, replacing the current one.
+    """
+    global _watchdog  # pylint: disable=global-statement
+    previous, _watchdog = _watchdog, watchdog
+    if previous is not None and previous is not watchdog:
+        previous.stop()
+
+
+def uninstall_watchdog():
+    """
+    Stop and uninstall the current TransactionWatchdog.
+    """
+    install_watchdog(None)
+
+
+def get_watchdog():
+    """
+    Return the installed TransactionWatchdog or None.
+    """
+    return _watchdog
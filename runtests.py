@@ -21,6 +21,14 @@ DEFAULT_SETTINGS = dict(
             "PORT": "3306",
             "USER": "dbutils"
         },
+        "other": {
+            "ENGINE": "django.db.backends.mysql",
+            "HOST": "localhost",
+            "NAME": "dbutils_other",
+            "PASSWORD": "password",
+            "PORT": "3306",
+            "USER": "dbutils"
+        },
     }
 )
 